@@ -0,0 +1,129 @@
+"""Content hashed copies of the stylesheets and scripts of the site."""
+import logging
+import re
+
+from pathlib import Path
+
+from .catalog import STATE_DIR_NAME
+from .catalog import read_state_file
+from .catalog import write_state_file
+from .compress import ASSET_DIRS
+from .compress import remove_sidecars
+from .compress import write_atomic
+from .media_store import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+# Assets given a content hashed copy, fonts keep their names as stylesheets refer to them
+FINGERPRINT_SUFFIXES = {".css", ".js"}
+
+# The number of hex digits of the content hash in a file name
+HASH_LENGTH = 12
+
+# The state file mapping each asset URL to the URL of its hashed copy
+MANIFEST_NAME = "assets.json"
+
+MANIFEST_VERSION = 1
+
+_FINGERPRINTED = re.compile(rf"^.+\.[0-9a-f]{{{HASH_LENGTH}}}\.\w+$")
+
+# The asset URLs of the site this process builds or serves, see use_assets
+_asset_urls: dict[str, str] = {}
+
+
+def is_fingerprinted(name: str) -> bool:
+    """Check whether a file is the content hashed copy of an asset.
+
+    Args:
+        name: The file name.
+
+    Returns:
+        True for names such as site.0123456789ab.css.
+    """
+    return _FINGERPRINTED.match(name) is not None
+
+
+def _manifest_path(site_dir: Path) -> Path:
+    """Get the asset manifest of a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The manifest path in the site state directory.
+    """
+    return site_dir / STATE_DIR_NAME / MANIFEST_NAME
+
+
+def fingerprint_assets(site_dir: Path) -> dict[str, str]:
+    """Write a content hashed copy of each stylesheet and script.
+
+    Copies of older versions are removed, and the manifest is written
+    and used for the pages rendered by this process.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The URL of each hashed copy by the URL of its asset.
+    """
+    urls: dict[str, str] = {}
+    current: set[Path] = set()
+    for name in ASSET_DIRS:
+        asset_dir = site_dir / name
+        if not asset_dir.is_dir():
+            continue
+        for path in sorted(asset_dir.iterdir()):
+            if path.suffix not in FINGERPRINT_SUFFIXES or is_fingerprinted(path.name):
+                continue
+            digest = hash_file(path)[:HASH_LENGTH]
+            copy = path.with_name(f"{path.stem}.{digest}{path.suffix}")
+            if not copy.exists():
+                write_atomic(copy, path.read_bytes())
+            current.add(copy)
+            urls[
+                f"/{path.relative_to(site_dir).as_posix()}"
+            ] = f"/{copy.relative_to(site_dir).as_posix()}"
+        for path in asset_dir.iterdir():
+            if is_fingerprinted(path.name) and path not in current:
+                path.unlink()
+                remove_sidecars(path)
+    if urls != read_state_file(_manifest_path(site_dir), MANIFEST_VERSION):
+        write_state_file(_manifest_path(site_dir), MANIFEST_VERSION, urls)
+        logger.debug("Fingerprinted %s assets", len(urls))
+    _asset_urls.clear()
+    _asset_urls.update(urls)
+    return urls
+
+
+def use_assets(site_dir: Path) -> None:
+    """Load the asset manifest of a site for the pages this process renders.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    _asset_urls.clear()
+    _asset_urls.update(read_state_file(_manifest_path(site_dir), MANIFEST_VERSION) or {})
+
+
+def asset_manifest() -> dict[str, str]:
+    """Get the asset URLs the pages of this process link to.
+
+    Returns:
+        A copy of the URL of each hashed copy by the URL of its asset.
+    """
+    return dict(_asset_urls)
+
+
+def asset_url(url: str) -> str:
+    """Get the URL of the content hashed copy of an asset, for templates.
+
+    Args:
+        url: The asset URL, e.g. /css/site.css.
+
+    Returns:
+        The hashed copy URL, or the asset URL if there is no copy.
+    """
+    absolute = url if url.startswith("/") else f"/{url}"
+    return _asset_urls.get(absolute, absolute)
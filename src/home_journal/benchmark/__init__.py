@@ -0,0 +1 @@
+"""Benchmark home journal against generated sites of any size."""
@@ -0,0 +1,8 @@
+"""Run the benchmark with python -m home_journal.benchmark."""
+import sys
+
+from .runner import main
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,252 @@
+"""Generate a synthetic journal, with posts, photos, and videos, to benchmark against."""
+import logging
+import random
+
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+
+from PIL import Image
+
+from ..utils import NewPost
+from ..utils import _media_groups
+from ..utils import _slugify
+from ..utils import _video_sources
+from ..utils import jinja_env
+from ..videos import run_ffmpeg
+
+
+logger = logging.getLogger(__name__)
+
+# Names given to generated authors, in order
+AUTHOR_NAMES = ("Alex", "Sam", "Jordan", "Riley", "Casey", "Morgan", "Taylor", "Jamie")
+
+# Syllables the vocabulary of generated text is made of
+_SYLLABLES = "an be dor el gen ho ka li lo mar mi ne po ra ren sa si to tu vi".split()
+
+# The number of distinct words in generated text
+VOCABULARY_SIZE = 5000
+
+# The last day a generated post can be dated, so runs are comparable
+LAST_DATE = datetime(2024, 12, 31, 23, 59, tzinfo=timezone.utc)
+
+
+@dataclass(kw_only=True)
+class SiteSpec:
+    """The shape of a generated journal."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    # The number of authors
+    authors: int = 4
+    # The size of generated photos, in pixels
+    image_size: tuple[int, int] = (1280, 960)
+    # The share of posts with photos
+    image_ratio: float = 0.3
+    # The number of posts
+    posts: int = 100
+    # The seed of the random choices, the same seed makes the same journal
+    seed: int = 0
+    # The number of distinct tags
+    tags: int = 30
+    # The share of posts with a video
+    video_ratio: float = 0.02
+    # The number of years the posts are spread over
+    years: int = 10
+
+
+@dataclass(kw_only=True)
+class GeneratedSite:
+    """What was written for a generated journal."""
+
+    # The number of bytes written
+    bytes: int = 0
+    # The number of photos written
+    images: int = 0
+    # The post ids, ordered chronologically
+    post_ids: list[str] = field(default_factory=list)
+    # The search terms used most often in the posts
+    terms: list[str] = field(default_factory=list)
+    # The number of videos written
+    videos: int = 0
+
+
+class _Writer:
+    """Write the posts of one generated journal."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, site_dir: Path, spec: SiteSpec) -> None:
+        """Initialize the writer.
+
+        Args:
+            site_dir: The directory of the site.
+            spec: The shape of the journal.
+        """
+        self.site_dir = site_dir
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.result = GeneratedSite()
+        self.videos_enabled = True
+        words: set[str] = set()
+        while len(words) < VOCABULARY_SIZE:
+            words.add("".join(self.rng.choices(_SYLLABLES, k=self.rng.randint(1, 4))))
+        self.vocabulary = sorted(words)
+        self.rng.shuffle(self.vocabulary)
+        # Word frequencies fall off with their rank, as they do in prose
+        self.weights = [1 / rank for rank in range(1, VOCABULARY_SIZE + 1)]
+        self.result.terms = self.vocabulary[:20]
+        self.tags = self.vocabulary[50 : 50 + spec.tags]
+        self.authors = [
+            AUTHOR_NAMES[idx % len(AUTHOR_NAMES)] + ("" if idx < len(AUTHOR_NAMES) else str(idx))
+            for idx in range(spec.authors)
+        ]
+
+    def _words(self, count: int) -> list[str]:
+        """Pick words as they would appear in prose.
+
+        Args:
+            count: The number of words.
+
+        Returns:
+            The words.
+        """
+        return self.rng.choices(self.vocabulary, weights=self.weights, k=count)
+
+    def _content(self) -> str:
+        """Write the markdown body of a post.
+
+        Returns:
+            A few paragraphs, with the odd heading, list, and emphasis.
+        """
+        blocks = []
+        for _ in range(self.rng.randint(1, 6)):
+            roll = self.rng.random()
+            if roll < 0.1:
+                blocks.append("## " + " ".join(self._words(3)).capitalize())
+            elif roll < 0.2:
+                blocks.append("\n".join(f"- {' '.join(self._words(4))}" for _ in range(3)))
+            words = self._words(self.rng.randint(20, 80))
+            emphasis = self.rng.randrange(len(words))
+            words[emphasis] = f"**{words[emphasis]}**"
+            blocks.append(" ".join(words).capitalize() + ".")
+        return "\n\n".join(blocks)
+
+    def _write_image(self, path: Path) -> None:
+        """Write a photo sized and compressed like one from a phone.
+
+        Args:
+            path: The JPEG to write.
+        """
+        size = self.spec.image_size
+        image = Image.merge(
+            "RGB",
+            (
+                Image.effect_noise(size, self.rng.uniform(20, 80)),
+                Image.linear_gradient("L").resize(size),
+                Image.radial_gradient("L").resize(size),
+            ),
+        )
+        image.save(path, "JPEG", quality=85)
+
+    def _write_video(self, path: Path) -> bool:
+        """Write a short H.264 video.
+
+        Args:
+            path: The MP4 to write.
+
+        Returns:
+            True if ffmpeg wrote the video.
+        """
+        if not self.videos_enabled:
+            return False
+        args = ["-f", "lavfi", "-i", "testsrc2=duration=1:size=320x240:rate=15"]
+        args += ["-vf", f"hue=h={self.rng.randrange(360)}", "-pix_fmt", "yuv420p"]
+        args += ["-c:v", "libx264", "-preset", "ultrafast"]
+        if run_ffmpeg(args, path):
+            return True
+        logger.warning("Generating posts without videos")
+        self.videos_enabled = False
+        return False
+
+    def dates(self) -> list[datetime]:
+        """Spread the post dates over the years of the journal.
+
+        Returns:
+            The dates, in order.
+        """
+        span = int(timedelta(days=365 * self.spec.years).total_seconds())
+        seconds = sorted(self.rng.randrange(span) for _ in range(self.spec.posts))
+        return [LAST_DATE - timedelta(seconds=span - offset) for offset in seconds]
+
+    def write_post(self, idx: int, date: datetime) -> None:
+        """Write one post with its media.
+
+        Args:
+            idx: The number of the post, keeps post ids unique.
+            date: The post date.
+        """
+        date = date.replace(microsecond=idx % 1_000_000)
+        title = " ".join(self._words(self.rng.randint(2, 5))).capitalize()
+        post_id = f"{date.isoformat()}_{_slugify(title)}"
+        post = NewPost(
+            author=self.rng.choice(self.authors),
+            date=date,
+            fs_post_directory=(
+                self.site_dir / "posts" / str(date.year) / f"{date.month:02d}" / post_id
+            ),
+            md_content="",
+            media_file_names=[],
+            post_id=post_id,
+            tags=sorted(set(self.rng.choices(self.tags, k=self.rng.randint(1, 3)))),
+            title=title,
+        )
+        post.fs_media_dir.mkdir(parents=True)
+        if self.rng.random() < self.spec.image_ratio:
+            for number in range(self.rng.randint(1, 4)):
+                name = f"img_{number}.jpg"
+                self._write_image(post.fs_media_dir / name)
+                post.media_file_names.append(name)
+                post.media_mime_types[name] = "image/jpeg"
+                self.result.images += 1
+        if self.rng.random() < self.spec.video_ratio and self._write_video(
+            post.fs_media_dir / "clip.mp4"
+        ):
+            post.media_file_names.append("clip.mp4")
+            post.media_mime_types["clip.mp4"] = "video/mp4"
+            self.result.videos += 1
+        mimes = _media_groups(post, post.media_file_names)
+        post.md_content = jinja_env.get_template("post.md.j2").render(
+            content=self._content(),
+            images=mimes.get("image", []),
+            videos=_video_sources(mimes.get("video", [])),
+            md_header=post.md_header,
+        )
+        post.write_md()
+        self.result.post_ids.append(post_id)
+        self.result.bytes += sum(path.stat().st_size for path in post.fs_post_directory.rglob("*"))
+
+
+def generate_site(site_dir: Path, spec: SiteSpec) -> GeneratedSite:
+    """Write a synthetic journal into a site directory.
+
+    Posts are spread over years and months, with tags and authors used
+    unevenly, prose with a natural word frequency, and photos and videos
+    on a share of the posts.
+
+    Args:
+        site_dir: The directory of the site, usually initialized with --init.
+        spec: The shape of the journal.
+
+    Returns:
+        What was written.
+    """
+    writer = _Writer(site_dir, spec)
+    for idx, date in enumerate(writer.dates()):
+        writer.write_post(idx, date)
+        if (idx + 1) % 1000 == 0:
+            logger.info("Generated %s of %s posts", idx + 1, spec.posts)
+    return writer.result
@@ -0,0 +1,87 @@
+"""Measure the wall time, peak memory, and writes of a benchmark stage."""
+import resource
+import sys
+import time
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from ..metrics import bytes_written
+
+
+@dataclass(kw_only=True)
+class Measurement:
+    """The cost of one benchmark stage."""
+
+    # Bytes passed to write calls by this process and the workers it waited for
+    bytes_written: int | None
+    # The number of times the code path ran
+    calls: int
+    # The stage name
+    name: str
+    # The highest resident set size of this process during the stage
+    peak_rss_bytes: int | None
+    # Wall clock seconds for all calls
+    seconds: float
+
+
+def _reset_peak_rss() -> bool:
+    """Start a new peak resident set size for this process.
+
+    Returns:
+        True if the peak was reset, Linux only.
+    """
+    try:
+        Path("/proc/self/clear_refs").write_text("5", encoding="utf-8")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_rss(reset: bool) -> int | None:
+    """Get the peak resident set size of this process.
+
+    Args:
+        reset: Whether the peak was reset for the stage.
+
+    Returns:
+        The peak in bytes since the reset, or since the process started
+        where the peak cannot be reset, None if it cannot be read.
+    """
+    if reset:
+        for line in Path("/proc/self/status").read_text(encoding="utf-8").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+        return None
+    # ru_maxrss never goes down, later stages report the highest peak so far
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def measure(name: str, func: Callable[[], object], calls: int = 1) -> Measurement:
+    """Run a stage and measure it.
+
+    Args:
+        name: The stage name.
+        func: Runs the stage.
+        calls: The number of times the stage runs the code path.
+
+    Returns:
+        The measurement.
+    """
+    reset = _reset_peak_rss()
+    written = bytes_written()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    written_after = bytes_written()
+    return Measurement(
+        bytes_written=(
+            None if written is None or written_after is None else written_after - written
+        ),
+        calls=calls,
+        name=name,
+        peak_rss_bytes=_peak_rss(reset),
+        seconds=seconds,
+    )
@@ -0,0 +1,315 @@
+"""Time the code paths of home journal against a generated site."""
+import argparse
+import importlib.metadata
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+from argparse import ArgumentTypeError
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from flask import request
+from PIL import Image
+
+from ..build import initialize_site
+from ..indices import write_author_indices
+from ..indices import write_index
+from ..indices import write_tag_indices
+from ..run import app
+from ..thumbnails import build_thumbnails
+from ..utils import convert_all_html
+from ..utils import find_post
+from ..utils import initialize_new_post
+from ..utils import load_posts
+from ..utils import render_search_results
+from .generate import GeneratedSite
+from .generate import SiteSpec
+from .generate import generate_site
+from .measure import Measurement
+from .measure import measure
+
+
+logger = logging.getLogger(__name__)
+
+# The format version of the results file
+RESULTS_VERSION = 1
+
+# The number of posts looked up by id, and of searches run, for the repeated stages
+LOOKUPS = 100
+SEARCHES = 20
+
+# The number of new posts submitted, each with one photo
+NEW_POSTS = 10
+
+
+def _image_size(value: str) -> tuple[int, int]:
+    """Parse an image size such as 1280x960.
+
+    Args:
+        value: The size.
+
+    Returns:
+        The width and height.
+
+    Raises:
+        ArgumentTypeError: If the size is not two numbers.
+    """
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError as exc:
+        raise ArgumentTypeError(f"Not a WIDTHxHEIGHT size: {value}") from exc
+    return width, height
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments of the benchmark command.
+
+    Args:
+        argv: The arguments following the benchmark command.
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="home-journal benchmark",
+        description="Generate a synthetic journal and time the site code paths against it",
+    )
+    parser.add_argument("-n", "--posts", type=int, help="Number of posts", default=100)
+    parser.add_argument("--years", type=int, help="Years the posts span", default=10)
+    parser.add_argument("--authors", type=int, help="Number of authors", default=4)
+    parser.add_argument("--tags", type=int, help="Number of distinct tags", default=30)
+    parser.add_argument("--image_ratio", type=float, help="Share of posts with photos", default=0.3)
+    parser.add_argument(
+        "--video_ratio", type=float, help="Share of posts with a video", default=0.02
+    )
+    parser.add_argument(
+        "--image_size",
+        type=_image_size,
+        help="Size of generated photos, WIDTHxHEIGHT",
+        default=(1280, 960),
+    )
+    parser.add_argument("--seed", type=int, help="Seed of the generated journal", default=0)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of processes used to build thumbnails",
+        default=1,
+    )
+    parser.add_argument(
+        "-s",
+        "--site_directory",
+        type=str,
+        help="Directory to generate the site in, kept after the run (default: a temporary one)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="JSON file for the results (default: benchmark-POSTS.json)",
+    )
+    return parser.parse_args(argv)
+
+
+def _new_post_stage(site_dir: Path, photo: bytes) -> None:
+    """Submit new posts as the new post form does, then remove them.
+
+    Args:
+        site_dir: The directory of the site.
+        photo: The JPEG attached to each post.
+    """
+    # Uploads are streamed into the state directory of the configured site
+    app.config["site_dir"] = site_dir
+    for idx in range(NEW_POSTS):
+        data = {
+            "author": "Benchmark",
+            "content": "A post from the benchmark.",
+            "media": (io.BytesIO(photo), "photo.jpg"),
+            "tags": "benchmark",
+            "title": f"Benchmark {idx}",
+        }
+        with app.test_request_context("/new", method="POST", data=data):
+            post = initialize_new_post(request, site_dir / "posts")
+        shutil.rmtree(post.fs_post_directory)
+
+
+def run_stages(site_dir: Path, generated: GeneratedSite, jobs: int) -> list[Measurement]:
+    """Time each code path against a generated site.
+
+    Stages that only read run after the site is built, so they see it
+    as a server would.
+
+    Args:
+        site_dir: The directory of the generated site.
+        generated: What was generated.
+        jobs: The number of processes used to build thumbnails.
+
+    Returns:
+        The measurement of each stage, in the order they ran.
+    """
+    rng = random.Random(0)
+    post_ids = rng.choices(generated.post_ids, k=LOOKUPS)
+    queries = [" ".join(rng.sample(generated.terms, k=2)) for _ in range(SEARCHES)]
+    photo = next(site_dir.glob("posts/*/*/*/media/*.jpg"), None)
+    if photo is None:
+        buffer = io.BytesIO()
+        Image.new("RGB", (1280, 960), (90, 120, 150)).save(buffer, "JPEG")
+        photo_bytes = buffer.getvalue()
+    else:
+        photo_bytes = photo.read_bytes()
+    results = [
+        measure("convert_all_html", lambda: convert_all_html(site_dir)),
+        measure("convert_all_html unchanged", lambda: convert_all_html(site_dir)),
+    ]
+    all_posts = load_posts(site_dir)
+    results += [
+        measure("build_thumbnails", lambda: build_thumbnails(all_posts, site_dir, jobs=jobs)),
+        measure("write_index", lambda: write_index(all_posts, site_dir=site_dir)),
+        measure("write_tag_indices", lambda: write_tag_indices(all_posts, site_dir=site_dir)),
+        measure("write_author_indices", lambda: write_author_indices(all_posts, site_dir=site_dir)),
+        measure("render_search_results first", lambda: render_search_results(queries[0], site_dir)),
+        measure(
+            "render_search_results",
+            lambda: [render_search_results(query, site_dir) for query in queries],
+            calls=SEARCHES,
+        ),
+        measure(
+            "find_post",
+            lambda: [find_post(site_dir, post_id) for post_id in post_ids],
+            calls=LOOKUPS,
+        ),
+        measure(
+            "initialize_new_post",
+            lambda: _new_post_stage(site_dir, photo_bytes),
+            calls=NEW_POSTS,
+        ),
+    ]
+    return results
+
+
+def _site_bytes(site_dir: Path) -> int:
+    """Add up the size of the files of a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The total size in bytes, hardlinked files counted once.
+    """
+    seen = set()
+    total = 0
+    for root, _dirs, files in os.walk(site_dir):
+        for name in files:
+            stat = os.lstat(os.path.join(root, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+def run_benchmark(args: argparse.Namespace, site_dir: Path) -> dict[str, Any]:
+    """Generate a site and time the code paths against it.
+
+    Args:
+        args: The parsed command line arguments.
+        site_dir: An empty directory for the site.
+
+    Returns:
+        The results, ready to be saved as JSON.
+    """
+    spec = SiteSpec(
+        authors=args.authors,
+        image_ratio=args.image_ratio,
+        image_size=args.image_size,
+        posts=args.posts,
+        seed=args.seed,
+        tags=args.tags,
+        video_ratio=args.video_ratio,
+        years=args.years,
+    )
+    initialize_site(site_dir)
+    generated = GeneratedSite()
+
+    def generate() -> None:
+        nonlocal generated
+        generated = generate_site(site_dir, spec)
+
+    stages = [measure("generate", generate, calls=spec.posts)]
+    stages += run_stages(site_dir, generated, args.jobs)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "cpus": os.cpu_count(),
+            "home_journal": importlib.metadata.version("home_journal"),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "system": platform.system(),
+        },
+        "generated": {
+            "bytes": generated.bytes,
+            "images": generated.images,
+            "posts": len(generated.post_ids),
+            "videos": generated.videos,
+        },
+        "jobs": args.jobs,
+        "site_bytes": _site_bytes(site_dir),
+        "spec": asdict(spec),
+        "stages": [asdict(stage) for stage in stages],
+        "version": RESULTS_VERSION,
+    }
+
+
+def _report(results: dict[str, Any]) -> str:
+    """Format the results as a table.
+
+    Args:
+        results: The benchmark results.
+
+    Returns:
+        One line per stage.
+    """
+    lines = [f"{'stage':<30} {'calls':>6} {'seconds':>9} {'peak MiB':>9} {'written MiB':>12}"]
+    for stage in results["stages"]:
+        peak = stage["peak_rss_bytes"]
+        written = stage["bytes_written"]
+        lines.append(
+            f"{stage['name']:<30} {stage['calls']:>6} {stage['seconds']:>9.3f}"
+            f" {'-' if peak is None else f'{peak / 2**20:.1f}':>9}"
+            f" {'-' if written is None else f'{written / 2**20:.1f}':>12}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> None:
+    """Run the benchmark and save the results.
+
+    Args:
+        argv: The arguments following the benchmark command.
+
+    Raises:
+        SystemExit: If the site directory given is not empty.
+    """
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s %(message)s")
+    logging.getLogger("home_journal.benchmark").setLevel(logging.INFO)
+    if args.site_directory:
+        site_dir = Path(args.site_directory)
+        site_dir.mkdir(parents=True, exist_ok=True)
+        if any(site_dir.iterdir()):
+            raise SystemExit(f"The site directory {site_dir} is not empty")
+        results = run_benchmark(args, site_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="home-journal-benchmark-") as tmp_dir:
+            results = run_benchmark(args, Path(tmp_dir))
+    output = Path(args.output or f"benchmark-{args.posts}.json")
+    output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    print(_report(results))
+    print(f"Results saved to {output}")
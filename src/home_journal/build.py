@@ -0,0 +1,253 @@
+"""Rebuild the whole site, rendering posts on a process pool."""
+import functools
+import logging
+import os
+import shutil
+
+from dataclasses import dataclass
+from importlib import resources
+from pathlib import Path
+
+from .assets import fingerprint_assets
+from .assets import use_assets
+from .catalog import post_catalog
+from .compress import compress_assets
+from .indices import write_author_indices
+from .indices import write_index
+from .indices import write_tag_indices
+from .manifest import build_manifest
+from .manifest import signature
+from .media_store import MediaStore
+from .media_store import media_store
+from .media_store import post_media
+from .metrics import bytes_written
+from .metrics import last_rebuild_bytes
+from .metrics import rebuild_bytes
+from .metrics import rebuilds
+from .metrics import stage
+from .pool import process_map
+from .renditions import RenditionCache
+from .renditions import post_images
+from .renditions import rendition_cache
+from .search import search_index
+from .service_worker import write_service_worker
+from .thumbnails import build_thumbnails
+from .thumbnails import prune_thumbnails
+from .utils import ExistingPost
+from .utils import load_posts
+from .utils import record_post_pages
+from .utils import stale_post_pages
+from .utils import use_template_cache
+from .videos import build_videos
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RebuildResult:
+    """What a site rebuild did."""
+
+    # The posts, ordered chronologically
+    posts: list[ExistingPost]
+    # The number of post pages rendered, the others were current
+    rendered: int
+
+    @property
+    def summary(self) -> str:
+        """Describe the rebuild for the log and the /all response.
+
+        Returns:
+            The rendered and total post counts.
+        """
+        return f"Built {self.rendered} of {len(self.posts)} posts."
+
+
+def _render_post(post: ExistingPost) -> None:
+    """Read, render, and write a single post.
+
+    This runs in a worker process, so the post is sent without its body.
+
+    Args:
+        post: The post to render.
+    """
+    post.load_md_content()
+    post.write_html()
+
+
+def _init_worker(site_dir: Path) -> None:
+    """Load the asset manifest and the compiled templates of a site in a worker.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    use_assets(site_dir)
+    use_template_cache(site_dir)
+
+
+def render_posts(posts: list[ExistingPost], site_dir: Path, jobs: int) -> int:
+    """Render the HTML page of each post built from changed inputs.
+
+    Args:
+        posts: The posts, with their next and previous links and renditions set.
+        site_dir: The directory of the site, whose asset manifest and templates the workers load.
+        jobs: The number of worker processes, 1 renders in this process.
+
+    Returns:
+        The number of posts rendered.
+    """
+    signatures = stale_post_pages(posts, site_dir)
+    stale = [post for post in posts if post.post_id in signatures]
+    process_map(_render_post, stale, jobs, initializer=functools.partial(_init_worker, site_dir))
+    record_post_pages(stale, signatures, site_dir)
+    if stale:
+        logger.debug("Rendered %s of %s posts", len(stale), len(posts))
+    return len(stale)
+
+
+def _media_signature(posts: list[ExistingPost]) -> str:
+    """Hash what the media steps of a rebuild depend on, without reading any media.
+
+    A file added to, replaced in, or removed from a media directory
+    changes the modification time of the directory.
+
+    Args:
+        posts: The posts.
+
+    Returns:
+        A hex digest of the cataloged markdown stat data and the media
+        directory modification time of each post, and the format versions
+        of the media store and rendition cache.
+    """
+    media_dirs: dict[str, int | None] = {}
+    for post in posts:
+        try:
+            media_dirs[post.post_id] = os.stat(post.fs_media_dir).st_mtime_ns
+        except FileNotFoundError:
+            media_dirs[post.post_id] = None
+    return signature(
+        [(post.post_id, post.md_stat) for post in posts],
+        media_dirs,
+        MediaStore.VERSION,
+        RenditionCache.VERSION,
+    )
+
+
+def initialize_site(site_dir: Path) -> None:
+    """Copy the css, js, and icons shipped with the package into a site.
+
+    Stylesheets and scripts get their content hashed copies and, like the
+    other text files, their precompressed copies. The service worker is
+    written too, so the app can be installed before the first rebuild.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    data_dir = [
+        entry for entry in resources.files("home_journal").iterdir() if entry.name == "site"
+    ][0]
+    shutil.copytree(str(data_dir), site_dir, dirs_exist_ok=True)
+    fingerprint_assets(site_dir)
+    write_service_worker(site_dir)
+    compress_assets(site_dir)
+
+
+def _build_media(posts: list[ExistingPost], site_dir: Path, jobs: int) -> None:
+    """Prepare the videos, stored media, and renditions of the posts.
+
+    Thumbnails no post uses anymore are removed as well.
+
+    Args:
+        posts: The posts.
+        site_dir: The directory of the site.
+        jobs: The number of processes used to hash and render images.
+    """
+    with stage("build_videos"):
+        build_videos(posts, site_dir, jobs=jobs)
+    with stage("adopt_media"):
+        store = media_store(site_dir)
+        all_media = [path for post in posts for path in post_media(post.fs_media_dir)]
+        store.adopt(all_media, jobs=jobs)
+        used = store.prune(all_media)
+    with stage("build_renditions"):
+        cache = rendition_cache(site_dir)
+        cache.build([path for post in posts for path in post_images(post.fs_media_dir)], jobs=jobs)
+        cache.prune(used)
+        prune_thumbnails(site_dir, used)
+
+
+def _rebuild(site_dir: Path, jobs: int) -> RebuildResult:
+    """Run the steps of a site rebuild, each timed as a stage.
+
+    Args:
+        site_dir: The directory of the site.
+        jobs: The number of processes used to render posts and images.
+
+    Returns:
+        The posts and the number of post pages rendered.
+    """
+    use_template_cache(site_dir)
+    with stage("fingerprint_assets"):
+        fingerprint_assets(site_dir)
+    with stage("load_posts"):
+        all_posts = load_posts(site_dir)
+    # Recorded against the posts directory, the media steps only run again
+    # once a post or media directory changed
+    manifest = build_manifest(site_dir)
+    if not manifest.is_current(site_dir / "posts", _media_signature(all_posts)):
+        _build_media(all_posts, site_dir, jobs)
+        # Taken again, the media steps may have written to the media directories
+        manifest.record(site_dir / "posts", _media_signature(all_posts))
+    cache = rendition_cache(site_dir)
+    for post in all_posts:
+        post.renditions = cache.lookup(post_images(post.fs_media_dir))
+    with stage("render_posts"):
+        rendered = render_posts(all_posts, site_dir, jobs)
+    # Always run, the thumbnail URLs are kept on the posts for the indices
+    with stage("build_thumbnails"):
+        build_thumbnails(all_posts, site_dir, jobs=jobs)
+    with stage("write_indices"):
+        write_index(all_posts, site_dir=site_dir)
+        write_author_indices(all_posts, site_dir=site_dir)
+        write_tag_indices(all_posts, site_dir=site_dir)
+    with stage("update_search"):
+        search_index(site_dir).sync(post_catalog(site_dir).all_entries())
+    with stage("write_service_worker"):
+        write_service_worker(site_dir)
+    with stage("compress_assets"):
+        compress_assets(site_dir)
+    return RebuildResult(all_posts, rendered)
+
+
+def rebuild_site(site_dir: Path, jobs: int = 1) -> RebuildResult:
+    """Rebuild the post pages, renditions, thumbnails, and listings for the whole site.
+
+    Stylesheets and scripts get content hashed copies the pages link to,
+    and videos are made ready to stream and given poster frames. Media
+    files not in the media store yet are moved into it, and stored files,
+    renditions, and thumbnails no post uses anymore are removed. These
+    media steps are skipped if no post or media directory changed since
+    they last ran. The service worker is written with the current app
+    shell, and text files changed since the last build get new
+    precompressed copies.
+
+    Args:
+        site_dir: The directory of the site.
+        jobs: The number of processes used to render posts and images.
+
+    Returns:
+        The posts and the number of post pages rendered, only those built
+        from changed inputs are.
+    """
+    written = bytes_written()
+    result = "failed"
+    try:
+        rebuilt = _rebuild(site_dir, jobs)
+        result = "done"
+    finally:
+        rebuilds.inc(result=result)
+    written_after = bytes_written()
+    if written is not None and written_after is not None:
+        rebuild_bytes.inc(written_after - written)
+        last_rebuild_bytes.set(written_after - written)
+    return rebuilt
@@ -0,0 +1,385 @@
+"""A persistent catalog of post metadata."""
+import json
+import logging
+import os
+import re
+import threading
+
+from collections.abc import Iterator
+from dataclasses import asdict
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Any
+
+from .compress import write_atomic
+
+
+logger = logging.getLogger(__name__)
+
+# Generated state kept in the site directory, never served over HTTP
+STATE_DIR_NAME = ".home_journal"
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+def read_state_file(path: Path, version: int) -> dict[str, Any] | None:
+    """Read a versioned JSON state file.
+
+    Args:
+        path: The state file.
+        version: The expected format version.
+
+    Returns:
+        The stored mapping, or None if it is missing, unreadable, or stale.
+    """
+    try:
+        stored = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable state file %s: %s", path, exc)
+        return None
+    if not isinstance(stored, dict) or stored.get("version") != version:
+        logger.info("Ignoring state file %s, version changed", path)
+        return None
+    return stored
+
+
+def write_state_file(path: Path, version: int, data: dict[str, Any]) -> None:
+    """Write a versioned JSON state file.
+
+    Args:
+        path: The state file.
+        version: The format version.
+        data: The mapping to store.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, json.dumps({**data, "version": version}).encode("utf-8"))
+
+
+def _string_list(value: object) -> list[str]:
+    """Read a frontmatter list of names.
+
+    Args:
+        value: The frontmatter value.
+
+    Returns:
+        The items as strings, or nothing if the value is not a list.
+    """
+    return [str(item) for item in value] if isinstance(value, list) else []
+
+
+def catalog_media_names(metadata: dict[str, object]) -> list[str]:
+    """Return media file names from post frontmatter.
+
+    Args:
+        metadata: Parsed post frontmatter.
+
+    Returns:
+        Names from media_file_names, or image_file_names for older posts.
+    """
+    names = metadata.get("media_file_names") or metadata.get("image_file_names")
+    return _string_list(names)
+
+
+def index_image_name(metadata: dict[str, object], content: str) -> str | None:
+    """Pick the index thumbnail file name for a post.
+
+    Args:
+        metadata: Parsed post frontmatter.
+        content: Markdown body.
+
+    Returns:
+        A still-image file name, or None.
+    """
+    for name in catalog_media_names(metadata):
+        if Path(name).suffix.lower() in IMAGE_SUFFIXES:
+            return Path(name).name
+    images = re.findall(r"!\[.*\]\((.*?\.(?:jpg|jpeg|png))?.*\)", content)
+    names = [Path(image).name for image in images if image]
+    return names[0] if names else None
+
+
+@dataclass(kw_only=True)
+class CatalogEntry:
+    """Metadata for one post as recorded in the post catalog."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    # The post author
+    author: str
+    # The post date as an ISO 8601 string
+    date: str
+    # The image to use on the index
+    index_image: str | None
+    # The attached media file names
+    media_file_names: list[str]
+    # The markdown file path relative to the site directory
+    md_path: str
+    # The markdown file modification time in nanoseconds
+    mtime_ns: int
+    # The post id
+    post_id: str
+    # The markdown file size in bytes
+    size: int
+    # Tags, including categories from older posts
+    tags: list[str]
+    # The post title
+    title: str
+
+    @classmethod
+    def from_file(cls, path: Path, site_dir: Path, stat: os.stat_result) -> "CatalogEntry":
+        """Parse a post markdown file into a catalog entry.
+
+        Args:
+            path: The markdown file.
+            site_dir: The directory of the site.
+            stat: The stat result for the markdown file.
+
+        Returns:
+            The catalog entry.
+        """
+        # Only posts changed since they were last read are parsed, often none
+        import frontmatter  # pylint: disable=import-outside-toplevel
+
+        parsed_post = frontmatter.load(path)
+        date = datetime.fromisoformat(str(parsed_post["date"]))
+        if not date.tzinfo:
+            date = date.replace(tzinfo=timezone.utc)
+
+        # Some older posts have categories, convert to tags
+        tags = _string_list(parsed_post.metadata.get("tags"))
+        categories = _string_list(parsed_post.metadata.get("categories"))
+
+        return cls(
+            author=str(parsed_post.get("author", "")),
+            date=date.isoformat(),
+            index_image=index_image_name(parsed_post.metadata, parsed_post.content),
+            media_file_names=catalog_media_names(parsed_post.metadata),
+            md_path=path.relative_to(site_dir).as_posix(),
+            mtime_ns=stat.st_mtime_ns,
+            post_id=path.parent.name,
+            size=stat.st_size,
+            tags=tags + categories,
+            title=str(parsed_post["title"]),
+        )
+
+
+class PostCatalog:
+    """A persistent catalog of post metadata.
+
+    The catalog is stored as JSON in the site state directory. Each refresh
+    compares the stat data of every markdown file under posts/ with the
+    recorded entry and only parses files that were added or changed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the catalog.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        self.path = site_dir / STATE_DIR_NAME / "catalog.json"
+        self.entries: dict[str, CatalogEntry] = {}
+        # The markdown path of each post id, so posts are found without a scan
+        self._md_paths: dict[str, str] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        """Load the catalog from disk, ignoring a missing or stale file."""
+        self._loaded = True
+        stored = read_state_file(self.path, self.VERSION)
+        if stored is None:
+            return
+        for md_path, entry in stored.get("entries", {}).items():
+            self._set(md_path, CatalogEntry(**entry))
+
+    def _set(self, md_path: str, entry: CatalogEntry) -> None:
+        """Record the entry of a markdown file.
+
+        Args:
+            md_path: The markdown file path relative to the site directory.
+            entry: The catalog entry.
+        """
+        self.entries[md_path] = entry
+        self._md_paths[entry.post_id] = md_path
+
+    def _drop(self, md_path: str) -> str:
+        """Forget the entry of a markdown file that is gone.
+
+        Args:
+            md_path: The markdown file path relative to the site directory.
+
+        Returns:
+            The id of the post.
+        """
+        entry = self.entries.pop(md_path)
+        if self._md_paths.get(entry.post_id) == md_path:
+            del self._md_paths[entry.post_id]
+        return entry.post_id
+
+    def _catalog(self, path: Path, stat: os.stat_result) -> str | None:
+        """Record a markdown file unless it is cataloged as it is on disk.
+
+        Args:
+            path: The markdown file.
+            stat: The stat result for the markdown file.
+
+        Returns:
+            The id of the post if its entry changed, otherwise None.
+        """
+        md_path = path.relative_to(self.site_dir).as_posix()
+        entry = self.entries.get(md_path)
+        if entry and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            return None
+        logger.debug("Cataloging %s", md_path)
+        entry = CatalogEntry.from_file(path, self.site_dir, stat)
+        self._set(md_path, entry)
+        return entry.post_id
+
+    def _save(self) -> None:
+        """Write the catalog to disk."""
+        entries = {md_path: asdict(entry) for md_path, entry in self.entries.items()}
+        write_state_file(self.path, self.VERSION, {"entries": entries})
+
+    def _scan(self) -> Iterator[tuple[Path, os.stat_result]]:
+        """Walk the posts directory for markdown files.
+
+        Yields:
+            Each markdown file and its stat result.
+        """
+        posts_dir = self.site_dir / "posts"
+        for root, _dirs, files in os.walk(posts_dir):
+            for name in files:
+                if not name.endswith(".md"):
+                    continue
+                path = Path(root) / name
+                try:
+                    yield path, path.stat()
+                except FileNotFoundError:
+                    continue
+
+    def refresh(self) -> set[str]:
+        """Bring the catalog up to date with the posts on disk.
+
+        Returns:
+            The ids of posts that were added, changed, or removed.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            changed: set[str] = set()
+            seen: set[str] = set()
+            for path, stat in self._scan():
+                seen.add(path.relative_to(self.site_dir).as_posix())
+                post_id = self._catalog(path, stat)
+                if post_id is not None:
+                    changed.add(post_id)
+            for md_path in set(self.entries) - seen:
+                changed.add(self._drop(md_path))
+            if changed:
+                logger.debug("Post catalog changed: %s posts", len(changed))
+                self._save()
+            return changed
+
+    def refresh_post(self, post_dir: Path) -> list[CatalogEntry]:
+        """Bring the catalog up to date with a single post directory.
+
+        Only that directory is read, so a post written or deleted by the
+        app is cataloged without walking every post.
+
+        Args:
+            post_dir: The post directory, which may have been deleted.
+
+        Returns:
+            The entries of the markdown files now in the directory.
+        """
+        # Paths relative to the site directory, however the post directory is given
+        directory = self.site_dir / post_dir.resolve().relative_to(self.site_dir.resolve())
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            changed = False
+            entries = []
+            for path in sorted(directory.glob("*.md")):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                changed = self._catalog(path, stat) is not None or changed
+                entries.append(self.entries[path.relative_to(self.site_dir).as_posix()])
+            current = {entry.md_path for entry in entries}
+            prefix = f"{directory.relative_to(self.site_dir).as_posix()}/"
+            listed = [
+                md_path
+                for md_path in self.entries
+                if md_path.startswith(prefix) and "/" not in md_path[len(prefix) :]
+            ]
+            for md_path in set(listed) - current:
+                self._drop(md_path)
+                changed = True
+            if changed:
+                self._save()
+            return entries
+
+    def post_count(self) -> int:
+        """Count the posts on disk, bringing the catalog up to date first.
+
+        Returns:
+            The number of cataloged posts.
+        """
+        self.refresh()
+        with self._lock:
+            return len(self.entries)
+
+    def find(self, post_id: str) -> CatalogEntry | None:
+        """Find a catalog entry by post id.
+
+        Args:
+            post_id: The id of the post.
+
+        Returns:
+            The entry, or None if the post is not cataloged.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            md_path = self._md_paths.get(post_id)
+            return self.entries.get(md_path) if md_path else None
+
+    def all_entries(self) -> list[CatalogEntry]:
+        """Get every cataloged post.
+
+        Returns:
+            The entries, ordered chronologically.
+        """
+        with self._lock:
+            entries = list(self.entries.values())
+        entries.sort(key=lambda x: datetime.fromisoformat(x.date))
+        return entries
+
+
+_catalogs: dict[Path, PostCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def post_catalog(site_dir: Path) -> PostCatalog:
+    """Get the shared post catalog for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The post catalog, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = PostCatalog(site_dir)
+        return _catalogs[key]
@@ -1,13 +1,21 @@
 """Command line interface for home journal."""
 
 import argparse
+import atexit
 import logging
+import logging.handlers
 import os
-import shutil
+import pathlib
+import queue
+import sys
 
-from importlib import resources
-
-from .run import run_server
+from .build import initialize_site
+from .build import rebuild_site
+from .catalog import post_catalog
+from .pool import default_jobs
+from .profiling import Profiler
+from .profiling import use_profiler
+from .videos import set_ffmpeg_limit
 
 
 logger = logging.getLogger()
@@ -25,13 +33,12 @@ def _list_tags(values: str) -> list[str]:
     return values.split(",")
 
 
-def _parse_args() -> argparse.Namespace:
-    """Parse the command line arguments.
+def _add_site_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments shared by the server and the build command.
 
-    Returns:
-        The parsed arguments.
+    Args:
+        parser: The parser to add the arguments to.
     """
-    parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i",
         "--init",
@@ -53,6 +60,69 @@ def _parse_args() -> argparse.Namespace:
         help="Log file",
         default=os.getcwd() + "/hj.log",
     )
+    parser.add_argument(
+        "-s",
+        "--site_directory",
+        type=str,
+        help="Path to the site directory",
+        required=True,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of processes used to render posts and thumbnails during a full rebuild",
+        default=default_jobs(),
+    )
+    parser.add_argument(
+        "--ffmpeg_jobs",
+        type=int,
+        help="Number of ffmpeg processes run at once for video processing",
+        default=1,
+    )
+    parser.add_argument(
+        "--profile_dir",
+        type=str,
+        help=(
+            "Directory for cProfile and tracemalloc files, relative to the site directory;"
+            " the server profiles once switched on with a POST to /profile, a build always"
+        ),
+    )
+
+
+def _parse_build_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments of the build command.
+
+    Args:
+        argv: The arguments following the build command.
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="home-journal build",
+        description="Rebuild the whole site without starting the server",
+    )
+    _add_site_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments.
+
+    Args:
+        argv: The command line arguments.
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        epilog=(
+            "Run 'home-journal build -h' for the build command,"
+            " and 'home-journal benchmark -h' to measure how the site scales."
+        )
+    )
+    _add_site_arguments(parser)
     parser.add_argument(
         "-p",
         "--port",
@@ -61,11 +131,28 @@ def _parse_args() -> argparse.Namespace:
         default=8000,
     )
     parser.add_argument(
-        "-s",
-        "--site_directory",
-        type=str,
-        help="Path to the site directory",
-        required=True,
+        "--job_workers",
+        type=int,
+        help="Number of background workers for post processing",
+        default=2,
+    )
+    parser.add_argument(
+        "--job_queue_size",
+        type=int,
+        help="Number of waiting background jobs before new posts are refused",
+        default=16,
+    )
+    parser.add_argument(
+        "--slow_request_seconds",
+        type=float,
+        help="Log the stage breakdown of requests slower than this",
+        default=1.0,
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        help="Rebuild the pages of posts added or edited on disk as they change",
+        action="store_true",
     )
     parser.add_argument(
         "-t",
@@ -74,13 +161,13 @@ def _parse_args() -> argparse.Namespace:
         type=_list_tags,
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
 
 def _setup_logging(args: argparse.Namespace) -> None:
-    """Set up the logging.
+    """Set up the logging, written to the log file by a background thread.
 
     Args:
         args: The parsed command line arguments.
@@ -91,7 +178,12 @@ def _setup_logging(args: argparse.Namespace) -> None:
         fmt="%(asctime)s %(levelname)s '%(name)s.%(funcName)s' %(message)s"
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    # Request threads only queue records, a listener thread writes them to the file
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(records))
     level = logging.getLevelName(args.log_level.upper())
     logger.setLevel(level)
     logger.info("Started")
@@ -105,21 +197,52 @@ def _init_site(args: argparse.Namespace) -> None:
     """
     if args.init:
         logging.info("Initializing site")
-        data_dir = [
-            entry for entry in resources.files("home_journal").iterdir() if entry.name == "site"
-        ][0]
-        shutil.copytree(str(data_dir), args.site_directory, dirs_exist_ok=True)
+        initialize_site(pathlib.Path(args.site_directory))
         logging.info("Site initialized")
 
 
+def _build(args: argparse.Namespace) -> None:
+    """Rebuild the whole site and report the result.
+
+    Args:
+        args: The parsed command line arguments.
+    """
+    set_ffmpeg_limit(args.ffmpeg_jobs)
+    site_dir = pathlib.Path(args.site_directory)
+    if not args.profile_dir:
+        rebuilt = rebuild_site(site_dir, jobs=args.jobs)
+    else:
+        profiler = Profiler(site_dir / args.profile_dir)
+        profiler.enable()
+        use_profiler(profiler)
+        with profiler.profile("build", post_catalog(site_dir).post_count()):
+            rebuilt = rebuild_site(site_dir, jobs=args.jobs)
+        profiler.disable()
+    logger.info(rebuilt.summary)
+    print(rebuilt.summary)
+
+
 def main() -> None:
     """Run the app."""
-    args = _parse_args()
+    argv = sys.argv[1:]
+    # The server and the benchmark import Flask and waitress, only load the one run
+    if argv[:1] == ["benchmark"]:
+        from .benchmark import runner  # pylint: disable=import-outside-toplevel
+
+        runner.main(argv[1:])
+        return
+    build = argv[:1] == ["build"]
+    args = _parse_build_args(argv[1:]) if build else _parse_args(argv)
     _setup_logging(args)
     for arg in vars(args):
         logger.debug("%s: %s", arg, getattr(args, arg))
     _init_site(args)
-    run_server(args)
+    if build:
+        _build(args)
+    else:
+        from .run import run_server  # pylint: disable=import-outside-toplevel
+
+        run_server(args)
 
 
 if __name__ == "__main__":
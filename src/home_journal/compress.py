@@ -0,0 +1,250 @@
+"""Minify generated pages and precompress the text files of the site."""
+import gzip
+import importlib
+import importlib.util
+import logging
+import os
+import re
+import threading
+
+from pathlib import Path
+
+from .file_events import file_changed
+
+
+logger = logging.getLogger(__name__)
+
+# Files served with a precompressed copy next to them
+TEXT_SUFFIXES = {".css", ".html", ".js", ".json", ".svg", ".webmanifest"}
+
+# Files smaller than this are not worth a compressed copy
+MIN_COMPRESS_SIZE = 512
+
+# The sidecar suffix of each content coding, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# The site directories holding the stylesheets and scripts copied by --init
+ASSET_DIRS = ("css", "js")
+
+# Elements whose whitespace is kept as it is
+_PRESERVED = re.compile(
+    r"<(code|pre|script|style|textarea)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE
+)
+
+_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+
+_LINE_BREAK = re.compile(r"[ \t\r\f]*\n\s*")
+
+
+def brotli_available() -> bool:
+    """Check whether the optional brotli package is installed.
+
+    Returns:
+        True if .br copies can be written.
+    """
+    return importlib.util.find_spec("brotli") is not None
+
+
+def minify_html(text: str) -> str:
+    """Remove whitespace and comments a browser would not render.
+
+    Whitespace that contains a line break is reduced to the line break,
+    which renders the same, and comments are dropped. Preformatted text,
+    scripts, styles, and form fields are left alone.
+
+    Args:
+        text: The HTML.
+
+    Returns:
+        The minified HTML.
+    """
+    parts = []
+    position = 0
+    for match in _PRESERVED.finditer(text):
+        parts.append(_LINE_BREAK.sub("\n", _COMMENT.sub("", text[position : match.start()])))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_LINE_BREAK.sub("\n", _COMMENT.sub("", text[position:])))
+    return "".join(parts).strip() + "\n"
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write a file so it is never read half written.
+
+    The content goes to a hidden file next to it, named for the process
+    and thread, which is then renamed over the file.
+
+    Args:
+        path: The file.
+        data: The content.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    file_changed(path)
+
+
+def _encode(data: bytes, encoding: str) -> bytes:
+    """Compress data at the highest level, the work is only done once.
+
+    Args:
+        data: The content.
+        encoding: The content coding, br or gzip.
+
+    Returns:
+        The compressed content.
+    """
+    if encoding == "br":
+        return bytes(importlib.import_module("brotli").compress(data, quality=11))
+    # A fixed mtime keeps the output the same for the same content
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def sidecar_path(path: Path, encoding: str) -> Path:
+    """Get the precompressed copy of a file.
+
+    Args:
+        path: The file.
+        encoding: The content coding, br or gzip.
+
+    Returns:
+        The path of the copy, which may not exist.
+    """
+    return path.with_name(path.name + ENCODINGS[encoding])
+
+
+def remove_sidecars(path: Path) -> None:
+    """Delete the precompressed copies of a file.
+
+    Args:
+        path: The file.
+    """
+    for encoding in ENCODINGS:
+        sidecar_path(path, encoding).unlink(missing_ok=True)
+    file_changed(path)
+
+
+def sidecars_current(path: Path) -> bool:
+    """Check whether the precompressed copies of a file are up to date.
+
+    Args:
+        path: The file.
+
+    Returns:
+        True if each copy that should exist is newer than the file.
+    """
+    source_mtime = path.stat().st_mtime_ns
+    for encoding in ENCODINGS:
+        if encoding == "br" and not brotli_available():
+            continue
+        sidecar = sidecar_path(path, encoding)
+        try:
+            if sidecar.stat().st_mtime_ns < source_mtime:
+                return False
+        except FileNotFoundError:
+            if path.stat().st_size >= MIN_COMPRESS_SIZE:
+                return False
+    return True
+
+
+def write_sidecars(path: Path, data: bytes | None = None) -> None:
+    """Write the precompressed copies of a file.
+
+    Copies that would not be smaller than the file are removed instead.
+
+    Args:
+        path: The file.
+        data: The content of the file, if already in memory.
+    """
+    if data is None:
+        data = path.read_bytes()
+    for encoding in ENCODINGS:
+        sidecar = sidecar_path(path, encoding)
+        if len(data) < MIN_COMPRESS_SIZE or (encoding == "br" and not brotli_available()):
+            sidecar.unlink(missing_ok=True)
+            continue
+        encoded = _encode(data, encoding)
+        if len(encoded) >= len(data):
+            sidecar.unlink(missing_ok=True)
+            continue
+        write_atomic(sidecar, encoded)
+
+
+def write_text_file(path: Path, text: str) -> bool:
+    """Write a generated text file with its precompressed copies.
+
+    HTML is minified first. A file whose content did not change is not
+    written again, so its copies, validators, and client caches stay good.
+
+    Args:
+        path: The file.
+        text: The content.
+
+    Returns:
+        True if the file was written.
+    """
+    if path.suffix == ".html":
+        text = minify_html(text)
+    data = text.encode("utf-8")
+    try:
+        unchanged = path.read_bytes() == data
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged:
+        if not sidecars_current(path):
+            write_sidecars(path, data)
+        return False
+    write_atomic(path, data)
+    write_sidecars(path, data)
+    return True
+
+
+def compress_assets(site_dir: Path) -> int:
+    """Precompress the stylesheets, scripts, and other text files copied by --init.
+
+    Only files changed since their copies were written are compressed.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The number of files compressed.
+    """
+    paths = [path for path in site_dir.iterdir() if path.is_file()]
+    for name in ASSET_DIRS:
+        if (site_dir / name).is_dir():
+            paths.extend(path for path in (site_dir / name).iterdir() if path.is_file())
+    compressed = 0
+    for path in paths:
+        if path.suffix in TEXT_SUFFIXES and not sidecars_current(path):
+            write_sidecars(path)
+            compressed += 1
+    if compressed:
+        logger.debug("Compressed %s site files", compressed)
+    return compressed
+
+
+def available_encodings(path: str) -> tuple[str, ...]:
+    """List the content codings a file can be sent in without compressing it.
+
+    Args:
+        path: The file.
+
+    Returns:
+        The codings with a current precompressed copy, in order of preference.
+    """
+    try:
+        source_mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return ()
+    found = []
+    for encoding, suffix in ENCODINGS.items():
+        try:
+            if os.stat(path + suffix).st_mtime_ns >= source_mtime:
+                found.append(encoding)
+        except OSError:
+            continue
+    return tuple(found)
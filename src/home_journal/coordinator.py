@@ -0,0 +1,99 @@
+"""Serialize the writers of a site and merge rebuilds requested while one runs."""
+import contextlib
+import logging
+import threading
+
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+from typing import TypeVar
+from typing import cast
+
+from .metrics import coalesced_passes
+from .metrics import stage
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RebuildCoordinator:
+    """Let one request or job write the generated files of a site at a time.
+
+    Passes of the same kind, such as refreshing the listing pages, are
+    merged: a caller that finds a pass of its kind started after it
+    asked takes that pass's result instead of running another. A burst
+    of uploads then refreshes the listings once or twice, not once each.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the coordinator."""
+        # Reentrant, so a pass can be run by a caller that already writes
+        self._write_lock = threading.RLock()
+        self._lock = threading.Lock()
+        # Per kind: the passes asked for, the passes covered by a finished pass, its result
+        self._requested: dict[str, int] = {}
+        self._done: dict[str, int] = {}
+        self._results: dict[str, Any] = {}
+
+    @contextlib.contextmanager
+    def writer(self) -> Iterator[None]:
+        """Write generated files once no one else is.
+
+        Yields:
+            Nothing, the writes happen in the with block.
+        """
+        with stage("wait_for_writer"):
+            self._write_lock.acquire()
+        try:
+            yield
+        finally:
+            self._write_lock.release()
+
+    def run(self, kind: str, func: Callable[[], T]) -> T:
+        """Run a pass as the only writer, unless a later pass covers it.
+
+        Args:
+            kind: The kind of pass, passes of one kind do the same work.
+            func: Runs the pass.
+
+        Returns:
+            The result of the pass that covered this request.
+        """
+        with self._lock:
+            ticket = self._requested[kind] = self._requested.get(kind, 0) + 1
+        with self.writer():
+            with self._lock:
+                if self._done.get(kind, 0) >= ticket:
+                    coalesced_passes.inc(kind=kind)
+                    logger.debug("Merged a %s pass into the one that just ran", kind)
+                    return cast(T, self._results[kind])
+                # Every request made so far sees the files this pass writes
+                covered = self._requested[kind]
+            result = func()
+            with self._lock:
+                self._done[kind] = covered
+                self._results[kind] = result
+            return result
+
+
+_coordinators: dict[Path, RebuildCoordinator] = {}
+_coordinators_lock = threading.Lock()
+
+
+def rebuild_coordinator(site_dir: Path) -> RebuildCoordinator:
+    """Get the shared rebuild coordinator for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The rebuild coordinator, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _coordinators_lock:
+        if key not in _coordinators:
+            _coordinators[key] = RebuildCoordinator()
+        return _coordinators[key]
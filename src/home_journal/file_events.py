@@ -0,0 +1,36 @@
+"""Tell in-memory caches about the site files this process writes."""
+import threading
+
+from collections.abc import Callable
+from pathlib import Path
+
+
+FileListener = Callable[[Path], None]
+
+_listeners: list[FileListener] = []
+_listeners_lock = threading.Lock()
+
+
+def add_file_listener(listener: FileListener) -> None:
+    """Call a function with each site file this process writes or removes from now on.
+
+    Files written by other processes, such as the render pool, are not
+    reported.
+
+    Args:
+        listener: Called with the path of each file.
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def file_changed(path: Path) -> None:
+    """Report a site file that was written, replaced, or removed.
+
+    Args:
+        path: The file.
+    """
+    with _listeners_lock:
+        listeners = tuple(_listeners)
+    for listener in listeners:
+        listener(path)
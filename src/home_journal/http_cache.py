@@ -0,0 +1,262 @@
+"""HTTP caching of the static site files."""
+import logging
+import mimetypes
+import os
+import threading
+
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+from flask import Response
+from flask import abort
+from flask import request
+from flask import send_from_directory
+from werkzeug.security import safe_join
+
+from .assets import is_fingerprinted
+from .compress import ENCODINGS
+from .compress import TEXT_SUFFIXES
+from .compress import available_encodings
+from .file_events import add_file_listener
+
+
+logger = logging.getLogger(__name__)
+
+# Files whose URL changes when their content does, cached by clients for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Files rewritten in place, such as post and index pages and post media, checked on every use
+REVALIDATE = "no-cache"
+
+# Stylesheets, scripts, and icons, which only change when the site is upgraded
+ASSET = "public, max-age=3600"
+
+# Directories holding files named by their content, or never rewritten
+IMMUTABLE_DIRS = {"renditions", "thumbs"}
+
+# Directories holding files that keep their name when replaced, such as a
+# video remuxed for streaming or an image replaced by an edit
+REVALIDATE_DIRS = {"media"}
+
+# Suffixes of files that are never changed in place
+IMMUTABLE_SUFFIXES = {".woff2"}
+
+# Files that tell the browser about new versions of everything else
+REVALIDATE_NAMES = {"manifest.webmanifest", "sw.js"}
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+@dataclass(frozen=True, kw_only=True)
+class Validator:
+    """The cache validators of one file, taken from a single stat call."""
+
+    # The Cache-Control header value
+    cache_control: str
+    # The content codings with a current precompressed copy, in order of preference
+    encodings: tuple[str, ...]
+    # The entity tag, unquoted
+    etag: str
+    # The file modification time
+    last_modified: datetime
+
+
+def cache_control(filename: str) -> str:
+    """Pick the Cache-Control header of a site file.
+
+    Args:
+        filename: The path relative to the site directory.
+
+    Returns:
+        The header value.
+    """
+    path = Path(filename)
+    if path.name in REVALIDATE_NAMES or path.suffix == ".html":
+        return REVALIDATE
+    if REVALIDATE_DIRS.intersection(path.parts[:-1]):
+        return REVALIDATE
+    if IMMUTABLE_DIRS.intersection(path.parts[:-1]) or path.suffix in IMMUTABLE_SUFFIXES:
+        return IMMUTABLE
+    if is_fingerprinted(path.name):
+        return IMMUTABLE
+    return ASSET
+
+
+class ValidatorCache:
+    """Keep the validators of served files in memory.
+
+    A conditional request for a file seen before is answered without
+    touching the disk. Each file this process writes or removes drops its
+    validators as it is written, see forget. Rebuilds, whose pages may be
+    written by other processes, clear the whole cache, see clear.
+    """
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the cache.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        # Written paths are compared without touching the disk
+        self._root = Path(os.path.abspath(site_dir))
+        self._validators: dict[str, Validator] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, filename: str) -> Validator | None:
+        """Get the validators of a file, reading its stat data on first use.
+
+        Args:
+            filename: The path relative to the site directory.
+
+        Returns:
+            The validators, or None if the file does not exist.
+        """
+        with self._lock:
+            validator = self._validators.get(filename)
+        if validator is not None:
+            return validator
+        path = safe_join(str(self.site_dir), filename)
+        if path is None:
+            return None
+        try:
+            stat = Path(path).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not Path(path).is_file():
+            return None
+        validator = Validator(
+            cache_control=cache_control(filename),
+            encodings=available_encodings(path) if Path(path).suffix in TEXT_SUFFIXES else (),
+            etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+        )
+        with self._lock:
+            self._validators[filename] = validator
+        return validator
+
+    def forget(self, path: Path) -> None:
+        """Drop the validators of a file that was written or removed.
+
+        A precompressed copy also changes the codings of its file.
+
+        Args:
+            path: The file.
+        """
+        try:
+            filename = Path(os.path.abspath(path)).relative_to(self._root).as_posix()
+        except ValueError:
+            return
+        names = [filename]
+        names.extend(
+            filename.removesuffix(suffix)
+            for suffix in ENCODINGS.values()
+            if filename.endswith(suffix)
+        )
+        with self._lock:
+            for name in names:
+                self._validators.pop(name, None)
+
+    def clear(self) -> None:
+        """Forget every validator, after site files were written."""
+        with self._lock:
+            self._validators.clear()
+
+
+_caches: dict[Path, ValidatorCache] = {}
+_caches_lock = threading.Lock()
+
+
+def validator_cache(site_dir: Path) -> ValidatorCache:
+    """Get the shared validator cache for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The validator cache, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ValidatorCache(site_dir)
+            add_file_listener(_caches[key].forget)
+        return _caches[key]
+
+
+def _not_modified(validator: Validator, etag: str) -> bool:
+    """Check whether the client already has the current version of a file.
+
+    Args:
+        validator: The validators of the file.
+        etag: The entity tag of the variant being sent.
+
+    Returns:
+        True if the conditional request headers match the file.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return request.if_modified_since >= validator.last_modified.replace(microsecond=0)
+    return False
+
+
+def _pick_encoding(validator: Validator) -> str | None:
+    """Pick the precompressed copy the client accepts.
+
+    Args:
+        validator: The validators of the file.
+
+    Returns:
+        The content coding, or None to send the file as it is.
+    """
+    for encoding in validator.encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def send_cached(site_dir: Path, filename: str) -> Response:
+    """Send a site file with cache headers, or a 304 if the client has it.
+
+    Text files are sent precompressed when the client accepts a coding
+    there is a copy for, nothing is compressed at request time.
+
+    Args:
+        site_dir: The directory of the site.
+        filename: The path relative to the site directory.
+
+    Returns:
+        The file, or an empty 304 response.
+    """
+    validator = validator_cache(site_dir).lookup(filename)
+    if validator is None:
+        abort(404)
+    encoding = _pick_encoding(validator)
+    etag = f"{validator.etag}-{encoding}" if encoding else validator.etag
+    if request.method in ("GET", "HEAD") and _not_modified(validator, etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    elif encoding:
+        response = send_from_directory(
+            site_dir,
+            filename + ENCODINGS[encoding],
+            etag=etag,
+            last_modified=validator.last_modified,
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        )
+        response.headers["Content-Encoding"] = encoding
+    else:
+        # The file is opened here, range requests are still answered by send_file
+        response = send_from_directory(
+            site_dir,
+            filename,
+            etag=etag,
+            last_modified=validator.last_modified,
+        )
+    response.headers["Cache-Control"] = validator.cache_control
+    if validator.encodings:
+        response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,370 @@
+"""Write the index, archive, tag, and author listing pages."""
+import functools
+import json
+import logging
+import os
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from .assets import asset_manifest
+from .compress import remove_sidecars
+from .compress import write_text_file
+from .manifest import build_manifest
+from .manifest import signature
+from .utils import ExistingPost
+from .utils import _slugify
+from .utils import _template_digest
+from .utils import jinja_env
+
+
+logger = logging.getLogger(__name__)
+
+# Number of posts on each index page shard
+INDEX_PAGE_SIZE = 48
+
+# The icon shown before the title of the year and month archive pages
+ARCHIVE_ICON = "calendar_month"
+
+
+def _card_fields(post: ExistingPost) -> dict[str, object]:
+    """Get the post fields shown on an index card.
+
+    These are also the entries of the JSON page feed.
+
+    Args:
+        post: The post.
+
+    Returns:
+        The values the index template renders for the post.
+    """
+    return {
+        "author": post.author,
+        "author_url": f"/authors/{post.author_index}",
+        "archive_url": post.archive_url,
+        "date": post.date.strftime("%B %d, %Y"),
+        "tags": [{"name": tag, "url": f"/tags/{tag}.html"} for tag in post.tags],
+        "thumbnail": str(post.thumbnail_url) if post.thumbnail_url else None,
+        "title": post.title,
+        "url": str(post.post_url),
+    }
+
+
+def _page_shards(posts: list[ExistingPost]) -> list[list[ExistingPost]]:
+    """Split chronological posts into the pages of a listing.
+
+    Posts are cut into fixed-size shards counted from the oldest post, so
+    an older shard keeps its posts as new ones are added. The first page
+    holds the newest full shard together with the posts after it, so it
+    always shows at least a full page, and a new post only changes the
+    first page.
+
+    Args:
+        posts: The posts, ordered chronologically.
+
+    Returns:
+        The pages, oldest first, the first page last. There is always at least one.
+    """
+    if not posts:
+        return [[]]
+    shards = [posts[idx : idx + INDEX_PAGE_SIZE] for idx in range(0, len(posts), INDEX_PAGE_SIZE)]
+    if len(shards) > 1 and len(shards[-1]) < INDEX_PAGE_SIZE:
+        shards[-2:] = [shards[-2] + shards[-1]]
+    return shards
+
+
+def _write_page(site_dir: Path, path: Path, page_signature: str, render: Callable[[], str]) -> bool:
+    """Write a generated page unless it was already built from the same inputs.
+
+    Args:
+        site_dir: The directory of the site.
+        path: The page path.
+        page_signature: The signature of the page inputs.
+        render: Produces the page content.
+
+    Returns:
+        True if the page was written.
+    """
+    manifest = build_manifest(site_dir)
+    if manifest.is_current(path, page_signature):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_text_file(path, render())
+    manifest.record(path, page_signature)
+    return True
+
+
+def _site_url(site_dir: Path, path: Path) -> str:
+    """Get the site URL of a generated file.
+
+    Args:
+        site_dir: The directory of the site.
+        path: The file path.
+
+    Returns:
+        The absolute URL path.
+    """
+    return f"/{path.relative_to(site_dir).as_posix()}"
+
+
+@dataclass
+class _Listing:
+    """A paginated post listing, such as the index or one tag.
+
+    The first page, such as index.html, shows the newest posts. Older
+    pages are numbered from the oldest, page/1.html holds the oldest
+    shard, so the URL and content of an older page do not change as posts
+    are added. Each older page has a JSON feed, page/1.json, with its
+    posts and the URL of the next older feed, for infinite scroll.
+    """
+
+    # The directory of the site
+    site_dir: Path
+    # The page holding the newest posts, e.g. index.html
+    first_page: Path
+    # The page title
+    title: str
+    # The icon shown before the title
+    title_icon: str | None
+
+    @property
+    def shard_dir(self) -> Path:
+        """Get the directory of the older page shards and the feed.
+
+        Returns:
+            page/ next to index.html, or in a directory named after the page.
+        """
+        if self.first_page.name == "index.html":
+            return self.first_page.parent / "page"
+        return self.first_page.with_suffix("") / "page"
+
+    def _write_shard(
+        self,
+        paths: tuple[Path, Path | None],
+        shard: list[ExistingPost],
+        links: dict[str, str | None],
+    ) -> None:
+        """Write one page and its feed if their inputs changed.
+
+        Args:
+            paths: The page path, and the feed path unless it is the first page.
+            shard: The posts of the page, ordered chronologically.
+            links: The feed, newer, and older page URLs.
+        """
+        page_path, feed_path = paths
+        cards = [_card_fields(post) for post in reversed(shard)]
+        template = jinja_env.get_template("index.html.j2")
+        _write_page(
+            self.site_dir,
+            page_path,
+            signature(
+                _template_digest("index.html.j2"),
+                asset_manifest(),
+                self.title,
+                self.title_icon,
+                links,
+                cards,
+            ),
+            functools.partial(
+                template.render,
+                posts=shard,
+                title=self.title,
+                title_icon=self.title_icon,
+                **links,
+            ),
+        )
+        if feed_path is None:
+            return
+        feed = {"older": links["feed_url"], "posts": cards}
+        _write_page(
+            self.site_dir,
+            feed_path,
+            signature(feed),
+            functools.partial(json.dumps, feed, separators=(",", ":")),
+        )
+
+    def write(self, posts: list[ExistingPost]) -> set[Path]:
+        """Write the pages and JSON page feeds of the listing.
+
+        Pages whose posts and links are unchanged are not rewritten.
+
+        Args:
+            posts: The posts, ordered chronologically.
+
+        Returns:
+            Every page and feed path of the listing.
+        """
+        shards = _page_shards(posts)
+        shard_dir = self.shard_dir
+        page_paths = [shard_dir / f"{number}.html" for number in range(1, len(shards))]
+        page_paths.append(self.first_page)
+        # The first page is never fetched as a feed, it is loaded as a page
+        feed_paths: list[Path | None] = [
+            shard_dir / f"{number}.json" for number in range(1, len(shards))
+        ]
+        feed_paths.append(None)
+        # Padded so idx is the older neighbor and idx + 2 the newer one
+        page_urls = [None, *(_site_url(self.site_dir, path) for path in page_paths), None]
+        feed_urls = [None, *(_site_url(self.site_dir, path) for path in feed_paths if path)]
+
+        for idx, shard in enumerate(shards):
+            links = {
+                "feed_url": feed_urls[idx],
+                "newer_url": page_urls[idx + 2],
+                "older_url": page_urls[idx],
+            }
+            self._write_shard((page_paths[idx], feed_paths[idx]), shard, links)
+        return set(page_paths) | {path for path in feed_paths if path}
+
+
+def _remove_stale_pages(site_dir: Path, root: Path, keep: set[Path]) -> int:
+    """Remove generated pages under a directory that are no longer built.
+
+    Args:
+        site_dir: The directory of the site.
+        root: The directory to clean.
+        keep: The pages that are still built.
+
+    Returns:
+        The number of pages removed.
+    """
+    manifest = build_manifest(site_dir)
+    removed = 0
+    for dir_path, _dirs, files in os.walk(root, topdown=False):
+        directory = Path(dir_path)
+        for name in files:
+            path = directory / name
+            if path.suffix in (".html", ".json") and path not in keep:
+                path.unlink()
+                remove_sidecars(path)
+                manifest.forget(path)
+                removed += 1
+        if directory != root and not any(directory.iterdir()):
+            directory.rmdir()
+    return removed
+
+
+def _archive_listings(
+    posts: list[ExistingPost], archive_dir: Path
+) -> list[tuple[_Listing, list[ExistingPost]]]:
+    """Group posts into the year and month archive listings.
+
+    Args:
+        posts: The posts, ordered chronologically.
+        archive_dir: The directory of the archive pages.
+
+    Returns:
+        Each year listing, then each month listing, with its posts.
+    """
+    site_dir = archive_dir.parent
+    years: dict[int, list[ExistingPost]] = {}
+    months: dict[tuple[int, int], list[ExistingPost]] = {}
+    for post in posts:
+        years.setdefault(post.date.year, []).append(post)
+        months.setdefault((post.date.year, post.date.month), []).append(post)
+
+    listings = [
+        (_Listing(site_dir, archive_dir / f"{year}.html", str(year), ARCHIVE_ICON), year_posts)
+        for year, year_posts in years.items()
+    ]
+    for (year, month), month_posts in months.items():
+        title = month_posts[0].date.strftime("%B %Y")
+        page = archive_dir / f"{year}" / f"{month:02}.html"
+        listings.append((_Listing(site_dir, page, title, ARCHIVE_ICON), month_posts))
+    return listings
+
+
+def _write_archive(posts: list[ExistingPost], site_dir: Path) -> None:
+    """Write the year and month archive pages whose posts changed, and the month counts.
+
+    Each year and month is its own listing, archive/2014.html and
+    archive/2014/06.html, so adding, editing, or deleting a post only
+    writes the pages of its year and month. archive/months.json maps each
+    month with posts, such as 2014-06, to its post count, oldest first.
+
+    Args:
+        posts: The posts, ordered chronologically.
+        site_dir: The directory of the site.
+    """
+    archive_dir = site_dir / "archive"
+    keep: set[Path] = set()
+    for listing, listing_posts in _archive_listings(posts, archive_dir):
+        keep |= listing.write(listing_posts)
+
+    counts: dict[str, int] = {}
+    for post in posts:
+        month = post.date.strftime("%Y-%m")
+        counts[month] = counts.get(month, 0) + 1
+    counts_path = archive_dir / "months.json"
+    _write_page(
+        site_dir,
+        counts_path,
+        signature(counts),
+        functools.partial(json.dumps, counts, separators=(",", ":")),
+    )
+    keep.add(counts_path)
+    removed = _remove_stale_pages(site_dir, archive_dir, keep)
+    logger.debug("Archive pages: %s current, %s removed", len(keep), removed)
+
+
+def write_index(posts: list[ExistingPost], site_dir: Path) -> None:
+    """Write the index page shards and feed, and the year and month archive.
+
+    Args:
+        posts: The posts, ordered chronologically.
+        site_dir: The directory of the site.
+    """
+    listing = _Listing(site_dir, site_dir / "index.html", "everything", None)
+    keep = listing.write(posts)
+    _remove_stale_pages(site_dir, site_dir / "page", keep)
+    _write_archive(posts, site_dir)
+    build_manifest(site_dir).save()
+
+
+def write_tag_indices(posts: list[ExistingPost], site_dir: Path) -> None:
+    """Write the tag files whose posts changed.
+
+    Args:
+        posts: The posts.
+        site_dir: The directory of the site.
+    """
+    all_tags: dict[str, list[ExistingPost]] = {}
+    for post in posts:
+        for tag in post.tags:
+            if tag not in all_tags:
+                all_tags[tag] = []
+            all_tags[tag].append(post)
+
+    tag_dir = site_dir / "tags"
+    keep: set[Path] = set()
+    for tag, matching_posts in all_tags.items():
+        listing = _Listing(site_dir, tag_dir / f"{_slugify(tag)}.html", tag, "tag")
+        keep |= listing.write(matching_posts)
+    removed = _remove_stale_pages(site_dir, tag_dir, keep)
+    build_manifest(site_dir).save()
+    logger.debug("Tag pages: %s current, %s removed", len(keep), removed)
+
+
+def write_author_indices(posts: list[ExistingPost], site_dir: Path) -> None:
+    """Write the author files whose posts changed.
+
+    Args:
+        posts: The posts.
+        site_dir: The directory of the site.
+    """
+    all_authors: dict[str, list[ExistingPost]] = {}
+    for post in posts:
+        author = post.author
+        if author not in all_authors:
+            all_authors[author] = []
+        all_authors[author].append(post)
+
+    author_dir = site_dir / "authors"
+    keep: set[Path] = set()
+    for author, matching_posts in all_authors.items():
+        listing = _Listing(site_dir, author_dir / f"{_slugify(author)}.html", author, "person")
+        keep |= listing.write(matching_posts)
+    removed = _remove_stale_pages(site_dir, author_dir, keep)
+    build_manifest(site_dir).save()
+    logger.debug("Author pages: %s current, %s removed", len(keep), removed)
@@ -0,0 +1,407 @@
+"""Stream uploads to the media store in a single pass."""
+import errno
+import hashlib
+import logging
+import os
+import re
+import struct
+import uuid
+
+from mmap import ACCESS_READ
+from mmap import mmap
+from pathlib import Path
+from typing import IO
+from typing import Any
+
+from flask import Request
+from flask import current_app
+
+from .catalog import STATE_DIR_NAME
+
+
+logger = logging.getLogger(__name__)
+
+# The MP4 brand that marks the video appended to a Google motion photo
+MOTION_MARKER = b"ftypisom"
+
+# The number of leading bytes used to sniff the MIME type
+SNIFF_SIZE = 8192
+
+# The buffer size of a copy the kernel cannot do
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The signature that starts the APP1 segment holding the XMP packet of a JPEG
+XMP_SIGNATURE = b"http://ns.adobe.com/xap/1.0/\x00"
+
+# JPEG markers without a length, the start of image, restart, and TEM markers
+_STANDALONE_MARKERS = {0x01, 0xD8, *range(0xD0, 0xD8)}
+
+# JPEG markers after which no more metadata segments follow, start of scan and end of image
+_LAST_MARKERS = {0xD9, 0xDA}
+
+_CONTAINER_ITEM = re.compile(r"<(?:\w+:)?Item(?=[\s/>])([^>]*)>")
+
+
+def _xmp_value(xmp: str, name: str) -> str | None:
+    """Get a property from an XMP packet, written as an attribute or an element.
+
+    Args:
+        xmp: The XMP packet.
+        name: The property name, without its namespace prefix.
+
+    Returns:
+        The value, or None if the property is not set.
+    """
+    match = re.search(
+        rf'\b(?:\w+:)?{name}\s*=\s*"([^"]*)"|<(?:\w+:)?{name}>([^<]*)<',
+        xmp,
+    )
+    if match is None:
+        return None
+    return (match.group(1) if match.group(1) is not None else match.group(2)).strip()
+
+
+def _next_segment(image: IO[bytes]) -> tuple[int, int] | None:
+    """Read the header of the next JPEG marker segment.
+
+    Args:
+        image: The image, just after the 0xff byte that starts a marker.
+
+    Returns:
+        The marker and the length of the segment data, or None at the
+        image data, the end of the image, or anything that is not a marker.
+    """
+    marker = 0xFF
+    # Any number of 0xff fill bytes may come before a marker
+    while marker == 0xFF:
+        byte = image.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+    if marker in _STANDALONE_MARKERS:
+        return marker, 0
+    length_bytes = image.read(2)
+    if marker in _LAST_MARKERS or len(length_bytes) < 2:
+        return None
+    return marker, max(0, struct.unpack(">H", length_bytes)[0] - 2)
+
+
+def _read_xmp(image: IO[bytes]) -> str | None:
+    """Read the XMP packet of a JPEG, walking its marker segments.
+
+    Only the segment headers and the XMP segment are read, the metadata
+    segments all come before the image data.
+
+    Args:
+        image: The image, at its start.
+
+    Returns:
+        The XMP packet, or None if the image is not a JPEG or has none.
+    """
+    if image.read(2) != b"\xff\xd8":
+        return None
+    while image.read(1) == b"\xff":
+        segment = _next_segment(image)
+        if segment is None:
+            break
+        marker, length = segment
+        if marker == 0xE1 and length >= len(XMP_SIGNATURE):
+            if image.read(len(XMP_SIGNATURE)) == XMP_SIGNATURE:
+                return image.read(length - len(XMP_SIGNATURE)).decode("utf-8", "replace")
+            length -= len(XMP_SIGNATURE)
+        image.seek(length, os.SEEK_CUR)
+    return None
+
+
+def _xmp_motion_offset(xmp: str, size: int) -> int | None:
+    """Find the video offset described by motion photo XMP metadata.
+
+    Newer motion photos list the appended files in a Container:Directory,
+    each with its length, older ones set MicroVideoOffset, the length of
+    the video, which is at the end of the file.
+
+    Args:
+        xmp: The XMP packet.
+        size: The size of the file.
+
+    Returns:
+        The offset the video starts at, or None if the metadata describes none.
+    """
+    items = [
+        dict(re.findall(r'\b(?:\w+:)?(\w+)="([^"]*)"', attributes))
+        for attributes in _CONTAINER_ITEM.findall(xmp)
+    ]
+    # The files after the primary image are appended in order, so each
+    # video starts before the combined length of itself and the files after it
+    trailing = 0
+    for item in reversed(items):
+        if item.get("Semantic") == "Primary":
+            break
+        try:
+            trailing += int(item.get("Length", 0)) + int(item.get("Padding", 0))
+        except ValueError:
+            return None
+        if item.get("Mime", "").startswith("video/") and item.get("Length"):
+            return size - trailing + int(item.get("Padding", 0))
+    micro_video = _xmp_value(xmp, "MicroVideoOffset")
+    if micro_video and micro_video.isdigit() and int(micro_video):
+        return size - int(micro_video)
+    return None
+
+
+def read_motion_metadata(image: IO[bytes], size: int) -> int | None:
+    """Find the video of a motion photo from its XMP metadata.
+
+    Args:
+        image: The image, at its start.
+        size: The size of the image file.
+
+    Returns:
+        The offset the video starts at, 0 if the image has XMP metadata
+        that describes no video, or None if it has no XMP metadata or the
+        offset it describes does not point at an MP4 file.
+    """
+    xmp = _read_xmp(image)
+    if xmp is None:
+        return None
+    offset = _xmp_motion_offset(xmp, size)
+    if offset is None:
+        return 0
+    if not 0 < offset < size - len(MOTION_MARKER):
+        return None
+    image.seek(offset)
+    # An MP4 file starts with the 4 byte size of its ftyp box
+    if image.read(8)[4:] != b"ftyp":
+        logger.debug("Motion photo metadata points at %s, not at a video", offset)
+        return None
+    return offset
+
+
+def find_motion_offset(path: Path) -> int | None:
+    """Find the video appended to a motion photo already on disk.
+
+    The XMP metadata is used when there is some, only images without it
+    are searched for the start of an MP4 file.
+
+    Args:
+        path: The image.
+
+    Returns:
+        The offset the video starts at, or None if there is none.
+    """
+    size = path.stat().st_size
+    with path.open("rb") as image:
+        offset = read_motion_metadata(image, size)
+        if offset is not None:
+            return offset or None
+        if size == 0:
+            return None
+        with mmap(image.fileno(), 0, access=ACCESS_READ) as mem_map:
+            place = mem_map.find(MOTION_MARKER)
+            if place in (-1, size - len(MOTION_MARKER)) or place < 4:
+                return None
+            # The marker follows the 4 byte size of the MP4 ftyp box
+            return place - 4
+
+
+def copy_range(source: Path, target: Path, offset: int, count: int) -> None:
+    """Copy part of a file without passing the data through Python.
+
+    The kernel copies the data with copy_file_range, or sendfile where
+    that is not supported, and a small buffered copy is the last resort.
+
+    Args:
+        source: The file to copy from.
+        target: The file to write, replaced if it exists.
+        offset: The offset to copy from.
+        count: The number of bytes to copy.
+
+    Raises:
+        OSError: If the copy fails for a reason other than lack of support.
+    """
+    with source.open("rb") as src, target.open("wb") as dst:
+        copied = 0
+        while copied < count:
+            try:
+                if hasattr(os, "copy_file_range"):
+                    sent = os.copy_file_range(
+                        src.fileno(), dst.fileno(), count - copied, offset + copied
+                    )
+                else:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), offset + copied, count - copied)
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                src.seek(offset + copied)
+                dst.seek(copied)
+                while copied < count:
+                    chunk = src.read(min(COPY_CHUNK_SIZE, count - copied))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    copied += len(chunk)
+                return
+            if sent == 0:
+                break
+            copied += sent
+
+
+class IngestFile:
+    """A file upload written once, hashed, sniffed, and scanned on the way in.
+
+    The werkzeug form parser writes each uploaded file into one of these.
+    The data goes to a staging file next to the media store, so storing it
+    is a rename, and the digest, MIME type, and motion photo offset are
+    known without reading the file back.
+    """
+
+    def __init__(self, incoming_dir: Path) -> None:
+        """Initialize the upload.
+
+        Args:
+            incoming_dir: The staging directory, on the media store file system.
+        """
+        incoming_dir.mkdir(parents=True, exist_ok=True)
+        self.path = incoming_dir / uuid.uuid4().hex
+        self.size = 0
+        self._file: IO[bytes] = self.path.open("w+b")
+        self._hash = hashlib.sha256()
+        self._head = b""
+        self._marker_at: int | None = None
+        # The end of the data already searched, kept to find a marker split across writes
+        self._tail = b""
+
+    def write(self, data: bytes) -> int:
+        """Write a chunk of the upload.
+
+        Args:
+            data: The chunk.
+
+        Returns:
+            The number of bytes written.
+        """
+        self._hash.update(data)
+        if len(self._head) < SNIFF_SIZE:
+            self._head += data[: SNIFF_SIZE - len(self._head)]
+        if self._marker_at is None:
+            window = self._tail + data
+            found = window.find(MOTION_MARKER)
+            if found != -1:
+                self._marker_at = self.size - len(self._tail) + found
+            self._tail = window[-(len(MOTION_MARKER) - 1) :]
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def digest(self) -> str:
+        """Get the sha256 of the upload.
+
+        Returns:
+            The hex digest.
+        """
+        return self._hash.hexdigest()
+
+    @property
+    def mime_type(self) -> str:
+        """Get the MIME type sniffed from the start of the upload.
+
+        Returns:
+            The MIME type.
+        """
+        import magic  # pylint: disable=import-outside-toplevel
+
+        return str(magic.from_buffer(self._head, mime=True))
+
+    @property
+    def motion_offset(self) -> int | None:
+        """Get the offset of the video appended to a motion photo.
+
+        The XMP metadata at the start of the upload is used when there is
+        some, otherwise the position of the MP4 marker seen while writing.
+
+        Returns:
+            The offset the video starts at, or None if there is none.
+        """
+        self._file.seek(0)
+        offset = read_motion_metadata(self._file, self.size)
+        if offset is not None:
+            return offset or None
+        if self._marker_at is None or self._marker_at == self.size - len(MOTION_MARKER):
+            return None
+        if self._marker_at < 4:
+            return None
+        return self._marker_at - 4
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """Move the file position, as werkzeug does once the upload is written.
+
+        Args:
+            offset: The position.
+            whence: What the position is relative to.
+
+        Returns:
+            The new position.
+        """
+        return self._file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        """Read from the staged upload.
+
+        Args:
+            size: The number of bytes to read, -1 for all.
+
+        Returns:
+            The data.
+        """
+        return self._file.read(size)
+
+    def claim(self) -> Path:
+        """Close the staged upload so it can be moved into the store.
+
+        Returns:
+            The staged file.
+        """
+        self._file.close()
+        return self.path
+
+    def close(self) -> None:
+        """Close the upload and remove it if it was not claimed."""
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    def __getattr__(self, name: str) -> Any:
+        """Pass other file methods to the staged file.
+
+        Args:
+            name: The attribute name.
+
+        Returns:
+            The attribute of the staged file.
+        """
+        return getattr(self._file, name)
+
+
+class IngestRequest(Request):
+    """A request that streams file uploads into the media store staging area."""
+
+    def _get_file_stream(
+        self,
+        total_content_length: int | None,
+        content_type: str | None,
+        filename: str | None = None,
+        content_length: int | None = None,
+    ) -> IO[bytes]:
+        """Get the file an uploaded file is written to.
+
+        Args:
+            total_content_length: The length of the request body.
+            content_type: The MIME type sent by the client.
+            filename: The uploaded file name.
+            content_length: The length of this file, if sent.
+
+        Returns:
+            An upload that is hashed and sniffed as it is written.
+        """
+        logger.debug("Streaming upload %s, %s", filename, content_type)
+        incoming_dir = Path(current_app.config["site_dir"]) / STATE_DIR_NAME / "incoming"
+        return IngestFile(incoming_dir)  # type: ignore[return-value]
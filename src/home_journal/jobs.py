@@ -0,0 +1,268 @@
+"""A durable local job queue for work done after a post is saved."""
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from collections.abc import Callable
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .catalog import STATE_DIR_NAME
+from .catalog import read_state_file
+from .catalog import write_state_file
+from .metrics import collect_stages
+from .metrics import format_stages
+from .metrics import job_seconds
+
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Path, dict[str, Any]], None]
+
+# Finished jobs are kept this long for the status endpoint
+FINISHED_JOB_TTL = 24 * 60 * 60
+
+
+@dataclass(kw_only=True)
+class Job:
+    """A unit of background work."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    # The handler arguments
+    args: dict[str, Any]
+    # The time the job was submitted
+    created: float
+    # The job id
+    job_id: str
+    # The handler name
+    kind: str
+
+    # The error message if the job failed
+    error: str | None = None
+    # The time the job finished
+    finished: float | None = None
+    # The time the job started
+    started: float | None = None
+    # One of queued, running, done, or failed
+    state: str = "queued"
+
+
+class JobQueue:
+    """A job queue persisted in the site state directory.
+
+    Each job is stored as a JSON file so queued and interrupted jobs are
+    picked up again when the server restarts. A fixed number of worker
+    threads run the jobs, and the queue reports itself full once too many
+    jobs are waiting so callers can push back.
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        site_dir: Path,
+        handlers: dict[str, JobHandler],
+        workers: int = 2,
+        max_pending: int = 16,
+    ) -> None:
+        """Initialize the job queue.
+
+        Args:
+            site_dir: The directory of the site.
+            handlers: The handler for each job kind.
+            workers: The number of worker threads.
+            max_pending: The number of waiting jobs at which the queue is full.
+        """
+        self.site_dir = site_dir
+        self.handlers = handlers
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 1)
+        self._jobs: dict[str, Job] = {}
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._lock = threading.Lock()
+
+    @property
+    def job_dir(self) -> Path:
+        """Get the directory holding the persisted jobs.
+
+        Returns:
+            The job directory in the site state directory.
+        """
+        return self.site_dir / STATE_DIR_NAME / "jobs"
+
+    def _save(self, job: Job) -> None:
+        """Persist a job.
+
+        Args:
+            job: The job to persist.
+        """
+        write_state_file(self.job_dir / f"{job.job_id}.json", self.VERSION, {"job": asdict(job)})
+
+    def _restore(self) -> None:
+        """Load persisted jobs, requeue unfinished ones, and drop old ones."""
+        if not self.job_dir.is_dir():
+            return
+        now = time.time()
+        for path in sorted(self.job_dir.glob("*.json")):
+            stored = read_state_file(path, self.VERSION)
+            if stored is None:
+                path.unlink()
+                continue
+            job = Job(**stored["job"])
+            if job.finished is not None and now - job.finished > FINISHED_JOB_TTL:
+                path.unlink()
+                continue
+            self._jobs[job.job_id] = job
+            if job.state in ("queued", "running"):
+                logger.info("Requeueing %s job %s", job.kind, job.job_id)
+                job.state = "queued"
+                self._queue.put(job.job_id)
+
+    def start(self) -> None:
+        """Restore persisted jobs and start the worker threads."""
+        with self._lock:
+            self._restore()
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{idx}", daemon=True)
+            thread.start()
+        logger.info("Started %s job workers, %s jobs queued", self.workers, self.depth)
+
+    @property
+    def running(self) -> int:
+        """Get the number of jobs being run.
+
+        Returns:
+            The number of running jobs.
+        """
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == "running")
+
+    @property
+    def depth(self) -> int:
+        """Get the number of jobs waiting to run.
+
+        Returns:
+            The number of queued jobs.
+        """
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == "queued")
+
+    def full(self) -> bool:
+        """Check if the queue should refuse new work.
+
+        Returns:
+            True if the number of waiting jobs reached the limit.
+        """
+        return self.depth >= self.max_pending
+
+    def submit(self, kind: str, args: dict[str, Any]) -> Job:
+        """Persist and queue a job.
+
+        Args:
+            kind: The handler name.
+            args: The handler arguments, must be JSON serializable.
+
+        Returns:
+            The queued job.
+
+        Raises:
+            ValueError: If there is no handler for the kind.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind}")
+        job = Job(args=args, created=time.time(), job_id=uuid.uuid4().hex, kind=kind)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._save(job)
+        self._queue.put(job.job_id)
+        logger.debug("Queued %s job %s", kind, job.job_id)
+        return job
+
+    def status(self, job_id: str) -> Job | None:
+        """Get a job by id.
+
+        Args:
+            job_id: The job id.
+
+        Returns:
+            The job, or None if it is unknown.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def unfinished(self, kind: str) -> list[Job]:
+        """Get the jobs of a kind that are queued or running.
+
+        Args:
+            kind: The handler name.
+
+        Returns:
+            The jobs, in no particular order.
+        """
+        with self._lock:
+            return [
+                job
+                for job in self._jobs.values()
+                if job.kind == kind and job.state in ("queued", "running")
+            ]
+
+    def _prune(self) -> None:
+        """Forget finished jobs past their retention time."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished is not None and now - job.finished > FINISHED_JOB_TTL
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                (self.job_dir / f"{job_id}.json").unlink(missing_ok=True)
+
+    def _run(self, job: Job) -> None:
+        """Run a single job and record the outcome.
+
+        Args:
+            job: The job to run.
+        """
+        with self._lock:
+            job.state = "running"
+            job.started = time.time()
+            self._save(job)
+        logger.info("Running %s job %s", job.kind, job.job_id)
+        with collect_stages() as stages:
+            try:
+                self.handlers[job.kind](self.site_dir, job.args)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.exception("Job %s failed", job.job_id)
+                job.state = "failed"
+                job.error = str(exc)
+            else:
+                job.state = "done"
+        with self._lock:
+            job.finished = time.time()
+            self._save(job)
+        seconds = job.finished - job.started
+        job_seconds.observe(seconds, kind=job.kind, result=job.state)
+        logger.info(
+            "Finished %s job %s in %.2fs: %s",
+            job.kind,
+            job.job_id,
+            seconds,
+            format_stages(stages),
+        )
+
+    def _work(self) -> None:
+        """Run jobs from the queue until the process exits."""
+        while True:
+            job_id = self._queue.get()
+            job = self.status(job_id)
+            if job is not None and job.state == "queued":
+                self._run(job)
+            self._queue.task_done()
+            self._prune()
@@ -0,0 +1,132 @@
+"""A manifest of generated pages and the inputs they were built from."""
+import hashlib
+import json
+import threading
+
+from pathlib import Path
+
+from .catalog import STATE_DIR_NAME
+from .catalog import read_state_file
+from .catalog import write_state_file
+
+
+def signature(*parts: object) -> str:
+    """Hash the inputs of a generated page.
+
+    Args:
+        *parts: JSON serializable inputs, other values are converted to strings.
+
+    Returns:
+        A hex digest of the inputs.
+    """
+    encoded = json.dumps(parts, default=str, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class BuildManifest:
+    """Record the input signature of each generated page.
+
+    A page whose inputs hash to the recorded signature, and which still
+    exists on disk, does not need to be rendered again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the manifest.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        self.path = site_dir / STATE_DIR_NAME / "build.json"
+        self.signatures: dict[str, str] = {}
+        self._dirty = False
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _key(self, path: Path) -> str:
+        """Get the manifest key for a page.
+
+        Args:
+            path: The page path.
+
+        Returns:
+            The path relative to the site directory.
+        """
+        return path.relative_to(self.site_dir).as_posix()
+
+    def _ensure_loaded(self) -> None:
+        """Load the manifest from disk on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        stored = read_state_file(self.path, self.VERSION)
+        if stored is not None:
+            self.signatures = dict(stored.get("signatures", {}))
+
+    def is_current(self, path: Path, page_signature: str) -> bool:
+        """Check if a page was built from the same inputs.
+
+        Args:
+            path: The page path.
+            page_signature: The signature of the current inputs.
+
+        Returns:
+            True if the page exists and its signature matches.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            recorded = self.signatures.get(self._key(path))
+        return recorded == page_signature and path.exists()
+
+    def record(self, path: Path, page_signature: str) -> None:
+        """Record the signature of a page that was written.
+
+        Args:
+            path: The page path.
+            page_signature: The signature of the inputs it was built from.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self.signatures[self._key(path)] = page_signature
+            self._dirty = True
+
+    def forget(self, path: Path) -> None:
+        """Drop a page that was removed.
+
+        Args:
+            path: The page path.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if self.signatures.pop(self._key(path), None) is not None:
+                self._dirty = True
+
+    def save(self) -> None:
+        """Write the manifest to disk if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            write_state_file(self.path, self.VERSION, {"signatures": self.signatures})
+            self._dirty = False
+
+
+_manifests: dict[Path, BuildManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def build_manifest(site_dir: Path) -> BuildManifest:
+    """Get the shared build manifest for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The build manifest, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = BuildManifest(site_dir)
+        return _manifests[key]
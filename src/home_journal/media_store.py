@@ -0,0 +1,441 @@
+"""A content addressed store for uploaded media."""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from pathlib import Path
+
+from .catalog import STATE_DIR_NAME
+from .catalog import read_state_file
+from .catalog import write_state_file
+from .file_events import file_changed
+from .pool import process_map
+
+
+logger = logging.getLogger(__name__)
+
+# Stored files this recent are never pruned, the post using them may not be listed yet
+PRUNE_GRACE_SECONDS = 60 * 60
+
+
+def hash_file(path: Path) -> str:
+    """Hash a file without reading it into memory at once.
+
+    Args:
+        path: The file.
+
+    Returns:
+        The sha256 hex digest.
+    """
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def post_media(media_dir: Path) -> list[Path]:
+    """List the media files of a post.
+
+    Args:
+        media_dir: The media directory of the post.
+
+    Returns:
+        The media files, without thumbnails from older builds.
+    """
+    try:
+        names = sorted(path.name for path in media_dir.iterdir())
+    except FileNotFoundError:
+        return []
+    return [
+        media_dir / name
+        for name in names
+        if not name.startswith(("thumb_", ".")) and (media_dir / name).is_file()
+    ]
+
+
+class MediaStore:
+    """Keep one copy of each media file, linked into the posts that use it.
+
+    Files are stored under the site state directory, named by their
+    sha256. Post media files are hardlinks to the stored file, or
+    symlinks where hardlinks are not possible. The digest of each post
+    media file is cached against its stat data, so a file is only read
+    again when it changes. Files derived from another one, such as the
+    video split from a motion photo, are recorded against the digest of
+    their source so a repeated upload can reuse them.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    VERSION = 1
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the store.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        # Media path relative to the site: [mtime_ns, size, digest]
+        self.sources: dict[str, list[int | str]] = {}
+        # "<source digest>:<kind>": derived digest
+        self.derived: dict[str, str] = {}
+        # Digest: MIME type, as sniffed when the file was uploaded
+        self.types: dict[str, str] = {}
+        # Digest: the time this process last stored or linked the file
+        self._linked: dict[str, float] = {}
+        self._dirty = False
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    @property
+    def path(self) -> Path:
+        """Get the store index file.
+
+        Returns:
+            The index file in the site state directory.
+        """
+        return self.site_dir / STATE_DIR_NAME / "media.json"
+
+    @property
+    def objects_dir(self) -> Path:
+        """Get the directory holding the stored files.
+
+        Returns:
+            The object directory in the site state directory.
+        """
+        return self.site_dir / STATE_DIR_NAME / "media"
+
+    def object_path(self, digest: str) -> Path:
+        """Get the path of a stored file.
+
+        Args:
+            digest: The sha256 of the file.
+
+        Returns:
+            The path, which may not exist.
+        """
+        return self.objects_dir / digest[:2] / digest
+
+    def _ensure_loaded(self) -> None:
+        """Load the store index from disk on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        stored = read_state_file(self.path, self.VERSION) or {}
+        self.sources = dict(stored.get("sources", {}))
+        self.derived = dict(stored.get("derived", {}))
+        self.types = dict(stored.get("types", {}))
+
+    def save(self) -> None:
+        """Write the store index to disk if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            write_state_file(
+                self.path,
+                self.VERSION,
+                {"derived": self.derived, "sources": self.sources, "types": self.types},
+            )
+            self._dirty = False
+
+    def _key(self, path: Path) -> str:
+        """Get the index key of a media file.
+
+        Args:
+            path: The media file.
+
+        Returns:
+            The path relative to the site directory.
+        """
+        return path.relative_to(self.site_dir).as_posix()
+
+    def _cached(self, path: Path) -> str | None:
+        """Get the cached digest of a media file, if its stat data is unchanged.
+
+        Args:
+            path: The media file.
+
+        Returns:
+            The digest, or None if the file is missing, changed, or unknown.
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        cached = self.sources.get(self._key(path))
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return str(cached[2])
+        return None
+
+    def _record(self, path: Path, digest: str) -> None:
+        """Record the digest of a media file against its current stat data.
+
+        Args:
+            path: The media file.
+            digest: The sha256 of the file.
+        """
+        stat = path.stat()
+        self.sources[self._key(path)] = [stat.st_mtime_ns, stat.st_size, digest]
+        self._dirty = True
+
+    def digests(self, paths: list[Path], jobs: int = 1) -> dict[Path, str]:
+        """Get the digest of media files, hashing those not seen before.
+
+        Args:
+            paths: The media files.
+            jobs: The number of processes used to hash files.
+
+        Returns:
+            The digest of each file that exists.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            found = {path: self._cached(path) for path in paths}
+        unhashed = [path for path, digest in found.items() if digest is None and path.is_file()]
+        hashed = dict(zip(unhashed, process_map(hash_file, unhashed, jobs)))
+        with self._lock:
+            for path, digest in hashed.items():
+                self._record(path, digest)
+        self.save()
+        found.update(hashed)
+        return {path: digest for path, digest in found.items() if digest is not None}
+
+    def link(self, digest: str, path: Path) -> None:
+        """Replace a path with a link to a stored file.
+
+        Args:
+            digest: The sha256 of the stored file.
+            path: The post media path to link.
+        """
+        stored = self.object_path(digest)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(stored, tmp_path)
+        except OSError:
+            tmp_path.symlink_to(os.path.relpath(stored, path.parent))
+        tmp_path.replace(path)
+        file_changed(path)
+        with self._lock:
+            self._ensure_loaded()
+            self._linked[digest] = time.time()
+            self._record(path, digest)
+        self.save()
+
+    def _store(self, path: Path, digest: str, move: bool) -> bool:
+        """Make a post media file the stored copy of its content.
+
+        Args:
+            path: The post media file.
+            digest: The sha256 of the file.
+            move: Move the file into the store and symlink it if it cannot be hardlinked.
+
+        Returns:
+            True if the file is now in the store.
+        """
+        stored = self.object_path(digest)
+        stored.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, stored)
+        except FileExistsError:
+            return True
+        except OSError:
+            if not move:
+                return False
+            path.replace(stored)
+            path.symlink_to(os.path.relpath(stored, path.parent))
+            file_changed(path)
+        return True
+
+    def add(self, path: Path, mime_type: str | None = None) -> str:
+        """Store a new media file, or link it to an identical stored one.
+
+        Args:
+            path: The new file, in the post media directory.
+            mime_type: The MIME type of the file, if known.
+
+        Returns:
+            The sha256 of the file.
+        """
+        digest = hash_file(path)
+        with self._lock:
+            self._ensure_loaded()
+            if mime_type:
+                self.types[digest] = mime_type
+            if self.object_path(digest).exists():
+                logger.debug("Linking duplicate upload %s", path)
+                self.link(digest, path)
+            else:
+                self._store(path, digest, move=True)
+                self._linked[digest] = time.time()
+                self._record(path, digest)
+        self.save()
+        return digest
+
+    def add_staged(self, staged: Path, digest: str, path: Path, mime_type: str) -> None:
+        """Move an upload staged on the store file system into the store.
+
+        Args:
+            staged: The staged upload, already hashed.
+            digest: The sha256 of the upload.
+            path: The post media path to link.
+            mime_type: The MIME type of the upload.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            stored = self.object_path(digest)
+            if stored.exists():
+                logger.debug("Linking duplicate upload %s", path)
+                staged.unlink()
+            else:
+                stored.parent.mkdir(parents=True, exist_ok=True)
+                staged.replace(stored)
+            self.types[digest] = mime_type
+            self.link(digest, path)
+
+    def mime_types(self, paths: list[Path]) -> dict[str, str]:
+        """Get the recorded MIME types of media files without reading them.
+
+        Args:
+            paths: The media files.
+
+        Returns:
+            The MIME type by file name, for files whose type is known.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            digests = {path.name: self._cached(path) for path in paths}
+            return {
+                name: self.types[digest]
+                for name, digest in digests.items()
+                if digest is not None and digest in self.types
+            }
+
+    def adopt(self, paths: list[Path], jobs: int = 1) -> dict[Path, str]:
+        """Move media files that are not linked to the store yet into it.
+
+        Post media written before the store existed, or copied in by hand,
+        is hashed and then hardlinked to the stored copy, so duplicates
+        share one file. Files that cannot be hardlinked are left alone.
+
+        Args:
+            paths: The media files.
+            jobs: The number of processes used to hash files.
+
+        Returns:
+            The digest of each file that exists.
+        """
+        digests = self.digests(paths, jobs)
+        with self._lock:
+            for path, digest in digests.items():
+                stored = self.object_path(digest)
+                if stored.exists():
+                    if not path.samefile(stored):
+                        self.link(digest, path)
+                elif not self._store(path, digest, move=False):
+                    logger.debug("Could not store %s, hardlinks not supported", path)
+        self.save()
+        return digests
+
+    def find_derived(self, digest: str, kind: str) -> str | None:
+        """Find a file previously derived from a stored file.
+
+        Args:
+            digest: The sha256 of the source file.
+            kind: The kind of derived file, e.g. h264.
+
+        Returns:
+            The digest of the derived file, if it is still stored.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            derived = self.derived.get(f"{digest}:{kind}")
+        if derived is None or not self.object_path(derived).exists():
+            return None
+        return derived
+
+    def record_derived(self, digest: str, kind: str, derived: str) -> None:
+        """Record a file derived from a stored file.
+
+        Args:
+            digest: The sha256 of the source file.
+            kind: The kind of derived file, e.g. h264.
+            derived: The sha256 of the derived file.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self.derived[f"{digest}:{kind}"] = derived
+            self._dirty = True
+        self.save()
+
+    def prune(self, paths: list[Path]) -> set[str]:
+        """Forget removed media files and delete stored files no post uses.
+
+        The media files are listed before the store is pruned, so a post
+        being written meanwhile is not among them. Files stored or linked
+        within the grace period are kept, as are their types and derived
+        files, whether or not a listed file uses them.
+
+        Args:
+            paths: Every media file in the site.
+
+        Returns:
+            The digests still in use, or stored too recently to tell.
+        """
+        keep = {self._key(path) for path in paths}
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            for key in set(self.sources) - keep:
+                del self.sources[key]
+                self._dirty = True
+            self._linked = {
+                digest: linked
+                for digest, linked in self._linked.items()
+                if now - linked < PRUNE_GRACE_SECONDS
+            }
+            used = {str(value[2]) for value in self.sources.values()} | set(self._linked)
+            derived = {
+                key: value for key, value in self.derived.items() if key.split(":")[0] in used
+            }
+            types = {key: value for key, value in self.types.items() if key in used}
+            if derived != self.derived or types != self.types:
+                self.derived = derived
+                self.types = types
+                self._dirty = True
+            removed = 0
+            if self.objects_dir.is_dir():
+                for stored in self.objects_dir.glob("*/*"):
+                    if stored.name in used:
+                        continue
+                    stat = stored.stat()
+                    # A stored file still hardlinked from a post is in use, a new
+                    # one stored by another process may be about to be
+                    if stat.st_nlink == 1 and now - stat.st_mtime >= PRUNE_GRACE_SECONDS:
+                        stored.unlink()
+                        removed += 1
+            if removed:
+                logger.debug("Removed %s stored media files", removed)
+        self.save()
+        return used
+
+
+_stores: dict[Path, MediaStore] = {}
+_stores_lock = threading.Lock()
+
+
+def media_store(site_dir: Path) -> MediaStore:
+    """Get the shared media store for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The media store, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = MediaStore(site_dir)
+        return _stores[key]
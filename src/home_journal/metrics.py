@@ -0,0 +1,461 @@
+"""Process metrics, exposed in the Prometheus text format, and per-stage timings."""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket bounds in seconds, from a cached page to a long video transcode
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[str, ...]
+
+MetricT = TypeVar("MetricT", bound="Metric")
+
+
+def _escape(value: str) -> str:
+    """Escape a label value.
+
+    Args:
+        value: The label value.
+
+    Returns:
+        The value with backslashes, quotes, and line breaks escaped.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """Format the labels of a sample.
+
+    Args:
+        names: The label names.
+        values: The label values, in the order of the names.
+        extra: A preformatted label to add, such as the bucket bound.
+
+    Returns:
+        The labels in braces, or nothing for a sample without labels.
+    """
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value.
+
+    Args:
+        value: The value.
+
+    Returns:
+        The value, integers without a fraction.
+    """
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """A named metric with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        """Initialize the metric.
+
+        Args:
+            name: The metric name.
+            help_text: The description shown in the exposition.
+            labels: The label names.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _values(self, labels: dict[str, str]) -> LabelValues:
+        """Order label values by the label names.
+
+        Args:
+            labels: The label values by name.
+
+        Returns:
+            The label values.
+
+        Raises:
+            ValueError: If the labels do not match the label names.
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> list[str]:
+        """Format the samples of the metric, each kind of metric has its own.
+
+        Raises:
+            NotImplementedError: Always, for the base class.
+        """
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        """Format the metric with its help and type lines.
+
+        Returns:
+            The lines of the metric.
+        """
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        """Initialize the counter.
+
+        Args:
+            name: The metric name, ending in _total.
+            help_text: The description shown in the exposition.
+            labels: The label names.
+        """
+        super().__init__(name, help_text, labels)
+        self._counts: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add to the counter.
+
+        Args:
+            amount: The amount to add.
+            **labels: The label values.
+        """
+        key = self._values(labels)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        """Format the samples of the counter.
+
+        Returns:
+            One line per label set.
+        """
+        with self._lock:
+            counts = sorted(self._counts.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in counts
+        ]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, set directly or read when scraped."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        read: Callable[[], float] | None = None,
+    ) -> None:
+        """Initialize the gauge.
+
+        Args:
+            name: The metric name.
+            help_text: The description shown in the exposition.
+            labels: The label names.
+            read: Reads the value when the metrics are scraped, for a gauge without labels.
+        """
+        super().__init__(name, help_text, labels)
+        self.read = read
+        self._values_by_key: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge.
+
+        Args:
+            value: The value.
+            **labels: The label values.
+        """
+        key = self._values(labels)
+        with self._lock:
+            self._values_by_key[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add to the gauge.
+
+        Args:
+            amount: The amount to add, negative to subtract.
+            **labels: The label values.
+        """
+        key = self._values(labels)
+        with self._lock:
+            self._values_by_key[key] = self._values_by_key.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        """Format the samples of the gauge.
+
+        Returns:
+            One line per label set.
+        """
+        if self.read is not None:
+            try:
+                return [f"{self.name} {_format_value(self.read())}"]
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Could not read %s", self.name)
+                return []
+        with self._lock:
+            values = sorted(self._values_by_key.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Observed durations counted into buckets, with their count and sum."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """Initialize the histogram.
+
+        Args:
+            name: The metric name, ending in the unit such as _seconds.
+            help_text: The description shown in the exposition.
+            labels: The label names.
+            buckets: The upper bounds of the buckets, in increasing order.
+        """
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # Per label set: the count of each bucket, the total count, and the sum
+        self._series: dict[LabelValues, tuple[list[int], int, float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation.
+
+        Args:
+            value: The observed value.
+            **labels: The label values.
+        """
+        key = self._values(labels)
+        with self._lock:
+            counts, count, total = self._series.get(key, ([0] * len(self.buckets), 0, 0.0))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+            self._series[key] = (counts, count + 1, total + value)
+
+    def samples(self) -> list[str]:
+        """Format the buckets, count, and sum of each label set.
+
+        Returns:
+            The sample lines.
+        """
+        with self._lock:
+            series = sorted(
+                (key, list(counts), count, total)
+                for key, (counts, count, total) in self._series.items()
+            )
+        lines = []
+        for key, counts, count, total in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket} {bucket_count}")
+            infinity = _format_labels(self.labels, key, 'le="+Inf"')
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_bucket{infinity} {count}")
+            lines.append(f"{self.name}_count{labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        return lines
+
+
+class Registry:
+    """The metrics of the process, rendered together."""
+
+    def __init__(self) -> None:
+        """Initialize the registry."""
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: MetricT) -> MetricT:
+        """Add a metric, replacing one registered under the same name.
+
+        Args:
+            metric: The metric.
+
+        Returns:
+            The metric.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Format every metric in the text exposition format.
+
+        Returns:
+            The exposition.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(
+    Histogram(
+        "home_journal_stage_seconds",
+        "Duration of each build and publish step.",
+        labels=("stage",),
+    )
+)
+
+rebuild_bytes = registry.register(
+    Counter(
+        "home_journal_rebuild_written_bytes_total",
+        "Bytes written by site rebuilds, workers included.",
+    )
+)
+
+last_rebuild_bytes = registry.register(
+    Gauge(
+        "home_journal_last_rebuild_written_bytes",
+        "Bytes written by the last site rebuild, workers included.",
+    )
+)
+
+rebuilds = registry.register(
+    Counter("home_journal_rebuilds_total", "Site rebuilds, by how they ended.", labels=("result",))
+)
+
+ffmpeg_seconds = registry.register(
+    Histogram(
+        "home_journal_ffmpeg_seconds",
+        "Duration of each ffmpeg run, by whether it succeeded.",
+        labels=("result",),
+    )
+)
+
+coalesced_passes = registry.register(
+    Counter(
+        "home_journal_coalesced_passes_total",
+        "Rebuild passes merged into one that ran for a later request, by kind.",
+        labels=("kind",),
+    )
+)
+
+job_seconds = registry.register(
+    Histogram(
+        "home_journal_job_seconds",
+        "Duration of each background job, by kind and how it ended.",
+        labels=("kind", "result"),
+    )
+)
+
+# The stages timed in the current request or job, see collect_stages
+_stages: contextvars.ContextVar[list[tuple[str, float]] | None] = contextvars.ContextVar(
+    "stages", default=None
+)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a build or publish step.
+
+    The duration is added to the stage histogram, and to the breakdown
+    of the request or job being timed, if any.
+
+    Args:
+        name: The stage name.
+
+    Yields:
+        Nothing, the step runs in the with block.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, stage=name)
+        note_stage(name, seconds)
+
+
+def note_stage(name: str, seconds: float) -> None:
+    """Add a step timed elsewhere to the breakdown of the current request or job.
+
+    Args:
+        name: The stage name.
+        seconds: The duration of the step.
+    """
+    collected = _stages.get()
+    if collected is not None:
+        collected.append((name, seconds))
+
+
+@contextlib.contextmanager
+def collect_stages() -> Iterator[list[tuple[str, float]]]:
+    """Collect the stages timed in a request or job.
+
+    Yields:
+        The name and duration of each stage, in the order they finished.
+    """
+    collected: list[tuple[str, float]] = []
+    token = _stages.set(collected)
+    try:
+        yield collected
+    finally:
+        _stages.reset(token)
+
+
+def format_stages(stages: list[tuple[str, float]]) -> str:
+    """Format a stage breakdown for the log.
+
+    Args:
+        stages: The name and duration of each stage.
+
+    Returns:
+        The stages, such as convert_all_html=1.20s, build_thumbnails=0.31s.
+    """
+    return ", ".join(f"{name}={seconds:.2f}s" for name, seconds in stages) or "no stages"
+
+
+def bytes_written() -> int | None:
+    """Get the bytes this process passed to write calls so far.
+
+    Workers the process waited for are included.
+
+    Returns:
+        The byte count, or None where /proc is not available.
+    """
+    try:
+        lines = Path("/proc/self/io").read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    counters = dict(line.split(": ") for line in lines)
+    return int(counters["wchar"])
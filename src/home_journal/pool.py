@@ -0,0 +1,62 @@
+"""Run CPU bound rebuild work on a process pool."""
+import logging
+import multiprocessing
+import os
+
+from collections.abc import Callable
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def default_jobs() -> int:
+    """Get the default number of rebuild processes.
+
+    Returns:
+        The number of CPUs available to this process.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def process_map(
+    func: Callable[[T], R],
+    items: Sequence[T],
+    jobs: int,
+    chunksize: int | None = None,
+    initializer: Callable[[], None] | None = None,
+) -> list[R]:
+    """Apply a function to each item, in worker processes when it pays off.
+
+    Args:
+        func: A module level function, so it can be sent to a worker.
+        items: The items, each sent to a worker.
+        jobs: The number of worker processes, 1 runs in this process.
+        chunksize: Items per batch sent to a worker, defaults to a few batches per worker.
+        initializer: Run once in each worker before its first item, e.g. to load site state.
+
+    Returns:
+        The results, in the order of the items.
+    """
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    workers = min(jobs, len(items))
+    if chunksize is None:
+        # A few batches per worker so pickling does not dominate small items
+        chunksize = max(1, len(items) // (workers * 4))
+    # Spawned workers do not inherit the locks of the server threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=initializer
+    ) as executor:
+        results = list(executor.map(func, items, chunksize=chunksize))
+    logger.debug("Processed %s items with %s processes", len(items), workers)
+    return results
@@ -0,0 +1,188 @@
+"""Profile requests and rebuilds on demand, writing files standard tools open."""
+import contextlib
+import cProfile
+import logging
+import re
+import threading
+import tracemalloc
+
+from collections.abc import Callable
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of cProfile stats, opened with pstats or snakeviz, and tracemalloc snapshots
+PROFILE_SUFFIX = ".prof"
+SNAPSHOT_SUFFIX = ".tracemalloc"
+
+# The number of frames tracemalloc keeps for each allocation
+TRACEMALLOC_FRAMES = 10
+
+
+# A post count, or a function read for it once the measured code ran
+PostCount = int | Callable[[], int]
+
+
+def _count(post_count: PostCount) -> int:
+    """Read a post count.
+
+    Args:
+        post_count: The post count, or a function returning it.
+
+    Returns:
+        The post count.
+    """
+    return post_count() if callable(post_count) else post_count
+
+
+def _slug(label: str) -> str:
+    """Make a label safe for a file name.
+
+    Args:
+        label: The label, such as the method and path of a request.
+
+    Returns:
+        The label with runs of other characters replaced by a dash.
+    """
+    return re.sub(r"[^A-Za-z0-9]+", "-", label).strip("-").lower() or "root"
+
+
+class Profiler:
+    """Record profiles of a site while profiling is switched on.
+
+    One request or rebuild is profiled at a time, the others run as
+    usual. Work done in worker processes is not included.
+    """
+
+    def __init__(self, profile_dir: Path) -> None:
+        """Initialize the profiler, switched off.
+
+        Args:
+            profile_dir: The directory profiles are written to.
+        """
+        self.profile_dir = profile_dir
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        """Switch profiling on, tracing memory allocations from now on."""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.enabled = True
+        logger.info("Profiling on, writing profiles to %s", self.profile_dir)
+
+    def disable(self) -> None:
+        """Switch profiling off and stop tracing memory allocations."""
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        logger.info("Profiling off")
+
+    def _path(self, label: str, post_count: int, suffix: str) -> Path:
+        """Name a profile after what was profiled.
+
+        Args:
+            label: What was profiled, such as the method and path of a request.
+            post_count: The number of posts in the site.
+            suffix: The file suffix.
+
+        Returns:
+            The file, named by the time, label, and post count.
+        """
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S.%f")
+        return self.profile_dir / f"{stamp}-{_slug(label)}-{post_count}-posts{suffix}"
+
+    @contextlib.contextmanager
+    def profile(self, label: str, post_count: int) -> Iterator[None]:
+        """Record the calls made in the with block with cProfile.
+
+        Nothing is recorded while profiling is off or another profile is
+        being recorded.
+
+        Args:
+            label: What is profiled, such as the method and path of a request.
+            post_count: The number of posts in the site.
+
+        Yields:
+            Nothing, the profiled code runs in the with block.
+        """
+        if not self.enabled or not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                path = self._path(label, post_count, PROFILE_SUFFIX)
+                profile.dump_stats(path)
+                logger.info("Wrote the profile of %s to %s", label, path)
+        finally:
+            self._lock.release()
+
+    @contextlib.contextmanager
+    def memory(self, label: str, post_count: PostCount) -> Iterator[None]:
+        """Write tracemalloc snapshots from before and after the with block.
+
+        Both snapshots are named after the with block, so a count read from
+        a function includes the posts the measured code found.
+
+        Args:
+            label: What is measured, such as the function name.
+            post_count: The number of posts in the site, or a function returning it.
+
+        Yields:
+            Nothing, the measured code runs in the with block.
+        """
+        if not self.enabled or not tracemalloc.is_tracing():
+            yield
+            return
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            # Snapshots can only be taken until profiling is switched off
+            if tracemalloc.is_tracing():
+                after = tracemalloc.take_snapshot()
+                count = _count(post_count)
+                before.dump(str(self._path(f"{label}-before", count, SNAPSHOT_SUFFIX)))
+                after.dump(str(self._path(f"{label}-after", count, SNAPSHOT_SUFFIX)))
+                logger.info("Wrote memory snapshots of %s to %s", label, self.profile_dir)
+
+
+# The profiler of the running app or build, used by the functions profiled deep in a build
+_profiler: Profiler | None = None  # pylint: disable=invalid-name
+
+
+def use_profiler(profiler: Profiler | None) -> None:
+    """Set the profiler memory snapshots are written with.
+
+    Args:
+        profiler: The profiler, or None to take no snapshots.
+    """
+    global _profiler  # pylint: disable=global-statement
+    _profiler = profiler
+
+
+@contextlib.contextmanager
+def memory_snapshots(label: str, post_count: PostCount) -> Iterator[None]:
+    """Write tracemalloc snapshots around the with block while profiling is on.
+
+    Args:
+        label: What is measured, such as the function name.
+        post_count: The number of posts in the site, or a function returning it.
+
+    Yields:
+        Nothing, the measured code runs in the with block.
+    """
+    if _profiler is None:
+        yield
+        return
+    with _profiler.memory(label, post_count):
+        yield
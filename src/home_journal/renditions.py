@@ -0,0 +1,359 @@
+"""Display size renditions of post images."""
+import html
+import logging
+import re
+import shutil
+import threading
+
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import unquote
+
+from .catalog import IMAGE_SUFFIXES
+from .catalog import STATE_DIR_NAME
+from .catalog import read_state_file
+from .catalog import write_state_file
+from .media_store import media_store
+from .media_store import post_media
+from .pool import process_map
+from .videos import POSTER_PREFIX
+
+
+if TYPE_CHECKING:
+    from PIL.Image import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+# Renditions are served from here, one directory per source digest
+RENDITIONS_DIR_NAME = "renditions"
+
+# The widths generated for each image, narrower images get their own width only
+RENDITION_WIDTHS = (480, 960, 1600)
+
+# The width of the img fallback for browsers without srcset
+FALLBACK_WIDTH = 960
+
+# How wide an image is displayed on the post page
+RENDITION_SIZES = "(max-width: 1000px) 100vw, 1000px"
+
+# The color transparent images are flattened onto for the jpg fallback, webp keeps the alpha
+JPEG_BACKGROUND = (255, 255, 255)
+
+_IMG_TAG = re.compile(r'<img src="media/([^"]+)" alt="([^"]*)" />')
+
+
+@dataclass(kw_only=True)
+class Rendition:
+    """The renditions generated for one source image."""
+
+    # The sha256 of the source image
+    digest: str
+    # The height of the largest rendition
+    height: int
+    # The width of the largest rendition
+    width: int
+    # The widths generated, each as webp and jpg
+    widths: list[int]
+
+    def url(self, width: int, suffix: str) -> str:
+        """Get the URL of a single rendition.
+
+        Args:
+            width: The rendition width.
+            suffix: The file suffix, webp or jpg.
+
+        Returns:
+            The absolute URL path.
+        """
+        return f"/{RENDITIONS_DIR_NAME}/{self.digest}/{width}.{suffix}"
+
+    def srcset(self, suffix: str) -> str:
+        """Get the srcset of one format.
+
+        Args:
+            suffix: The file suffix, webp or jpg.
+
+        Returns:
+            The srcset attribute value.
+        """
+        return ", ".join(f"{self.url(width, suffix)} {width}w" for width in self.widths)
+
+    def picture(self, alt: str) -> str:
+        """Render the picture element replacing the original img tag.
+
+        Args:
+            alt: The escaped alt text of the original img tag.
+
+        Returns:
+            A picture element with a webp source and a jpg fallback.
+        """
+        fallback = max((w for w in self.widths if w <= FALLBACK_WIDTH), default=self.widths[0])
+        return (
+            "<picture>"
+            f'<source type="image/webp" srcset="{self.srcset("webp")}"'
+            f' sizes="{RENDITION_SIZES}" />'
+            f'<img src="{self.url(fallback, "jpg")}" srcset="{self.srcset("jpg")}"'
+            f' sizes="{RENDITION_SIZES}" width="{self.width}" height="{self.height}"'
+            f' style="--aspect: {self.width / self.height:.4f}"'
+            f' alt="{alt}" loading="lazy" decoding="async" />'
+            "</picture>"
+        )
+
+
+def _flatten(image: "PILImage") -> "PILImage":
+    """Flatten a transparent image onto the jpg background.
+
+    Args:
+        image: The image, in any mode.
+
+    Returns:
+        The image without an alpha channel.
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    if image.mode != "RGBA":
+        return image
+    flat = Image.new("RGB", image.size, JPEG_BACKGROUND)
+    flat.paste(image, mask=image.getchannel("A"))
+    return flat
+
+
+def make_renditions(job: tuple[Path, str, Path]) -> Rendition | str | None:
+    """Write the renditions of one source image.
+
+    Transparent images keep their alpha channel in the webp renditions.
+    Animated images get no renditions, they are shown as uploaded.
+
+    Args:
+        job: The source image, its digest, and the directory to write to.
+
+    Returns:
+        The rendition record, None for an animated image, or the error
+        message if the source is unreadable.
+    """
+    # Pillow is only loaded by the processes that decode images
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+    from PIL import ImageOps  # pylint: disable=import-outside-toplevel
+
+    source, digest, out_dir = job
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.tmp")
+    try:
+        with Image.open(source) as opened:
+            if getattr(opened, "is_animated", False):
+                return None
+            opened.draft("RGB", (RENDITION_WIDTHS[-1], RENDITION_WIDTHS[-1]))
+            image = ImageOps.exif_transpose(opened) or opened
+            if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+                image = image.convert("RGBA")
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            widths = [w for w in RENDITION_WIDTHS if w < image.width]
+            if image.width <= RENDITION_WIDTHS[-1]:
+                widths.append(image.width)
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            for rendition_width in widths:
+                size = (
+                    rendition_width,
+                    max(1, round(image.height * rendition_width / image.width)),
+                )
+                resized = image.resize(size, Image.Resampling.LANCZOS)
+                resized.save(tmp_dir / f"{rendition_width}.webp", quality=80, method=4)
+                _flatten(resized).save(
+                    tmp_dir / f"{rendition_width}.jpg", quality=82, progressive=True
+                )
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return str(exc) or type(exc).__name__
+    shutil.rmtree(out_dir, ignore_errors=True)
+    tmp_dir.replace(out_dir)
+    # The intrinsic size is that of the largest rendition
+    return Rendition(digest=digest, height=size[1], width=size[0], widths=widths)
+
+
+def rewrite_images(content: str, renditions: dict[str, Rendition]) -> str:
+    """Replace media img tags in rendered markdown with picture elements.
+
+    Images without renditions keep pointing at the original upload.
+
+    Args:
+        content: The rendered HTML of a post.
+        renditions: The renditions of the post images by file name.
+
+    Returns:
+        The HTML with picture elements.
+    """
+    if not renditions:
+        return content
+
+    def _replace(match: re.Match[str]) -> str:
+        rendition = renditions.get(html.unescape(unquote(match.group(1))))
+        return rendition.picture(match.group(2)) if rendition else match.group(0)
+
+    return _IMG_TAG.sub(_replace, content)
+
+
+def post_images(media_dir: Path) -> list[Path]:
+    """List the uploaded images of a post.
+
+    Args:
+        media_dir: The media directory of the post.
+
+    Returns:
+        The images, without generated thumbnails and video poster frames.
+    """
+    return [
+        path
+        for path in post_media(media_dir)
+        if path.suffix.lower() in IMAGE_SUFFIXES and not path.name.startswith(POSTER_PREFIX)
+    ]
+
+
+class RenditionCache:
+    """Track which source images have renditions.
+
+    Renditions are keyed by the digest of the source from the media
+    store, so identical uploads share one set of renditions. Animated
+    images are recorded as shown as uploaded, so they are not opened
+    again on each build.
+    """
+
+    VERSION = 3
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the cache.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        self.path = site_dir / STATE_DIR_NAME / "renditions.json"
+        self.renditions: dict[str, Rendition] = {}
+        # The digests of animated images, which get no renditions
+        self.originals: set[str] = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def renditions_dir(self) -> Path:
+        """Get the directory the renditions are written to.
+
+        Returns:
+            The renditions directory in the site directory.
+        """
+        return self.site_dir / RENDITIONS_DIR_NAME
+
+    def _ensure_loaded(self) -> None:
+        """Load the cache from disk on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        stored = read_state_file(self.path, self.VERSION)
+        if stored is None:
+            return
+        for digest, rendition in stored.get("renditions", {}).items():
+            self.renditions[digest] = Rendition(**rendition)
+        self.originals.update(stored.get("originals", []))
+
+    def _save(self) -> None:
+        """Write the cache to disk."""
+        renditions = {digest: asdict(rendition) for digest, rendition in self.renditions.items()}
+        write_state_file(
+            self.path,
+            self.VERSION,
+            {"originals": sorted(self.originals), "renditions": renditions},
+        )
+
+    def lookup(self, images: list[Path]) -> dict[str, Rendition]:
+        """Get the existing renditions of some images, without building any.
+
+        Args:
+            images: The source images.
+
+        Returns:
+            The renditions by image file name.
+        """
+        digests = media_store(self.site_dir).digests(images)
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                path.name: self.renditions[digest]
+                for path, digest in digests.items()
+                if digest in self.renditions
+            }
+
+    def build(self, images: list[Path], jobs: int = 1) -> list[tuple[Path, str]]:
+        """Build the renditions missing for some images.
+
+        Args:
+            images: The source images.
+            jobs: The number of processes used to hash and render images.
+
+        Returns:
+            The images that could not be rendered, with the error.
+        """
+        digests = media_store(self.site_dir).digests(images, jobs)
+        with self._lock:
+            self._ensure_loaded()
+            pending: dict[str, Path] = {}
+            for path, digest in digests.items():
+                if digest not in self.renditions and digest not in self.originals:
+                    pending.setdefault(digest, path)
+
+        work = [(path, digest, self.renditions_dir / digest) for digest, path in pending.items()]
+        results = process_map(make_renditions, work, jobs, chunksize=1)
+
+        failures = []
+        with self._lock:
+            for (path, digest, _out_dir), result in zip(work, results):
+                if isinstance(result, str):
+                    logger.warning("Could not build renditions of %s: %s", path, result)
+                    failures.append((path, result))
+                elif result is None:
+                    logger.debug("Showing the animated %s as uploaded", path)
+                    self.originals.add(digest)
+                else:
+                    self.renditions[digest] = result
+            if len(failures) < len(work):
+                self._save()
+        logger.debug("Built renditions of %s images", len(work) - len(failures))
+        return failures
+
+    def prune(self, used: set[str]) -> None:
+        """Delete renditions of images no post uses anymore.
+
+        Args:
+            used: The digests of every media file in the site.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            stale = set(self.renditions) - used
+            for digest in stale:
+                del self.renditions[digest]
+                shutil.rmtree(self.renditions_dir / digest, ignore_errors=True)
+            stale_originals = self.originals - used
+            self.originals -= stale_originals
+            if stale or stale_originals:
+                logger.debug("Removed renditions of %s images", len(stale))
+                self._save()
+
+
+_caches: dict[Path, RenditionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def rendition_cache(site_dir: Path) -> RenditionCache:
+    """Get the shared rendition cache for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The rendition cache, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = RenditionCache(site_dir)
+        return _caches[key]
@@ -1,41 +1,239 @@
 """Form to post."""
 import argparse
+import functools
 import hmac
 import logging
 import pathlib
+import time
 
+from collections.abc import Callable
+from contextlib import ExitStack
 from pathlib import Path
 from typing import TYPE_CHECKING
+from typing import Any
 
 from flask import Flask
+from flask import g
+from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask.wrappers import Response
-from waitress import serve
 
-from .utils import build_thumbnails
+from .assets import asset_url
+from .assets import use_assets
+from .build import RebuildResult
+from .build import rebuild_site
+from .catalog import STATE_DIR_NAME
+from .catalog import post_catalog
+from .coordinator import rebuild_coordinator
+from .http_cache import send_cached
+from .http_cache import validator_cache
+from .indices import write_author_indices
+from .indices import write_index
+from .indices import write_tag_indices
+from .ingest import IngestRequest
+from .jobs import JobQueue
+from .media_store import media_store
+from .media_store import post_media
+from .metrics import CONTENT_TYPE
+from .metrics import Gauge
+from .metrics import Histogram
+from .metrics import collect_stages
+from .metrics import format_stages
+from .metrics import registry
+from .metrics import stage
+from .profiling import Profiler
+from .profiling import use_profiler
+from .renditions import post_images
+from .renditions import rendition_cache
+from .search import search_index
+from .service_worker import write_service_worker
+from .thumbnails import build_thumbnails
+from .utils import NewPost
 from .utils import convert_all_html
 from .utils import delete_post
 from .utils import edit_prose
 from .utils import find_post
 from .utils import initialize_new_post
+from .utils import load_posts
 from .utils import load_site_config
 from .utils import render_search_results
+from .utils import template_cache
 from .utils import update_post
-from .utils import write_author_indices
-from .utils import write_index
-from .utils import write_tag_indices
+from .utils import use_template_cache
+from .videos import is_video
+from .videos import process_video
+from .videos import remove_split_videos
+from .videos import set_ffmpeg_limit
+from .videos import transcode_motion_video
+from .watch import PostWatcher
+from .watch import inotify_available
+
+
+class JournalApp(Flask):
+    """The journal app, serving site files with cache headers."""
+
+    def send_static_file(self, filename: str) -> Response:
+        """Serve a file from the site directory.
+
+        Args:
+            filename: The path relative to the site directory.
+
+        Returns:
+            The file, a 304 response if the client has the current version,
+            or a 404 response for profiles written inside the site.
+        """
+        hidden = self.config.get("profile_prefix")
+        if hidden and (filename == hidden or filename.startswith(f"{hidden}/")):
+            return Response(status=404)
+        return send_cached(self.config["site_dir"], filename)
+
+
+app = JournalApp(
+    __name__, static_url_path="", template_folder=str(Path(__file__).parent / "templates")
+)
+app.request_class = IngestRequest
+app.jinja_env.globals["asset_url"] = asset_url
+logger = logging.getLogger(__name__)
 
+# Seconds a client should wait before retrying when the job queue is full
+RETRY_AFTER_SECONDS = 30
 
-app = Flask(__name__, static_url_path="", template_folder=str(Path(__file__).parent / "templates"))
-logger = logging.getLogger(__name__)
+# The number of threads waitress serves requests with
+SERVER_THREADS = 8
+
+request_seconds = registry.register(
+    Histogram(
+        "home_journal_request_seconds",
+        "Duration of each request, by endpoint, method, and status.",
+        labels=("endpoint", "method", "status"),
+    )
+)
+
+requests_in_progress = registry.register(
+    Gauge(
+        "home_journal_requests_in_progress",
+        "Requests being handled, each on a waitress thread.",
+    )
+)
+
+registry.register(
+    Gauge(
+        "home_journal_server_threads",
+        "Threads waitress serves requests with.",
+        read=lambda: SERVER_THREADS,
+    )
+)
 
 
 if TYPE_CHECKING:
     from werkzeug.wrappers import Response as BaseResponse
 
 
+def _profiled(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Profile a view with cProfile while profiling is switched on.
+
+    Args:
+        view: The view function.
+
+    Returns:
+        The view, profiled under the method and path of the request.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profiler = app.config.get("profiler")
+        if profiler is None or not profiler.enabled:
+            return view(*args, **kwargs)
+        post_count = post_catalog(app.config["site_dir"]).post_count()
+        with profiler.profile(f"{request.method} {request.path}", post_count):
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+@app.before_request
+def _start_timing() -> None:
+    """Start timing a request and collecting the stages it runs."""
+    g.request_start = time.perf_counter()
+    g.request_stages = ExitStack()
+    g.stages = g.request_stages.enter_context(collect_stages())
+    requests_in_progress.inc()
+
+
+@app.after_request
+def _record_timing(response: Response) -> Response:
+    """Record the duration of a request, logging the stages of a slow one.
+
+    Args:
+        response: The response to the request.
+
+    Returns:
+        The response, unchanged.
+    """
+    if "request_start" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_start
+    endpoint = request.url_rule.rule if request.url_rule is not None else "static"
+    request_seconds.observe(
+        seconds, endpoint=endpoint, method=request.method, status=str(response.status_code)
+    )
+    if seconds >= app.config.get("slow_request_seconds", 1.0):
+        logger.warning(
+            "Slow request %s %s took %.2fs: %s",
+            request.method,
+            request.path,
+            seconds,
+            format_stages(g.stages),
+        )
+    return response
+
+
+@app.teardown_request
+def _stop_timing(_exc: BaseException | None) -> None:
+    """Stop collecting the stages of a request, whether or not it failed.
+
+    Args:
+        _exc: The exception the request failed with, if any.
+    """
+    if "request_stages" in g:
+        g.request_stages.close()
+        requests_in_progress.inc(-1)
+
+
+@app.route("/metrics")
+def endpoint_metrics() -> Response:
+    """Serve the process metrics in the Prometheus text format.
+
+    Returns:
+        The metrics.
+    """
+    return Response(
+        registry.render(), content_type=CONTENT_TYPE, headers={"Cache-Control": "no-store"}
+    )
+
+
+@app.route("/profile", methods=["POST"])
+def endpoint_profile() -> Response:
+    """Switch profiling on or off after the passcode is confirmed.
+
+    Returns:
+        Whether profiling is on, or an error response.
+    """
+    profiler = app.config.get("profiler")
+    if profiler is None:
+        return Response("Profiling is not configured, start with --profile_dir", status=404)
+    if not _passcode_matches(request.form.get("passcode", "")):
+        logger.warning("Rejected profiling toggle with invalid passcode")
+        return Response("Invalid passcode", status=403)
+    if request.form.get("enabled", "on") == "on":
+        profiler.enable()
+    else:
+        profiler.disable()
+    return jsonify({"enabled": profiler.enabled})
+
+
 @app.route("/config.yml")
 @app.route("/config.yaml")
 def endpoint_hide_config() -> Response:
@@ -47,6 +245,19 @@ def endpoint_hide_config() -> Response:
     return Response(status=404)
 
 
+@app.route(f"/{STATE_DIR_NAME}/<path:_subpath>")
+def endpoint_hide_state(_subpath: str) -> Response:
+    """Do not serve generated site state such as the post catalog.
+
+    Args:
+        _subpath: The requested path inside the state directory.
+
+    Returns:
+        A 404 response.
+    """
+    return Response(status=404)
+
+
 @app.route("/")
 def endpoint_root() -> Response:
     """Serve the index.html file from the static folder.
@@ -74,6 +285,7 @@ def endpoint_new() -> Response:
 
 
 @app.route("/search", methods=["POST"])
+@_profiled
 def endpoint_search() -> Response:
     """Search all the posts.
 
@@ -81,37 +293,39 @@ def endpoint_search() -> Response:
         An index page with the search results.
     """
     search = request.form["search"]
-    result = render_search_results(search, app.config["site_dir"])
+    with stage("search"):
+        result = render_search_results(search, app.config["site_dir"])
     return Response(
         render_template("index.html.j2", posts=result, title=search, title_icon="search")
     )
 
 
 @app.route("/all")
+@_profiled
 def endpoint_convert_all() -> str:
     """Serve the index.html file from the static folder.
 
     Returns:
-        The count of posts converted.
+        The count of posts rendered, and of all posts.
     """
     logger.debug("Converting all posts")
-    revised, all_posts = _rebuild_site()
-    return f"Built {len(revised)} of {len(all_posts)} posts."
+    return _rebuild_site().summary
 
 
-def _rebuild_site() -> tuple[list, list]:
+def _rebuild_site() -> RebuildResult:
     """Rebuild HTML, thumbnails, and indices for the whole site.
 
+    Rebuilds asked for while one runs are served by a single pass.
+
     Returns:
-        The revised posts and the full post list.
+        The full post list and the number of post pages rendered.
     """
     site_dir = app.config["site_dir"]
-    revised, all_posts = convert_all_html(site_dir)
-    build_thumbnails(all_posts)
-    write_index(all_posts, site_dir=site_dir)
-    write_author_indices(all_posts, site_dir=site_dir)
-    write_tag_indices(all_posts, site_dir=site_dir)
-    return revised, all_posts
+    rebuilt = rebuild_coordinator(site_dir).run(
+        "rebuild", functools.partial(rebuild_site, site_dir, jobs=app.config["build_jobs"])
+    )
+    validator_cache(site_dir).clear()
+    return rebuilt
 
 
 def _passcode_matches(provided: str) -> bool:
@@ -145,16 +359,20 @@ def endpoint_delete() -> "BaseResponse | Response":
         return Response("Invalid passcode", status=403)
 
     post_id = request.form.get("post_id", "")
-    if not post_id or not delete_post(app.config["site_dir"], post_id):
+    with rebuild_coordinator(app.config["site_dir"]).writer():
+        deleted = delete_post(app.config["site_dir"], post_id) if post_id else None
+    if deleted is None:
         logger.warning("Post not found for delete: %s", post_id)
         return Response("Post not found", status=404)
 
     logger.info("Deleted post %s", post_id)
+    search_index(app.config["site_dir"]).update([deleted])
     _rebuild_site()
     return redirect("/")
 
 
 @app.route("/edit", methods=["GET", "POST"])
+@_profiled
 def endpoint_edit() -> "BaseResponse | Response":
     """Show or save the edit form for a single post.
 
@@ -180,57 +398,265 @@ def endpoint_edit() -> "BaseResponse | Response":
             )
         )
 
+    rejected = _reject_submission("post edit")
+    if rejected is not None:
+        return rejected
+
     if not _passcode_matches(request.form.get("passcode", "")):
         logger.warning("Rejected post edit with invalid passcode")
         return Response("Invalid passcode", status=403)
 
-    allowed_authors = app.config.get("authors") or []
-    author = request.form.get("author", "")
-    if allowed_authors and author not in allowed_authors:
-        logger.warning("Rejected post edit with invalid author: %s", author)
-        return Response("Invalid author", status=400)
-
-    post = update_post(site_dir, request)
-    if post is None:
+    updated = update_post(site_dir, request)
+    if updated is None:
         logger.warning("Post not found for edit")
         return Response("Post not found", status=404)
 
-    logger.info("Updated post %s", post.post_id)
-    _revised, all_posts = convert_all_html(site_dir, post_id=post.post_id)
-    build_thumbnails(all_posts)
-    write_index(all_posts, site_dir=site_dir)
-    write_author_indices(all_posts, site_dir=site_dir)
-    write_tag_indices(all_posts, site_dir=site_dir)
-    return redirect(post.fs_post_full_html_path.relative_to(site_dir).as_posix())
+    logger.info("Updated post %s", updated.post_id)
+    return _publish(updated)
 
 
 @app.route("/", methods=["POST"])
+@_profiled
 def endpoint_post() -> "BaseResponse | Response":
     """Create a new post from the form data and redirect to it.
 
     Returns:
         A redirect to the new post.
     """
+    rejected = _reject_submission("post")
+    if rejected is not None:
+        return rejected
+
+    posts_dir = app.config["site_dir"] / "posts"
+    post = initialize_new_post(request=request, posts_dir=posts_dir)
+    post.write_md()
+    return _publish(post)
+
+
+@app.route("/jobs/<job_id>")
+def endpoint_job_status(job_id: str) -> Response:
+    """Report the state of a background job.
+
+    Args:
+        job_id: The job id.
+
+    Returns:
+        The job as JSON, or a 404 response.
+    """
+    job = app.config["jobs"].status(job_id)
+    if job is None:
+        return Response("Job not found", status=404)
+    return jsonify(
+        job_id=job.job_id,
+        kind=job.kind,
+        state=job.state,
+        error=job.error,
+        created=job.created,
+        started=job.started,
+        finished=job.finished,
+        queue_depth=app.config["jobs"].depth,
+    )
+
+
+def _reject_submission(action: str) -> Response | None:
+    """Check a post or edit submission before any work is done.
+
+    Args:
+        action: The submission kind, for the log.
+
+    Returns:
+        A 503 response with Retry-After when the background job queue is
+        full, a 400 response for an author not in the site config, or None.
+    """
+    # Checked before the form is read, so a busy journal never takes the upload
+    if app.config["jobs"].full():
+        logger.warning("Rejected %s, job queue is full", action)
+        return Response(
+            "The journal is busy, try again shortly",
+            status=503,
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
     allowed_authors = app.config.get("authors") or []
     author = request.form.get("author", "")
     if allowed_authors and author not in allowed_authors:
-        logger.warning("Rejected post with invalid author: %s", author)
+        logger.warning("Rejected %s with invalid author: %s", action, author)
         return Response("Invalid author", status=400)
+    return None
 
-    site_dir = app.config["site_dir"]
-    posts_dir = app.config["site_dir"] / "posts"
-    post = initialize_new_post(request=request, posts_dir=posts_dir)
-    post.write_md()
 
-    _revise_posts, all_posts = convert_all_html(
-        site_dir=site_dir,
-        post_id=post.post_id,
+def _publish(post: NewPost) -> "BaseResponse":
+    """Render a saved post and queue the rest of its processing.
+
+    The post page and its neighbors are rendered right away. Transcoding,
+    thumbnails, and the index pages are left to a background job.
+
+    Args:
+        post: The post whose markdown was written.
+
+    Returns:
+        A redirect to the post, carrying the job id for status polling.
+    """
+    site_dir = app.config["site_dir"]
+    with stage("update_search"):
+        search_index(site_dir).update([post.fs_post_directory])
+    with rebuild_coordinator(site_dir).writer(), stage("render_post"):
+        convert_all_html(site_dir=site_dir, post_id=post.post_id)
+    validator_cache(site_dir).clear()
+    job = app.config["jobs"].submit(
+        "process_post",
+        {"post_id": post.post_id, "transcodes": post.pending_transcodes},
     )
-    build_thumbnails(all_posts)
-    write_index(all_posts, site_dir=site_dir)
-    write_author_indices(all_posts, site_dir=site_dir)
-    write_tag_indices(all_posts, site_dir=site_dir)
-    return redirect(post.fs_post_full_html_path.relative_to(site_dir).as_posix())
+    post_url = post.fs_post_full_html_path.relative_to(site_dir).as_posix()
+    return redirect(f"{post_url}?job={job.job_id}")
+
+
+def _process_post(site_dir: pathlib.Path, args: dict[str, Any]) -> None:
+    """Finish publishing a post in the background.
+
+    Motion photo videos are transcoded, then every video of the post is
+    made ready to stream and given a poster frame and a mobile rendition.
+    A listings refresh is queued afterwards, even if processing failed,
+    unless one is already waiting to run.
+
+    Args:
+        site_dir: The directory of the site.
+        args: The post id and the motion photo videos to transcode, as the
+            photo, the offset of its video, and the H.264 video to write.
+    """
+    try:
+        post = find_post(site_dir, args["post_id"])
+        if post is None:
+            logger.warning("Post %s was removed before it was processed", args["post_id"])
+            return
+        store = media_store(site_dir)
+        with stage("build_videos"):
+            for source, offset, target in args["transcodes"]:
+                transcode_motion_video(
+                    post.fs_media_dir / source,
+                    offset,
+                    post.fs_media_dir / target,
+                    store,
+                )
+            remove_split_videos(post.fs_media_dir)
+            for name in post.media_file_names:
+                if is_video(name):
+                    process_video(post.fs_media_dir / name, store)
+        with stage("build_renditions"):
+            rendition_cache(site_dir).build(post_images(post.fs_media_dir))
+        # Render the post again now that its images have renditions
+        with rebuild_coordinator(site_dir).writer(), stage("render_post"):
+            convert_all_html(site_dir=site_dir, post_id=post.post_id)
+    finally:
+        _queue_listings_refresh()
+
+
+def _queue_listings_refresh() -> None:
+    """Queue a refresh of the listings unless one is waiting to run.
+
+    A queued refresh has not loaded the posts yet, so it shows every
+    change made before it starts. A burst of uploads then refreshes the
+    listings once or twice, and a post whose processing failed still
+    reaches them.
+    """
+    jobs = app.config["jobs"]
+    if any(job.state == "queued" for job in jobs.unfinished("refresh_listings")):
+        logger.debug("Leaving the listings to the queued refresh")
+        return
+    jobs.submit("refresh_listings", {})
+
+
+def _refresh_listings_job(site_dir: pathlib.Path, _args: dict[str, Any]) -> None:
+    """Refresh the listings in the background after posts were processed.
+
+    Args:
+        site_dir: The directory of the site.
+        _args: No arguments.
+    """
+    _refresh_listings(site_dir)
+
+
+def _refresh_listings(site_dir: pathlib.Path) -> None:
+    """Update the thumbnails and the index, author, and tag pages after posts changed.
+
+    Only the listing pages showing a changed post are written again, and
+    refreshes asked for while one runs are served by a single pass.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    rebuild_coordinator(site_dir).run("listings", functools.partial(_write_listings, site_dir))
+    validator_cache(site_dir).clear()
+
+
+def _write_listings(site_dir: pathlib.Path) -> None:
+    """Write the thumbnails and the index, author, and tag pages.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    with stage("load_posts"):
+        all_posts = load_posts(site_dir)
+    with stage("build_thumbnails"):
+        build_thumbnails(all_posts, site_dir)
+    with stage("write_indices"):
+        write_index(all_posts, site_dir=site_dir)
+        write_author_indices(all_posts, site_dir=site_dir)
+        write_tag_indices(all_posts, site_dir=site_dir)
+
+
+def _sync_posts(site_dir: pathlib.Path, args: dict[str, Any]) -> None:
+    """Bring the site up to date with posts changed on disk.
+
+    Media of the changed posts is stored, and their videos and images are
+    processed, unless a post is still being processed after it was saved
+    in the app. Only the pages whose inputs changed are rendered again:
+    the changed posts, their neighbors, and the listings they appear on.
+
+    Args:
+        site_dir: The directory of the site.
+        args: The changed post directories, relative to the site directory.
+    """
+    changed = {site_dir / name for name in args["post_dirs"]}
+    busy = {job.args["post_id"] for job in app.config["jobs"].unfinished("process_post")}
+    store = media_store(site_dir)
+    cache = rendition_cache(site_dir)
+    with stage("process_media"):
+        for post in load_posts(site_dir):
+            if post.fs_post_directory not in changed or post.post_id in busy:
+                continue
+            store.adopt(post_media(post.fs_media_dir))
+            for name in post.media_file_names:
+                if is_video(name) and (post.fs_media_dir / name).is_file():
+                    process_video(post.fs_media_dir / name, store)
+            cache.build(post_images(post.fs_media_dir))
+    with stage("update_search"):
+        search_index(site_dir).update(sorted(changed))
+    with rebuild_coordinator(site_dir).writer(), stage("render_posts"):
+        convert_all_html(site_dir=site_dir)
+    _refresh_listings(site_dir)
+
+
+def _rebuild_job(_site_dir: pathlib.Path, _args: dict[str, Any]) -> None:
+    """Rebuild the whole site in the background, as --init asks for.
+
+    Args:
+        _site_dir: The directory of the site, the app config has it.
+        _args: No arguments.
+    """
+    # Not the endpoint, a job runs outside of any request
+    logger.info(_rebuild_site().summary)
+
+
+def _submit_sync(site_dir: pathlib.Path, post_dirs: set[pathlib.Path]) -> None:
+    """Queue the work for posts changed on disk.
+
+    Args:
+        site_dir: The directory of the site.
+        post_dirs: The changed post directories.
+    """
+    names = sorted(path.relative_to(site_dir).as_posix() for path in post_dirs)
+    app.config["jobs"].submit("sync_posts", {"post_dirs": names})
 
 
 def run_server(args: argparse.Namespace) -> None:
@@ -247,11 +673,59 @@ def run_server(args: argparse.Namespace) -> None:
     app.config["tags"] = raw_tags if isinstance(raw_tags, list) else []
     app.config["authors"] = raw_authors if isinstance(raw_authors, list) else []
     app.config["delete_passcode"] = config.get("delete_passcode")
+    app.config["build_jobs"] = args.jobs
+    app.config["slow_request_seconds"] = args.slow_request_seconds
+    if args.profile_dir:
+        profile_dir = site_dir / args.profile_dir
+        app.config["profiler"] = Profiler(profile_dir)
+        if profile_dir.resolve().is_relative_to(site_dir.resolve()):
+            prefix = profile_dir.resolve().relative_to(site_dir.resolve()).as_posix()
+            app.config["profile_prefix"] = prefix
+        use_profiler(app.config["profiler"])
+    use_assets(site_dir)
+    # Sites set up before sw.js was generated would not have one until a rebuild
+    write_service_worker(site_dir)
+    use_template_cache(site_dir)
+    app.jinja_env.bytecode_cache = template_cache(site_dir)
+    set_ffmpeg_limit(args.ffmpeg_jobs)
     app.static_folder = args.site_directory
-    logger.info("Starting server")
+    app.config["jobs"] = JobQueue(
+        site_dir,
+        handlers={
+            "process_post": _process_post,
+            "rebuild_site": _rebuild_job,
+            "refresh_listings": _refresh_listings_job,
+            "sync_posts": _sync_posts,
+        },
+        workers=args.job_workers,
+        max_pending=args.job_queue_size,
+    )
+    app.config["jobs"].start()
+    registry.register(
+        Gauge(
+            "home_journal_job_queue_depth",
+            "Background jobs waiting to run.",
+            read=lambda: app.config["jobs"].depth,
+        )
+    )
+    registry.register(
+        Gauge(
+            "home_journal_jobs_running",
+            "Background jobs being run.",
+            read=lambda: app.config["jobs"].running,
+        )
+    )
+    if args.watch:
+        if inotify_available():
+            PostWatcher(site_dir, functools.partial(_submit_sync, site_dir)).start()
+        else:
+            logger.warning("Not watching the posts, inotify is not available")
     if args.init:
-        logger.info("Initializing site")
-        res = endpoint_convert_all()
-        logger.info(res)
+        # The pages built last are served until the rebuild replaces them
+        logger.info("Rebuilding the site in the background")
+        app.config["jobs"].submit("rebuild_site", {})
+    logger.info("Starting server")
+
+    from waitress import serve  # pylint: disable=import-outside-toplevel
 
-    serve(app, host="0.0.0.0", port=args.port, threads=8)
+    serve(app, host="0.0.0.0", port=args.port, threads=SERVER_THREADS)
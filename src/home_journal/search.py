@@ -0,0 +1,505 @@
+"""An inverted full-text index over posts."""
+import bisect
+import html
+import logging
+import math
+import re
+import threading
+import unicodedata
+
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .catalog import STATE_DIR_NAME
+from .catalog import CatalogEntry
+from .catalog import post_catalog
+from .catalog import read_state_file
+from .catalog import write_state_file
+
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of a match in each field when ranking
+FIELD_WEIGHTS = {"title": 3.0, "tags": 2.0, "author": 2.0, "body": 1.0}
+
+# Characters of context on either side of the first match in a snippet
+SNIPPET_CONTEXT = 80
+
+# The state directory holding one indexed document per post
+SEARCH_DIR_NAME = "search"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+_MEDIA_BLOCK = re.compile(
+    r"<div class=\"video\">.*?</div>|!\[[^\]]*\]\([^)]*\)",
+    re.IGNORECASE | re.DOTALL,
+)
+_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_HTML_TAG = re.compile(r"<[^>]+>")
+_MARKDOWN_MARKUP = re.compile(r"[#*_>`~|]+")
+
+
+def _fold(text: str) -> str:
+    """Lowercase text and strip accents for matching.
+
+    Args:
+        text: The text to fold.
+
+    Returns:
+        The folded text.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into folded search tokens.
+
+    Args:
+        text: The text to split.
+
+    Returns:
+        The tokens in order.
+    """
+    return _TOKEN.findall(_fold(text))
+
+
+def plain_text(content: str) -> str:
+    """Reduce markdown prose to plain text for indexing and snippets.
+
+    Media blocks, link targets, HTML tags and markdown markup are removed.
+
+    Args:
+        content: The markdown body.
+
+    Returns:
+        The text on a single line.
+    """
+    text = _MEDIA_BLOCK.sub(" ", content)
+    text = _LINK.sub(r"\1", text)
+    text = _HTML_TAG.sub(" ", text)
+    text = _MARKDOWN_MARKUP.sub(" ", text)
+    return " ".join(text.split())
+
+
+@dataclass(kw_only=True)
+class SearchDocument:
+    """The indexed form of one post."""
+
+    # The markdown file modification time when indexed
+    mtime_ns: int
+    # The markdown file size when indexed
+    size: int
+    # The plain text body, used for snippets
+    text: str
+    # The tokens of each field, in order
+    fields: dict[str, list[str]]
+
+
+@dataclass
+class SearchHit:
+    """A single ranked search result."""
+
+    # The id of the matching post
+    post_id: str
+    # The relevance score, higher is better
+    score: float
+    # An HTML snippet with the matches highlighted
+    snippet: str
+
+
+@dataclass
+class _Query:
+    """A parsed search query."""
+
+    # Whole words that must match
+    terms: list[str]
+    # Word prefixes that must match, from "word*"
+    prefixes: list[str]
+    # Word sequences that must match in order, from quoted text
+    phrases: list[list[str]]
+
+
+def _parse_query(query: str) -> _Query:
+    """Parse a search string into terms, prefixes, and phrases.
+
+    Args:
+        query: The search string.
+
+    Returns:
+        The parsed query.
+    """
+    parsed = _Query(terms=[], prefixes=[], phrases=[])
+    for match in _QUERY_PART.finditer(query):
+        phrase, word = match.groups()
+        if phrase is not None:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                parsed.phrases.append(tokens)
+            parsed.terms.extend(tokens)
+            continue
+        tokens = tokenize(word)
+        if word.endswith("*") and tokens:
+            parsed.terms.extend(tokens[:-1])
+            parsed.prefixes.append(tokens[-1])
+        else:
+            parsed.terms.extend(tokens)
+    return parsed
+
+
+def _contains_phrase(tokens: list[str], phrase: list[str]) -> bool:
+    """Check if a token list contains a phrase.
+
+    Args:
+        tokens: The tokens of a field.
+        phrase: The phrase tokens.
+
+    Returns:
+        True if the phrase appears in order.
+    """
+    first = phrase[0]
+    length = len(phrase)
+    return any(
+        token == first and tokens[idx : idx + length] == phrase for idx, token in enumerate(tokens)
+    )
+
+
+def _snippet(text: str, words: set[str], prefixes: list[str]) -> str:
+    """Build an HTML snippet around the first match in the text.
+
+    Args:
+        text: The plain text body.
+        words: Whole words to highlight.
+        prefixes: Word prefixes to highlight.
+
+    Returns:
+        The escaped snippet with matches wrapped in mark tags.
+    """
+    spans = []
+    for match in _TOKEN.finditer(text):
+        folded = _fold(match.group())
+        if folded in words or any(folded.startswith(prefix) for prefix in prefixes):
+            spans.append(match.span())
+    if not spans:
+        return html.escape(text[: SNIPPET_CONTEXT * 2])
+
+    start = max(spans[0][0] - SNIPPET_CONTEXT, 0)
+    end = min(spans[0][1] + SNIPPET_CONTEXT, len(text))
+    parts = ["&hellip;" if start else ""]
+    position = start
+    for span_start, span_end in spans:
+        if span_start >= end:
+            break
+        parts.append(html.escape(text[position:span_start]))
+        parts.append(f"<mark>{html.escape(text[span_start:span_end])}</mark>")
+        position = span_end
+    parts.append(html.escape(text[position:end]))
+    parts.append("&hellip;" if end < len(text) else "")
+    return "".join(parts)
+
+
+class SearchIndex:
+    """An inverted index over post titles, tags, authors, and prose.
+
+    Each document is persisted as its own JSON file in the site state
+    directory, so indexing a post writes only that post. The postings are
+    built in memory when the index is first used, and kept up to date as
+    posts are added, edited, and deleted, not when the index is searched.
+    """
+
+    VERSION = 1
+
+    def __init__(self, site_dir: Path) -> None:
+        """Initialize the index.
+
+        Args:
+            site_dir: The directory of the site.
+        """
+        self.site_dir = site_dir
+        self.doc_dir = site_dir / STATE_DIR_NAME / SEARCH_DIR_NAME
+        self.documents: dict[str, SearchDocument] = {}
+        # term -> post id -> field -> term frequency
+        self._postings: dict[str, dict[str, dict[str, int]]] = {}
+        # Sorted terms for prefix queries, None until needed
+        self._vocabulary: list[str] | None = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self) -> None:
+        """Load the documents from disk on first use and catch up with the posts.
+
+        Posts changed while the site was not served are indexed here, once
+        per process.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        for path in self.doc_dir.glob("*.json"):
+            stored = read_state_file(path, self.VERSION)
+            if stored is None:
+                path.unlink()
+                continue
+            self._add(stored["post_id"], SearchDocument(**stored["document"]))
+        catalog = post_catalog(self.site_dir)
+        catalog.refresh()
+        self._reconcile(catalog.all_entries())
+
+    def _document_path(self, post_id: str) -> Path:
+        """Get the file a document is stored in.
+
+        Args:
+            post_id: The id of the post, also the name of its directory.
+
+        Returns:
+            The document file.
+        """
+        return self.doc_dir / f"{post_id}.json"
+
+    def _add(self, post_id: str, document: SearchDocument) -> None:
+        """Add a document to the postings.
+
+        Args:
+            post_id: The id of the post.
+            document: The indexed post.
+        """
+        self._remove(post_id)
+        self.documents[post_id] = document
+        for field_name, tokens in document.fields.items():
+            for token in tokens:
+                fields = self._postings.setdefault(token, {}).setdefault(post_id, {})
+                fields[field_name] = fields.get(field_name, 0) + 1
+        self._vocabulary = None
+
+    def _remove(self, post_id: str) -> None:
+        """Remove a document from the postings.
+
+        Args:
+            post_id: The id of the post.
+        """
+        document = self.documents.pop(post_id, None)
+        if document is None:
+            return
+        for tokens in document.fields.values():
+            for token in set(tokens):
+                posting = self._postings.get(token)
+                if posting is None:
+                    continue
+                posting.pop(post_id, None)
+                if not posting:
+                    del self._postings[token]
+        self._vocabulary = None
+
+    def _index_entry(self, entry: CatalogEntry) -> None:
+        """Read and index one post.
+
+        Args:
+            entry: The catalog entry of the post.
+        """
+        # Only posts changed since they were indexed are read
+        import frontmatter  # pylint: disable=import-outside-toplevel
+
+        parsed_post = frontmatter.load(self.site_dir / entry.md_path)
+        text = plain_text(parsed_post.content)
+        document = SearchDocument(
+            mtime_ns=entry.mtime_ns,
+            size=entry.size,
+            text=text,
+            fields={
+                "title": tokenize(entry.title),
+                "tags": tokenize(" ".join(str(tag) for tag in entry.tags)),
+                "author": tokenize(entry.author),
+                "body": tokenize(text),
+            },
+        )
+        self._add(entry.post_id, document)
+        write_state_file(
+            self._document_path(entry.post_id),
+            self.VERSION,
+            {"document": asdict(document), "post_id": entry.post_id},
+        )
+
+    def _drop(self, post_id: str) -> None:
+        """Remove a deleted post from the index and from disk.
+
+        Args:
+            post_id: The id of the post.
+        """
+        self._remove(post_id)
+        self._document_path(post_id).unlink(missing_ok=True)
+
+    def _is_current(self, entry: CatalogEntry) -> bool:
+        """Check if a post is indexed as it is on disk.
+
+        Args:
+            entry: The catalog entry of the post.
+
+        Returns:
+            True if the indexed document matches the catalog entry.
+        """
+        document = self.documents.get(entry.post_id)
+        return (
+            document is not None
+            and document.mtime_ns == entry.mtime_ns
+            and document.size == entry.size
+        )
+
+    def _reconcile(self, entries: list[CatalogEntry]) -> None:
+        """Index changed posts and drop deleted ones.
+
+        Args:
+            entries: Every cataloged post.
+        """
+        current = {entry.post_id for entry in entries}
+        for post_id in set(self.documents) - current:
+            self._drop(post_id)
+        for entry in entries:
+            if not self._is_current(entry):
+                self._index_entry(entry)
+
+    def sync(self, entries: list[CatalogEntry]) -> None:
+        """Reconcile the index with the post catalog.
+
+        Posts edited outside the app are re-indexed, deleted posts dropped.
+        Every entry is compared, so this runs with rebuilds and changes
+        seen on disk, not with searches.
+
+        Args:
+            entries: Every cataloged post.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._reconcile(entries)
+
+    def update(self, post_dirs: list[Path]) -> None:
+        """Re-index posts after they were written or deleted.
+
+        Only the given post directories are read and only their documents
+        are written, however many posts the site has.
+
+        Args:
+            post_dirs: The directories of the posts that changed.
+        """
+        catalog = post_catalog(self.site_dir)
+        with self._lock:
+            self._ensure_loaded()
+            for post_dir in post_dirs:
+                entries = catalog.refresh_post(post_dir)
+                if not entries and post_dir.name in self.documents:
+                    self._drop(post_dir.name)
+                for entry in entries:
+                    if not self._is_current(entry):
+                        self._index_entry(entry)
+
+    def _expand_prefix(self, prefix: str) -> list[str]:
+        """Find every indexed term starting with a prefix.
+
+        Args:
+            prefix: The term prefix.
+
+        Returns:
+            The matching terms.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\U0010ffff", lo=start)
+        return self._vocabulary[start:end]
+
+    def _score(self, term_groups: list[list[str]]) -> dict[str, float]:
+        """Rank the posts that match every term group.
+
+        Args:
+            term_groups: Alternatives for each query word, all must match.
+
+        Returns:
+            The score of each matching post.
+        """
+        total = len(self.documents)
+        scores: dict[str, float] | None = None
+        for group in term_groups:
+            group_scores: dict[str, float] = {}
+            for term in group:
+                posting = self._postings.get(term, {})
+                idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                for post_id, fields in posting.items():
+                    document = self.documents[post_id]
+                    weight = sum(
+                        FIELD_WEIGHTS[name] * count / math.sqrt(len(document.fields[name]))
+                        for name, count in fields.items()
+                    )
+                    group_scores[post_id] = group_scores.get(post_id, 0.0) + idf * weight
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {
+                    post_id: score + group_scores[post_id]
+                    for post_id, score in scores.items()
+                    if post_id in group_scores
+                }
+            if not scores:
+                return {}
+        return scores or {}
+
+    def search(self, query: str, limit: int | None = None) -> list[SearchHit]:
+        """Search the index.
+
+        Words must all match. Quoted text must match as a phrase and a
+        trailing * matches any word with that prefix.
+
+        Args:
+            query: The search string.
+            limit: The maximum number of hits to return.
+
+        Returns:
+            The hits, best first.
+        """
+        parsed = _parse_query(query)
+        with self._lock:
+            self._ensure_loaded()
+            groups = [[term] for term in parsed.terms]
+            groups.extend(self._expand_prefix(prefix) for prefix in parsed.prefixes)
+            if not groups:
+                return []
+            scores = self._score(groups)
+            for phrase in parsed.phrases:
+                scores = {
+                    post_id: score
+                    for post_id, score in scores.items()
+                    if any(
+                        _contains_phrase(tokens, phrase)
+                        for tokens in self.documents[post_id].fields.values()
+                    )
+                }
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            if limit is not None:
+                ranked = ranked[:limit]
+            words = set(parsed.terms)
+            return [
+                SearchHit(
+                    post_id=post_id,
+                    score=score,
+                    snippet=_snippet(self.documents[post_id].text, words, parsed.prefixes),
+                )
+                for post_id, score in ranked
+            ]
+
+
+_indices: dict[Path, SearchIndex] = {}
+_indices_lock = threading.Lock()
+
+
+def search_index(site_dir: Path) -> SearchIndex:
+    """Get the shared search index for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The search index, kept in memory for the life of the process.
+    """
+    key = site_dir.resolve()
+    with _indices_lock:
+        if key not in _indices:
+            _indices[key] = SearchIndex(site_dir)
+        return _indices[key]
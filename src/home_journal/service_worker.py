@@ -0,0 +1,81 @@
+"""Write the service worker with a versioned precache list of the app shell."""
+import logging
+
+from pathlib import Path
+
+from .assets import asset_url
+from .compress import ENCODINGS
+from .compress import write_text_file
+from .manifest import signature
+from .media_store import hash_file
+from .utils import jinja_env
+
+
+logger = logging.getLogger(__name__)
+
+# The site directories holding the app shell: stylesheets, fonts, scripts, and icons
+SHELL_DIRS = ("css", "icons", "js")
+
+# App shell files in the site directory itself
+SHELL_FILES = ("favicon.ico", "manifest.webmanifest")
+
+
+def _url(site_dir: Path, path: Path) -> str:
+    """Get the URL of a site file.
+
+    Args:
+        site_dir: The directory of the site.
+        path: The file.
+
+    Returns:
+        The absolute URL path.
+    """
+    return f"/{path.relative_to(site_dir).as_posix()}"
+
+
+def shell_files(site_dir: Path) -> list[Path]:
+    """List the files the service worker precaches.
+
+    Stylesheets and scripts are listed by their content hashed copy,
+    which is what the pages link to.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The files, sorted, without their precompressed copies.
+    """
+    paths = [site_dir / name for name in SHELL_FILES]
+    for name in SHELL_DIRS:
+        if (site_dir / name).is_dir():
+            paths.extend((site_dir / name).iterdir())
+    return sorted(
+        path
+        for path in paths
+        if path.is_file()
+        and not path.name.startswith(".")
+        and path.suffix not in ENCODINGS.values()
+        and asset_url(_url(site_dir, path)) == _url(site_dir, path)
+    )
+
+
+def write_service_worker(site_dir: Path) -> bool:
+    """Write sw.js, versioned by the content of the app shell.
+
+    The version only changes when a shell file does, so a new post does
+    not make installed apps download the shell again.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        True if sw.js changed.
+    """
+    files = shell_files(site_dir)
+    urls = [_url(site_dir, path) for path in files]
+    version = signature([(url, hash_file(path)) for url, path in zip(urls, files)])[:16]
+    template = jinja_env.get_template("sw.js.j2")
+    written = write_text_file(site_dir / "sw.js", template.render(precache=urls, version=version))
+    if written:
+        logger.debug("Wrote the service worker, version %s, %s files", version, len(urls))
+    return written
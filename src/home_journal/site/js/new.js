@@ -62,18 +62,32 @@ window.onload = function (e) {
       false
     );
 
+    var form = this;
     xhr.addEventListener(
       "readystatechange",
       function (event) {
-        if (event.target.readyState == 4) {
-          ui("#progress", 100);
-          window.location.replace(event.currentTarget.responseURL);
+        if (event.target.readyState != 4) {
+          return;
         }
+        if (event.target.status == 503) {
+          // The server is busy, send the post again once it has room
+          var wait = parseInt(xhr.getResponseHeader("Retry-After") || "30", 10);
+          progress_text.innerText = "Server busy, retrying in " + wait + "s";
+          setTimeout(function () {
+            send(form);
+          }, wait * 1000);
+          return;
+        }
+        ui("#progress", 100);
+        window.location.replace(event.currentTarget.responseURL);
       },
       false
     );
 
-    xhr.open(this.getAttribute("method"), this.getAttribute("action"), true);
-    xhr.send(new FormData(this));
+    function send(form) {
+      xhr.open(form.getAttribute("method"), form.getAttribute("action"), true);
+      xhr.send(new FormData(form));
+    }
+    send(form);
   });
 };
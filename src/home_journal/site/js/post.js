@@ -93,3 +93,39 @@ window.addEventListener(
   },
   false
 );
+
+function poll_job() {
+  var job = new URLSearchParams(window.location.search).get("job");
+  if (!job) {
+    return;
+  }
+  fetch("/jobs/" + encodeURIComponent(job))
+    .then((res) => (res.ok ? res.json() : { state: "done" }))
+    .then((status) => {
+      if (status.state == "queued" || status.state == "running") {
+        setTimeout(poll_job, 2000);
+        return;
+      }
+      // Reload without the job id once thumbnails and videos are ready,
+      // refreshing the copy the service worker keeps first
+      fetch(window.location.pathname, { cache: "reload" })
+        .catch(() => undefined)
+        .then(() => window.location.replace(window.location.pathname));
+    })
+    .catch(() => setTimeout(poll_job, 5000));
+}
+
+window.addEventListener("load", poll_job, false);
+
+function prefetch_neighbors() {
+  if (!navigator.serviceWorker || !navigator.serviceWorker.controller) {
+    return;
+  }
+  var urls = ["previous", "next"]
+    .map((id) => document.getElementById(id))
+    .filter((elem) => elem)
+    .map((elem) => elem.href);
+  navigator.serviceWorker.controller.postMessage({ prefetch: urls });
+}
+
+window.addEventListener("load", prefetch_neighbors, false);
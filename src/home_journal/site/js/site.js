@@ -51,3 +51,97 @@ function search_modal() {
     }, 200);
   }
 }
+
+function feed_card(post) {
+  var card = document.createElement("div");
+  card.className = "post";
+  var article = document.createElement("article");
+  article.className = post.thumbnail ? "with-image" : "without-image";
+  if (post.thumbnail) {
+    var img = document.createElement("img");
+    img.className = "responsive large article-image";
+    img.src = post.thumbnail;
+    img.alt = "";
+    img.loading = "lazy";
+    img.decoding = "async";
+    article.appendChild(img);
+  }
+  var meta = document.createElement("div");
+  meta.className = "article-meta";
+  var title = document.createElement("h6");
+  title.textContent = post.title;
+  meta.appendChild(title);
+  var byline = document.createElement("p");
+  var date = document.createElement("a");
+  date.href = post.archive_url;
+  date.className = "archive_link";
+  date.textContent = post.date;
+  byline.appendChild(date);
+  byline.append(" by ");
+  var author = document.createElement("a");
+  author.href = post.author_url;
+  author.className = "author_link";
+  author.textContent = post.author;
+  byline.appendChild(author);
+  meta.appendChild(byline);
+  if (post.tags.length) {
+    var tags = document.createElement("p");
+    post.tags.forEach(function (tag, idx) {
+      var link = document.createElement("a");
+      link.href = tag.url;
+      link.className = "deemphasisze";
+      link.textContent = tag.name + (idx < post.tags.length - 1 ? " | " : "");
+      tags.appendChild(link);
+    });
+    meta.appendChild(tags);
+  }
+  article.appendChild(meta);
+  var cover = document.createElement("a");
+  cover.className = "post-cover";
+  cover.href = post.url;
+  cover.setAttribute("aria-label", post.title);
+  article.appendChild(cover);
+  card.appendChild(article);
+  return card;
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+  var main = document.querySelector(".main[data-feed]");
+  if (!main || !("IntersectionObserver" in window)) {
+    return;
+  }
+  var feed = main.dataset.feed;
+  var loading = false;
+  var pager = document.getElementById("pager");
+  if (pager) {
+    pager.remove();
+  }
+  var sentinel = document.createElement("div");
+  main.after(sentinel);
+  var observer = new IntersectionObserver(
+    function (entries) {
+      if (!entries[0].isIntersecting || loading || !feed) {
+        return;
+      }
+      loading = true;
+      fetch(feed)
+        .then((res) => res.json())
+        .then((page) => {
+          page.posts.forEach((post) => main.appendChild(feed_card(post)));
+          feed = page.older;
+          if (!feed) {
+            observer.disconnect();
+          }
+          loading = false;
+          // Keep loading while the sentinel is still on screen
+          observer.unobserve(sentinel);
+          observer.observe(sentinel);
+        })
+        .catch(() => {
+          loading = false;
+        });
+    },
+    { rootMargin: "800px" }
+  );
+  observer.observe(sentinel);
+});
@@ -0,0 +1,144 @@
+"""Index thumbnails, keyed by the digest of their source image."""
+import logging
+import os
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .media_store import media_store
+from .pool import process_map
+from .profiling import memory_snapshots
+from .videos import is_video
+from .videos import poster_name
+
+
+if TYPE_CHECKING:
+    from .utils import ExistingPost
+
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails are served from here, named by the digest of the source image
+THUMBNAILS_DIR_NAME = "thumbs"
+
+# The bounding box of index thumbnails
+THUMBNAIL_SIZE = (1000, 1000)
+
+
+def make_thumbnail(paths: tuple[Path, Path]) -> str | None:
+    """Write the thumbnail of one image.
+
+    JPEG sources are decoded at the smallest scale that still covers the
+    thumbnail, so a worker never holds a full resolution bitmap of them.
+
+    Args:
+        paths: The source image and the thumbnail to write.
+
+    Returns:
+        None on success, otherwise the error message.
+    """
+    # Pillow is only loaded by the processes that decode images
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+    from PIL import ImageOps  # pylint: disable=import-outside-toplevel
+
+    source, target = paths
+    # Named for the process, the suffix is kept so Pillow picks the format from it
+    tmp_target = target.with_name(f".{target.stem}.{os.getpid()}{target.suffix}")
+    try:
+        with Image.open(source) as opened:
+            opened.draft("RGB", THUMBNAIL_SIZE)
+            image = ImageOps.exif_transpose(opened) or opened
+            image.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            save_image = image
+            if target.suffix.lower() in (".jpg", ".jpeg") and image.mode not in ("RGB", "L"):
+                save_image = image.convert("RGB")
+            save_image.save(tmp_target)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        tmp_target.unlink(missing_ok=True)
+        return str(exc) or type(exc).__name__
+    tmp_target.replace(target)
+    return None
+
+
+def _thumbnail_source(post: "ExistingPost") -> Path | None:
+    """Pick the image a post is shown with on the index.
+
+    Args:
+        post: The post.
+
+    Returns:
+        The index image, or the poster frame of the first video of a post
+        without images, or None.
+    """
+    if post.index_image:
+        return post.fs_media_dir / post.index_image
+    for name in post.media_file_names:
+        poster = post.fs_media_dir / poster_name(name)
+        if is_video(name) and poster.is_file():
+            return poster
+    return None
+
+
+def build_thumbnails(
+    posts: list["ExistingPost"], site_dir: Path, jobs: int = 1
+) -> list[tuple[Path, str]]:
+    """Build thumbnails for the post.
+
+    Posts that share an index image share its thumbnail. Posts with only
+    videos are shown with the poster frame of the first one.
+
+    Args:
+        posts: The post to build thumbnails for.
+        site_dir: The directory of the site.
+        jobs: The number of processes used to build missing thumbnails.
+
+    Returns:
+        The source images that could not be thumbnailed, with the error.
+    """
+    with memory_snapshots("build_thumbnails", len(posts)):
+        sources = {post.post_id: source for post in posts if (source := _thumbnail_source(post))}
+        digests = media_store(site_dir).digests(list(sources.values()), jobs)
+        thumbs_dir = site_dir / THUMBNAILS_DIR_NAME
+        thumbs_dir.mkdir(exist_ok=True)
+
+        missing: dict[Path, Path] = {}
+        for post in posts:
+            source = sources.get(post.post_id)
+            if source is None or source not in digests:
+                continue
+            thumbnail = thumbs_dir / f"{digests[source]}{source.suffix.lower()}"
+            post.thumbnail_url = Path("/") / thumbnail.relative_to(site_dir)
+            if not thumbnail.exists():
+                missing.setdefault(thumbnail, source)
+
+        # Each image is a batch of its own, they vary too much in size to group
+        work = [(source, thumbnail) for thumbnail, source in missing.items()]
+        errors = process_map(make_thumbnail, work, jobs, chunksize=1)
+        failures = [
+            (source, error) for (source, _), error in zip(work, errors) if error is not None
+        ]
+        failed = {source for source, _error in failures}
+        for source, error in failures:
+            logger.warning("Could not thumbnail %s: %s", source, error)
+        for post in posts:
+            if sources.get(post.post_id) in failed:
+                post.thumbnail_url = None
+        logger.debug("Built %s thumbnails", len(work) - len(failures))
+        return failures
+
+
+def prune_thumbnails(site_dir: Path, used: set[str]) -> None:
+    """Delete thumbnails of images no post uses anymore.
+
+    Args:
+        site_dir: The directory of the site.
+        used: The digests of every media file in the site.
+    """
+    thumbs_dir = site_dir / THUMBNAILS_DIR_NAME
+    if not thumbs_dir.is_dir():
+        return
+    stale = [path for path in thumbs_dir.iterdir() if path.stem not in used]
+    for path in stale:
+        path.unlink()
+    if stale:
+        logger.debug("Removed %s thumbnails", len(stale))
@@ -1,32 +1,55 @@
 """Helper utilities."""
+import functools
 import logging
 import re
 import shutil
-import subprocess
 import unicodedata
 
 from dataclasses import dataclass
+from dataclasses import field
 from datetime import datetime
-from datetime import timezone
-from mmap import mmap
 from pathlib import Path
-from collections.abc import Iterator
+from typing import TYPE_CHECKING
 
-import cmarkgfm
 import jinja2
-import magic
-import yaml
-
-from cmarkgfm.cmark import Options as cmarkgfmOptions
-from flask.wrappers import Request
-from frontmatter import load as frontmatter_load
-from PIL import Image
-from PIL import ImageOps
 
+from .assets import asset_manifest
+from .assets import asset_url
+from .catalog import STATE_DIR_NAME
+from .catalog import CatalogEntry
+from .catalog import post_catalog
+from .compress import write_atomic
+from .compress import write_text_file
+from .manifest import build_manifest
+from .manifest import signature
+from .media_store import MediaStore
+from .media_store import media_store
+from .metrics import stage
+from .profiling import memory_snapshots
+from .renditions import Rendition
+from .renditions import post_images
+from .renditions import rendition_cache
+from .renditions import rewrite_images
+from .search import search_index
+from .thumbnails import build_thumbnails
+from .videos import mobile_name
+from .videos import poster_name
+
+
+if TYPE_CHECKING:
+    from flask.wrappers import Request
+
+# Markdown, YAML, and MIME sniffing libraries, and the upload handling built on
+# Flask, are imported where they are first used: commands and worker processes
+# that never need them start faster
 
 jinja_env = jinja2.Environment(
     loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
 )
+jinja_env.globals["asset_url"] = asset_url
+
+# Compiled templates are kept in the state directory, across restarts
+TEMPLATE_CACHE_DIR_NAME = "templates"
 
 logger = logging.getLogger(__name__)
 
@@ -85,12 +108,22 @@ class BasePost:
 class ExistingPost(BasePost):
     """Metadata for an existing post."""
 
+    # pylint: disable=too-many-instance-attributes
+
+    # The markdown file the post was read from
+    fs_post_md_path: Path | None = None
     # The image to use on the index
     index_image: str | None = None
+    # The attached media file names from the frontmatter
+    media_file_names: list[str] = field(default_factory=list)
+    # The markdown file modification time in nanoseconds and size, as cataloged
+    md_stat: tuple[int, int] | None = None
     # The good url for the post
     post_url: Path | None = None
-    # The url for the thumbnail image
-    thumbnail_parent_url: Path | None = None
+    # The display renditions of the post images by file name
+    renditions: dict[str, Rendition] = field(default_factory=dict)
+    # A highlighted search result snippet
+    snippet: str | None = None
     # The url for the thumbnail image
     thumbnail_url: Path | None = None
 
@@ -103,12 +136,60 @@ class ExistingPost(BasePost):
         """
         return f"{_slugify(self.author)}.html"
 
+    @property
+    def archive_url(self) -> str:
+        """Get the url of the archive page of the month the post was created in.
+
+        Returns:
+            The month archive url.
+        """
+        return f"/archive/{self.date:%Y/%m}.html"
+
+    def load_md_content(self) -> str:
+        """Read the markdown body from disk.
+
+        Posts built from the catalog do not carry their body in memory.
+
+        Returns:
+            The markdown body of the post.
+        """
+        import frontmatter  # pylint: disable=import-outside-toplevel
+
+        md_path = self.fs_post_md_path or self.fs_post_directory / "post.md"
+        self.md_content = frontmatter.load(md_path).content
+        return self.md_content
+
+    def page_signature(self, config: dict[str, object]) -> str:
+        """Hash everything the post page is rendered from.
+
+        Args:
+            config: The site config.
+
+        Returns:
+            A hex digest of the markdown file stat data, the next and previous
+            links, the image renditions, the template, the asset URLs, and the
+            config.
+        """
+        md_stat = self.md_stat
+        if md_stat is None:
+            stat = (self.fs_post_md_path or self.fs_post_directory / "post.md").stat()
+            md_stat = (stat.st_mtime_ns, stat.st_size)
+        return signature(
+            _template_digest("post.html.j2"),
+            asset_manifest(),
+            config,
+            md_stat,
+            self.next,
+            self.previous,
+            self.renditions,
+        )
+
     def write_html(self) -> None:
         """Write the post to an HTML file."""
         template = jinja_env.get_template("post.html.j2")
-        html_content = _render_markdown(self.md_content)
+        html_content = rewrite_images(_render_markdown(self.md_content), self.renditions)
         rendered = template.render(post=self, content=html_content)
-        self.fs_post_full_html_path.write_text(rendered, encoding="utf-8")
+        write_text_file(self.fs_post_full_html_path, rendered)
 
 
 @dataclass(kw_only=True)
@@ -118,6 +199,11 @@ class NewPost(BasePost):
     # The filename for each attachment
     media_file_names: list[str]
 
+    # The MIME type of attachments, when known without reading the file
+    media_mime_types: dict[str, str] = field(default_factory=dict)
+    # Motion photo videos (photo, video offset, target) still to be transcoded
+    pending_transcodes: list[tuple[str, int, str]] = field(default_factory=list)
+
     @property
     def fs_post_full_md_path(self) -> Path:
         """Get the full path to the post md file.
@@ -144,7 +230,9 @@ class NewPost(BasePost):
             "tags": self.tags,
             "title": self.title,
         }
-        return yaml.dump(include, default_flow_style=False)  # type: ignore[no-any-return]
+        import yaml  # pylint: disable=import-outside-toplevel
+
+        return yaml.dump(include, default_flow_style=False)
 
     @property
     def relative_media_path(self) -> Path:
@@ -165,8 +253,84 @@ class NewPost(BasePost):
         return [self.relative_media_path / media for media in self.media_file_names]
 
     def write_md(self) -> None:
-        """Write the post to a markdown file."""
-        self.fs_post_full_md_path.write_text(self.md_content, encoding="utf-8")
+        """Write the post to a markdown file, replaced in one step."""
+        write_atomic(self.fs_post_full_md_path, self.md_content.encode("utf-8"))
+
+
+@functools.cache
+def template_cache(site_dir: Path) -> jinja2.FileSystemBytecodeCache:
+    """Get the persistent cache of compiled templates for a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The bytecode cache, shared by every environment rendering the site.
+    """
+    cache_dir = site_dir / STATE_DIR_NAME / TEMPLATE_CACHE_DIR_NAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return jinja2.FileSystemBytecodeCache(str(cache_dir))
+
+
+def use_template_cache(site_dir: Path) -> None:
+    """Load the templates of the site renderer from the persistent cache.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    jinja_env.bytecode_cache = template_cache(site_dir)
+
+
+@functools.cache
+def _template_digest(name: str) -> str:
+    """Hash the source of a template so template changes invalidate pages.
+
+    Args:
+        name: The template name.
+
+    Returns:
+        A hex digest of the template source.
+    """
+    source, _filename, _uptodate = jinja_env.loader.get_source(  # type: ignore[union-attr]
+        jinja_env, name
+    )
+    return signature(source)
+
+
+def stale_post_pages(posts: list[ExistingPost], site_dir: Path) -> dict[str, str]:
+    """Find the posts whose page was built from other inputs, or is missing.
+
+    Args:
+        posts: The posts, with their next and previous links and renditions set.
+        site_dir: The directory of the site.
+
+    Returns:
+        The page signature of each post to render, by post id.
+    """
+    manifest = build_manifest(site_dir)
+    config = load_site_config(site_dir)
+    stale = {}
+    for post in posts:
+        page_signature = post.page_signature(config)
+        if not manifest.is_current(post.fs_post_full_html_path, page_signature):
+            stale[post.post_id] = page_signature
+    return stale
+
+
+def record_post_pages(
+    posts: list[ExistingPost], signatures: dict[str, str], site_dir: Path
+) -> None:
+    """Record the signatures of rendered post pages in the build manifest.
+
+    Args:
+        posts: The rendered posts.
+        signatures: The page signature of each post, by post id.
+        site_dir: The directory of the site.
+    """
+    manifest = build_manifest(site_dir)
+    for post in posts:
+        manifest.record(post.fs_post_full_html_path, signatures[post.post_id])
+    manifest.save()
 
 
 def _slugify(value: str, allow_unicode: bool = False) -> str:
@@ -191,7 +355,7 @@ def _slugify(value: str, allow_unicode: bool = False) -> str:
     return re.sub(r"[-\s]+", "-", value)
 
 
-def _extract_tags(request: Request) -> list[str]:
+def _extract_tags(request: "Request") -> list[str]:
     """Extract tags from flask request.
 
     Args:
@@ -200,7 +364,7 @@ def _extract_tags(request: Request) -> list[str]:
     Returns:
         The tags.
     """
-    form_keys = request.form.keys()  # type: ignore[no-untyped-call]
+    form_keys = request.form.keys()
     selected_tags = [key.split("-", 1)[1] for key in form_keys if key.startswith("tag-")]
     form_tags = request.form.get("tags", "")
     tag_list = [tag.strip() for tag in form_tags.split(",")] + selected_tags
@@ -210,20 +374,71 @@ def _extract_tags(request: Request) -> list[str]:
     return tag_list
 
 
-def _extract_images(post: NewPost, request: Request) -> None:
+def _split_motion_photo(
+    post: NewPost, media_path: Path, digest: str, offset: int, store: MediaStore
+) -> None:
+    """Split the still out of a Google motion photo and queue its video.
+
+    The still is copied by the kernel. The video is not copied at all,
+    the background transcode reads it from the photo at its offset. The
+    still is recorded against the upload in the media store, so uploading
+    the same motion photo again links it instead.
+
+    Args:
+        post: The post the photo was uploaded to.
+        media_path: The uploaded image.
+        digest: The sha256 of the uploaded image.
+        offset: The offset the video starts at.
+        store: The media store of the site.
+    """
+    file_base = media_path.stem
+    jpeg_path = post.fs_media_dir / ("ex_" + file_base + ".jpg")
+    mp4_h264_path = post.fs_media_dir / ("ex_h264_" + file_base + ".mp4")
+
+    still = store.find_derived(digest, "motion_still")
+    if still:
+        store.link(still, jpeg_path)
+    else:
+        # Post media may be hardlinked to the store, never write through them
+        jpeg_path.unlink(missing_ok=True)
+        from .ingest import copy_range  # pylint: disable=import-outside-toplevel
+
+        copy_range(media_path, jpeg_path, 0, offset)
+        store.record_derived(digest, "motion_still", store.add(jpeg_path, "image/jpeg"))
+
+    post.media_mime_types[jpeg_path.name] = "image/jpeg"
+    post.media_file_names.append(jpeg_path.name)
+    # The transcode runs in the background, see transcode_motion_video
+    post.pending_transcodes.append((media_path.name, offset, mp4_h264_path.name))
+    post.media_mime_types[mp4_h264_path.name] = "video/mp4"
+    post.media_file_names.append(mp4_h264_path.name)
+
+
+def _extract_images(post: NewPost, request: "Request", site_dir: Path) -> None:
     """Extract images from flask request.
 
+    Uploads are normally streamed into the media store staging area by
+    IngestRequest, which also hashed and sniffed them, so they are moved
+    into the store without being read again. A file that was uploaded
+    before is linked rather than stored again.
+
     Args:
         post: The post to extract images for.
         request: The Markdown content to extract images from.
+        site_dir: The directory of the site.
 
     Raises:
         ValueError: If the image directory is not set.
     """
-    # pylint: disable=too-many-locals
+    import magic  # pylint: disable=import-outside-toplevel
+
+    from .ingest import IngestFile  # pylint: disable=import-outside-toplevel
+    from .ingest import find_motion_offset  # pylint: disable=import-outside-toplevel
+
     if not post.fs_media_dir:
         raise ValueError("fs_media_dir is not set")
     post.fs_media_dir.mkdir(exist_ok=True, parents=True)
+    store = media_store(site_dir)
 
     all_media = request.files.getlist("media")
 
@@ -240,65 +455,43 @@ def _extract_images(post: NewPost, request: Request) -> None:
         # Make minimal changes to the filename
         filename = media.filename.replace(" ", "_")
         media_path = post.fs_media_dir / filename
-        media.save(media_path)
-
-        logger.debug(media)
-        mimetype = magic.from_file(media_path, mime=True)
+        # Post media may be hardlinked to the store, never write through them
+        media_path.unlink(missing_ok=True)
+        upload = media.stream
+        if isinstance(upload, IngestFile):
+            mimetype = upload.mime_type
+            digest, offset = upload.digest, upload.motion_offset
+            store.add_staged(upload.claim(), digest, media_path, mimetype)
+        else:
+            media.save(media_path)
+            mimetype = magic.from_file(media_path, mime=True)
+            digest = store.add(media_path, mimetype)
+            offset = find_motion_offset(media_path) if mimetype.startswith("image/") else None
         logger.debug(mimetype)
-        if mimetype.startswith("image/"):
-            eop = b"\x66\x74\x79\x70\x69\x73\x6F\x6D"
-            with media_path.open("r+b") as image:
-                mem_map = mmap(image.fileno(), 0)
-                file_size = mem_map.size()
-                place = mem_map.find(eop)
-                place_lim = file_size - len(eop)
-                if place in (-1, place_lim):
-                    post.media_file_names.append(filename)
-                    continue
-                offset = place - 4
-
-                mem_map.seek(0)
-                jpeg = mem_map.read(offset)
-
-                mem_map.seek(offset)
-                mp4 = mem_map.read(file_size)
-
-                file_base = media_path.stem
-                jpeg_path = post.fs_media_dir / ("ex_" + file_base + ".jpg")
-                with jpeg_path.open("w+b") as jpeg_file:
-                    jpeg_file.write(jpeg)
-                post.media_file_names.append(jpeg_path.name)
-
-                mp4_orig_path = post.fs_media_dir / ("ex_orig_" + file_base + ".mp4")
-                with mp4_orig_path.open("w+b") as mp4_file:
-                    mp4_file.write(mp4)
-                mp4_h264_path = post.fs_media_dir / ("ex_h264_" + file_base + ".mp4")
-
-                _subproc = subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-i",
-                        str(mp4_orig_path),
-                        "-map",
-                        "0:0",
-                        "-c:v",
-                        "libx264",
-                        "-crf",
-                        "18",
-                        "-c:a",
-                        "copy",
-                        str(mp4_h264_path),
-                    ],
-                    check=False,
-                )
-                logger.debug(_subproc.stderr)
-                logger.debug(_subproc.stdout)
-                post.media_file_names.append(mp4_h264_path.name)
-
+        post.media_mime_types[filename] = mimetype
+        if mimetype.startswith("image/") and offset is not None:
+            _split_motion_photo(post, media_path, digest, offset, store)
         else:
             post.media_file_names.append(filename)
 
 
+def _video_sources(videos: list[tuple[Path, str]]) -> list[tuple[Path, str, Path, Path]]:
+    """Add the mobile rendition and poster frame to the videos of a post.
+
+    Both are written by the background job after the post is saved.
+
+    Args:
+        videos: The relative path and MIME type of each video.
+
+    Returns:
+        The relative path, MIME type, mobile rendition path, and poster path.
+    """
+    return [
+        (path, mime, path.with_name(mobile_name(path.name)), path.with_name(poster_name(path.name)))
+        for path, mime in videos
+    ]
+
+
 def _media_groups(post: NewPost, names: list[str]) -> dict[str, list[tuple[Path, str]]]:
     """Group media files by major MIME type.
 
@@ -312,10 +505,14 @@ def _media_groups(post: NewPost, names: list[str]) -> dict[str, list[tuple[Path,
     mimes: dict[str, list[tuple[Path, str]]] = {}
     for media in names:
         path = post.fs_media_dir / media
-        if not path.is_file():
-            logger.warning("Skipping missing media file %s", path)
-            continue
-        mime = magic.from_file(path, mime=True)
+        mime = post.media_mime_types.get(media)
+        if mime is None:
+            if not path.is_file():
+                logger.warning("Skipping missing media file %s", path)
+                continue
+            import magic  # pylint: disable=import-outside-toplevel
+
+            mime = magic.from_file(path.resolve(), mime=True)
         mime_type, _mime_subtype = mime.split("/")
         if mime_type not in mimes:
             mimes[mime_type] = []
@@ -323,13 +520,13 @@ def _media_groups(post: NewPost, names: list[str]) -> dict[str, list[tuple[Path,
     return mimes
 
 
-_IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
 _TRAILING_IMAGE = re.compile(
     r"[ \t]*!\[\]\(media/([^)\s]+)\)[ \t]*(?:\r?\n)?\Z",
 )
 _TRAILING_VIDEO = re.compile(
     r"[ \t]*<div class=\"video\">\s*"
     r"<video[^>]*>\s*"
+    r"(?:<source src=\"media/ex_mobile_[^\"]+\"[^>]*>\s*)?"
     r"<source src=\"media/([^\"]+)\"[^>]*>\s*"
     r"</video>\s*"
     r"</div>[ \t]*(?:\r?\n)?\Z",
@@ -337,19 +534,6 @@ _TRAILING_VIDEO = re.compile(
 )
 
 
-def catalog_media_names(metadata: dict[str, object]) -> list[str]:
-    """Return media file names from post frontmatter.
-
-    Args:
-        metadata: Parsed post frontmatter.
-
-    Returns:
-        Names from media_file_names, or image_file_names for older posts.
-    """
-    names = metadata.get("media_file_names") or metadata.get("image_file_names") or []
-    return [str(name) for name in names]
-
-
 def strip_media_appendix(content: str, media_names: list[str]) -> str:
     """Remove a trailing generated media appendix from markdown content.
 
@@ -388,9 +572,7 @@ def edit_prose(post: ExistingPost) -> str:
     Returns:
         Prose suitable for the edit form.
     """
-    md_path = post.fs_post_directory / "post.md"
-    parsed_post = frontmatter_load(md_path)
-    return strip_media_appendix(post.md_content, catalog_media_names(parsed_post.metadata))
+    return strip_media_appendix(post.md_content, post.media_file_names)
 
 
 def media_names_in_content(content: str) -> set[str]:
@@ -405,70 +587,52 @@ def media_names_in_content(content: str) -> set[str]:
     return set(re.findall(r"media/([^)\s\"]+)", content))
 
 
-def _index_image_name(metadata: dict[str, object], content: str) -> str | None:
-    """Pick the index thumbnail file name for a post.
+def _post_from_entry(entry: CatalogEntry, site_dir: Path) -> ExistingPost:
+    """Build post metadata from a catalog entry.
+
+    The markdown body is not loaded, see ExistingPost.load_md_content.
 
     Args:
-        metadata: Parsed post frontmatter.
-        content: Markdown body.
+        entry: The catalog entry.
+        site_dir: The directory of the site.
 
     Returns:
-        A still-image file name, or None.
+        The post.
     """
-    for name in catalog_media_names(metadata):
-        if Path(name).suffix.lower() in _IMAGE_SUFFIXES:
-            return Path(name).name
-    images = re.findall(r"!\[.*\]\((.*?\.(?:jpg|jpeg|png))?.*\)", content)
-    names = [Path(image).name for image in images if image]
-    return names[0] if names else None
+    md_path = site_dir / entry.md_path
+    post = ExistingPost(
+        author=entry.author,
+        date=datetime.fromisoformat(entry.date),
+        fs_post_directory=md_path.parent,
+        fs_post_md_path=md_path,
+        md_content="",
+        media_file_names=list(entry.media_file_names),
+        md_stat=(entry.mtime_ns, entry.size),
+        post_id=entry.post_id,
+        tags=list(entry.tags),
+        title=entry.title,
+    )
+    post.post_url = Path("/") / post.fs_post_full_html_path.relative_to(site_dir)
+    post.index_image = entry.index_image
+    return post
 
 
-def _populate_post_metadata(
-    md_glob: Iterator[Path], site_dir: Path, limit: list[Path] | None = None
-) -> list[ExistingPost]:
-    """Populate the metadata for all posts.
+def _populate_post_metadata(site_dir: Path) -> list[ExistingPost]:
+    """Populate the metadata for all posts from the post catalog.
 
     Args:
-        md_glob: The glob of markdown files.
         site_dir: The directory of the site.
-        limit: The list of posts to limit to.
 
     Returns:
-        The list of posts.
+        The list of posts, ordered chronologically.
     """
-    posts = []
-
-    for path in md_glob:
-        if limit and path not in limit:
-            continue
-        parsed_post = frontmatter_load(path)
-        date = datetime.fromisoformat(parsed_post["date"])
-        if not date.tzinfo:
-            date = date.replace(tzinfo=timezone.utc)
-        image_file_names = _index_image_name(parsed_post.metadata, parsed_post.content)
-
-        # Some older posts have categories, convert to tags
-        tags = parsed_post.metadata.get("tags", [])
-        categories = parsed_post.metadata.get("categories", [])
-
-        post = ExistingPost(
-            author=parsed_post.get("author", ""),
-            date=date,
-            fs_post_directory=path.parent,
-            md_content=parsed_post.content,
-            post_id=path.parent.name,
-            tags=tags + categories,
-            title=parsed_post["title"],
-        )
-        post.post_url = Path("/") / post.fs_post_full_html_path.relative_to(site_dir)
-        if image_file_names:
-            post.index_image = image_file_names
-            post.thumbnail_parent_url = Path("/") / post.fs_media_dir.relative_to(site_dir)
-        posts.append(post)
-    # Ensure we are ordered chronologically
-    posts.sort(key=lambda x: x.date)
-
-    return posts
+    catalog = post_catalog(site_dir)
+    # The refresh parses new posts, so it is measured and the posts counted after it
+    entries: list[CatalogEntry] = []
+    with memory_snapshots("populate_post_metadata", lambda: len(entries)):
+        catalog.refresh()
+        entries = catalog.all_entries()
+        return [_post_from_entry(entry, site_dir) for entry in entries]
 
 
 def _populate_post_next_previous(posts: list[ExistingPost], site_dir: Path) -> None:
@@ -528,9 +692,13 @@ def _render_markdown(content: str) -> str:
     Returns:
         The rendered HTML.
     """
+    import cmarkgfm  # pylint: disable=import-outside-toplevel
+
+    from cmarkgfm.cmark import Options  # pylint: disable=import-outside-toplevel
+
     content = cmarkgfm.github_flavored_markdown_to_html(
         content,
-        options=cmarkgfmOptions.CMARK_OPT_UNSAFE,
+        options=Options.CMARK_OPT_UNSAFE,
     )
     return content
 
@@ -547,17 +715,19 @@ def find_post(site_dir: Path, post_id: str) -> ExistingPost | None:
     """
     if not post_id:
         return None
-    posts_dir = site_dir / "posts"
-    posts_root = posts_dir.resolve()
-    all_posts = _populate_post_metadata(md_glob=posts_dir.rglob("*.md"), site_dir=site_dir)
-    matches = [post for post in all_posts if post.post_id == post_id]
-    if not matches:
+    posts_root = (site_dir / "posts").resolve()
+    catalog = post_catalog(site_dir)
+    catalog.refresh()
+    entry = catalog.find(post_id)
+    if entry is None:
         return None
-    post_dir = matches[0].fs_post_directory.resolve()
+    post = _post_from_entry(entry, site_dir)
+    post_dir = post.fs_post_directory.resolve()
     if not post_dir.is_relative_to(posts_root):
         logger.error("Refusing to use path outside posts dir: %s", post_dir)
         return None
-    return matches[0]
+    post.load_md_content()
+    return post
 
 
 def load_site_config(site_dir: Path) -> dict[str, object]:
@@ -573,6 +743,8 @@ def load_site_config(site_dir: Path) -> dict[str, object]:
     if not path.is_file():
         logger.info("No site config.yml found at %s", path)
         return {}
+    import yaml  # pylint: disable=import-outside-toplevel
+
     loaded = yaml.safe_load(path.read_text(encoding="utf-8"))
     if not isinstance(loaded, dict):
         logger.warning("Ignoring %s because it is not a YAML mapping", path)
@@ -581,7 +753,7 @@ def load_site_config(site_dir: Path) -> dict[str, object]:
     return loaded
 
 
-def delete_post(site_dir: Path, post_id: str) -> bool:
+def delete_post(site_dir: Path, post_id: str) -> Path | None:
     """Delete a post directory from the site.
 
     Args:
@@ -589,25 +761,28 @@ def delete_post(site_dir: Path, post_id: str) -> bool:
         post_id: The id of the post to delete.
 
     Returns:
-        True if the post was found and removed.
+        The removed post directory, or None if the post was not found.
     """
     existing = find_post(site_dir, post_id)
     if existing is None:
-        return False
+        return None
 
     posts_root = (site_dir / "posts").resolve()
     post_dir = existing.fs_post_directory.resolve()
     shutil.rmtree(post_dir)
+    manifest = build_manifest(site_dir)
+    manifest.forget(existing.fs_post_full_html_path)
+    manifest.save()
     parent = post_dir.parent
     for _ in range(2):
         if parent == posts_root or not parent.exists() or any(parent.iterdir()):
             break
         parent.rmdir()
         parent = parent.parent
-    return True
+    return existing.fs_post_directory
 
 
-def update_post(site_dir: Path, request: Request) -> ExistingPost | None:
+def update_post(site_dir: Path, request: "Request") -> NewPost | None:
     """Update a post's markdown and re-append attached media.
 
     The edit form holds prose only. This writes that prose, then appends
@@ -619,15 +794,17 @@ def update_post(site_dir: Path, request: Request) -> ExistingPost | None:
         request: The edit form request.
 
     Returns:
-        The existing post, or None if it was not found.
+        The updated post, or None if it was not found.
     """
     existing = find_post(site_dir, request.form.get("post_id", ""))
     if existing is None:
         return None
 
-    md_path = existing.fs_post_directory / "post.md"
-    parsed_post = frontmatter_load(md_path)
-    existing_media = catalog_media_names(parsed_post.metadata)
+    existing_media = existing.media_file_names
+    # The types of stored media are known, so the appendix does not read the files
+    known_types = media_store(site_dir).mime_types(
+        [existing.fs_media_dir / name for name in existing_media]
+    )
 
     draft = NewPost(
         author=request.form["author"],
@@ -635,11 +812,13 @@ def update_post(site_dir: Path, request: Request) -> ExistingPost | None:
         media_file_names=list(existing_media),
         fs_post_directory=existing.fs_post_directory,
         md_content="",
+        media_mime_types=known_types,
         post_id=existing.post_id,
         tags=_extract_tags(request),
         title=request.form.get("title", existing.title),
     )
-    _extract_images(post=draft, request=request)
+    with stage("extract_images"):
+        _extract_images(post=draft, request=request, site_dir=site_dir)
     prose = strip_media_appendix(
         request.form.get("content", ""),
         draft.media_file_names,
@@ -652,11 +831,25 @@ def update_post(site_dir: Path, request: Request) -> ExistingPost | None:
     draft.md_content = template.render(
         content=prose,
         images=appendix.get("image", []),
-        videos=appendix.get("video", []),
+        videos=_video_sources(appendix.get("video", [])),
         md_header=draft.md_header,
     )
     draft.write_md()
-    return existing
+    return draft
+
+
+def load_posts(site_dir: Path) -> list[ExistingPost]:
+    """Load every post with its next and previous links.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The posts, ordered chronologically.
+    """
+    all_posts = _populate_post_metadata(site_dir=site_dir)
+    _populate_post_next_previous(posts=all_posts, site_dir=site_dir)
+    return all_posts
 
 
 def convert_all_html(
@@ -665,6 +858,8 @@ def convert_all_html(
 ) -> tuple[list[ExistingPost], list[ExistingPost]]:
     """Convert all posts to html.
 
+    Posts whose page was built from the same inputs are not rendered again.
+
     Args:
         site_dir: The directory of the site.
         post_id: The name of the post to build.
@@ -672,23 +867,26 @@ def convert_all_html(
     Returns:
         The number of posts built.
     """
-    posts_dir = site_dir / "posts"
-    md_glob = posts_dir.rglob("*.md")
-    all_posts = _populate_post_metadata(md_glob=md_glob, site_dir=site_dir)
-
-    _populate_post_next_previous(posts=all_posts, site_dir=site_dir)
+    all_posts = load_posts(site_dir)
 
     if post_id:
         revise_posts = _prune_post_list(post_id=post_id, posts=all_posts)
     else:
         revise_posts = all_posts
 
+    cache = rendition_cache(site_dir)
     for post in revise_posts:
+        post.renditions = cache.lookup(post_images(post.fs_media_dir))
+    signatures = stale_post_pages(revise_posts, site_dir)
+    stale = [post for post in revise_posts if post.post_id in signatures]
+    for post in stale:
+        post.load_md_content()
         post.write_html()
+    record_post_pages(stale, signatures, site_dir)
     return revise_posts, all_posts
 
 
-def initialize_new_post(request: Request, posts_dir: Path) -> NewPost:
+def initialize_new_post(request: "Request", posts_dir: Path) -> NewPost:
     """Initialize a new post.
 
     Args:
@@ -716,125 +914,21 @@ def initialize_new_post(request: Request, posts_dir: Path) -> NewPost:
         title=request.form.get("title", str(now_iso)),
     )
 
-    _extract_images(post=post, request=request)
+    with stage("extract_images"):
+        _extract_images(post=post, request=request, site_dir=posts_dir.parent)
 
     template = jinja_env.get_template("post.md.j2")
     mimes = _media_groups(post, post.media_file_names)
     post.md_content = template.render(
         content=request.form["content"],
         images=mimes.get("image", []),
-        videos=mimes.get("video", []),
+        videos=_video_sources(mimes.get("video", [])),
         md_header=post.md_header,
     )
 
     return post
 
 
-def write_index(posts: list[ExistingPost], site_dir: Path) -> None:
-    """Write the index file.
-
-    Args:
-        posts: The posts.
-        site_dir: The directory of the site.
-    """
-    path = site_dir / "index.html"
-    template = jinja_env.get_template("index.html.j2")
-    rendered = template.render(posts=posts, title="everything")
-
-    path.write_text(rendered, encoding="utf-8")
-
-
-def write_tag_indices(posts: list[ExistingPost], site_dir: Path) -> None:
-    """Write the tag files.
-
-    Args:
-        posts: The posts.
-        site_dir: The directory of the site.
-    """
-    tag_dir = site_dir / "tags"
-    # Start with fresh tag indices
-    shutil.rmtree(tag_dir, ignore_errors=True)
-
-    all_tags: dict[str, list[ExistingPost]] = {}
-    for post in posts:
-        for tag in post.tags:
-            if tag not in all_tags:
-                all_tags[tag] = []
-            all_tags[tag].append(post)
-
-    for tag, matching_posts in all_tags.items():
-        tag_index_path = Path(tag_dir)
-        tag_index_path.mkdir(parents=True, exist_ok=True)
-        path = tag_index_path / f"{_slugify(tag)}.html"
-        template = jinja_env.get_template("index.html.j2")
-        rendered = template.render(posts=matching_posts, title=tag, title_icon="tag")
-        path.write_text(rendered, encoding="utf-8")
-
-
-def write_author_indices(posts: list[ExistingPost], site_dir: Path) -> None:
-    """Write the author files.
-
-    Args:
-        posts: The posts.
-        site_dir: The directory of the site.
-    """
-    author_dir = site_dir / "authors"
-    # Start with fresh author indices
-    shutil.rmtree(author_dir, ignore_errors=True)
-
-    all_authors: dict[str, list[ExistingPost]] = {}
-    for post in posts:
-        author = post.author
-        if author not in all_authors:
-            all_authors[author] = []
-        all_authors[author].append(post)
-
-    for author, matching_posts in all_authors.items():
-        author_index_path = Path(author_dir)
-        author_index_path.mkdir(parents=True, exist_ok=True)
-        path = author_index_path / f"{_slugify(author)}.html"
-        template = jinja_env.get_template("index.html.j2")
-        rendered = template.render(posts=matching_posts, title=author, title_icon="person")
-        path.write_text(rendered, encoding="utf-8")
-
-
-def build_thumbnails(posts: list[ExistingPost]) -> None:
-    """Build thumbnails for the post.
-
-    Args:
-        posts: The post to build thumbnails for.
-
-    Raises:
-        ValueError: If the thumbnail URL is not set.
-    """
-    count = 0
-    for post in posts:
-        image_dir = post.fs_media_dir
-        index_image = post.index_image
-        if not index_image:
-            continue
-        image_path = image_dir / index_image
-        thumbnail_name = f"thumb_{index_image}"
-        if post.thumbnail_parent_url is None:
-            raise ValueError("Thumbnail URL not set")
-        post.thumbnail_url = post.thumbnail_parent_url / thumbnail_name
-        if not (image_dir / thumbnail_name).exists():
-            image = Image.open(image_path)
-            transposed = ImageOps.exif_transpose(image)
-            if transposed is not None:
-                image = transposed
-            image.thumbnail((1000, 1000), Image.Resampling.LANCZOS)
-            save_image = image
-            if thumbnail_name.lower().endswith((".jpg", ".jpeg")) and image.mode not in (
-                "RGB",
-                "L",
-            ):
-                save_image = image.convert("RGB")
-            save_image.save(image_dir / thumbnail_name)
-            count += 1
-    logger.debug("Built %s thumbnails", count)
-
-
 def render_search_results(search_str: str, site_dir: Path) -> list[ExistingPost]:
     """Render the search results.
 
@@ -843,19 +937,19 @@ def render_search_results(search_str: str, site_dir: Path) -> list[ExistingPost]
         site_dir: The directory of the site.
 
     Returns:
-        The rendered search results.
+        The matching posts, ranked with the best match last.
     """
-    res = subprocess.run(
-        f"grep -r -i -l --include='*.md' '{search_str}' {site_dir}",
-        shell=True,
-        capture_output=True,
-        check=False,
-    )
-    limit = [Path(line) for line in res.stdout.decode("utf-8").splitlines()]
-    if not limit:
-        return []
-    posts_dir = site_dir / "posts"
-    md_glob = posts_dir.rglob("*.md")
-    posts = _populate_post_metadata(md_glob=md_glob, site_dir=site_dir, limit=limit)
-    build_thumbnails(posts)
+    # The index and the catalog are kept current as posts change, not here
+    catalog = post_catalog(site_dir)
+    posts = []
+    for hit in search_index(site_dir).search(search_str):
+        entry = catalog.find(hit.post_id)
+        if entry is None:
+            continue
+        post = _post_from_entry(entry, site_dir)
+        post.snippet = hit.snippet
+        posts.append(post)
+    build_thumbnails(posts, site_dir)
+    # The index template lists posts in reverse, so put the best match last
+    posts.reverse()
     return posts
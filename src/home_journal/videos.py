@@ -0,0 +1,318 @@
+"""Faststart remuxes, poster frames, and mobile renditions of post videos."""
+import logging
+import struct
+import subprocess
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .file_events import file_changed
+from .media_store import MediaStore
+from .media_store import media_store
+from .media_store import post_media
+from .metrics import ffmpeg_seconds
+from .metrics import note_stage
+
+
+if TYPE_CHECKING:
+    from .utils import ExistingPost
+
+
+logger = logging.getLogger(__name__)
+
+VIDEO_SUFFIXES = {".m4v", ".mov", ".mp4", ".webm"}
+
+# Containers whose index can be moved to the front of the file
+FASTSTART_SUFFIXES = {".m4v", ".mov", ".mp4"}
+
+# The MIME types of derived files, by suffix
+MIME_TYPES = {".jpg": "image/jpeg", ".m4v": "video/mp4", ".mov": "video/quicktime"}
+
+# The lower bitrate rendition served to small screens
+MOBILE_PREFIX = "ex_mobile_"
+
+# The frame shown before a video plays, and used for its index thumbnail
+POSTER_PREFIX = "ex_poster_"
+
+# Motion photo videos split out by earlier versions, no longer needed once transcoded
+_ORIGINAL_PREFIX = "ex_orig_"
+
+_MOBILE_ARGS = [
+    "-map",
+    "0:v:0",
+    "-map",
+    "0:a:0?",
+    "-vf",
+    "scale=-2:'min(720,trunc(ih/2)*2)'",
+    "-c:v",
+    "libx264",
+    "-preset",
+    "veryfast",
+    "-crf",
+    "28",
+    "-maxrate",
+    "1500k",
+    "-bufsize",
+    "3000k",
+    "-pix_fmt",
+    "yuv420p",
+    "-c:a",
+    "aac",
+    "-b:a",
+    "96k",
+    "-movflags",
+    "+faststart",
+]
+
+# Each ffmpeg process uses several cores, so only this many run at once in
+# the process, whether started by background jobs or a rebuild
+_ffmpeg_slots = threading.BoundedSemaphore(1)
+
+
+def set_ffmpeg_limit(limit: int) -> None:
+    """Set the number of ffmpeg processes allowed to run at once.
+
+    Args:
+        limit: The number of processes, at least 1.
+    """
+    global _ffmpeg_slots  # pylint: disable=global-statement
+    _ffmpeg_slots = threading.BoundedSemaphore(max(1, limit))
+
+
+def run_ffmpeg(args: list[str], target: Path) -> bool:
+    """Run ffmpeg once a slot is free, writing a file atomically.
+
+    Args:
+        args: The ffmpeg arguments, without the output file.
+        target: The file to write, replaced only if ffmpeg succeeds.
+
+    Returns:
+        True if the file was written.
+    """
+    # The suffix is kept so ffmpeg picks the output format from it
+    tmp_target = target.with_name(f".{target.stem}.tmp{target.suffix}")
+    with _ffmpeg_slots:
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", *args, str(tmp_target)],
+                capture_output=True,
+                check=False,
+                stdin=subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            logger.warning("Could not write %s, ffmpeg is not installed", target)
+            return False
+        seconds = time.perf_counter() - start
+    succeeded = result.returncode == 0 and tmp_target.is_file()
+    ffmpeg_seconds.observe(seconds, result="done" if succeeded else "failed")
+    note_stage("ffmpeg", seconds)
+    if not succeeded:
+        logger.warning("ffmpeg could not write %s: %s", target, result.stderr.decode().strip())
+        tmp_target.unlink(missing_ok=True)
+        return False
+    tmp_target.replace(target)
+    file_changed(target)
+    return True
+
+
+def derive_video_file(
+    source: Path,
+    kind: str,
+    target: Path,
+    args: list[str],
+    store: MediaStore,
+) -> bool:
+    """Write a file derived from a video with ffmpeg, unless it was made before.
+
+    The result is stored against the digest of the source, so the same
+    upload in another post links it instead of running ffmpeg again.
+
+    Args:
+        source: The source file, as stored in the media store.
+        kind: The kind of derived file, e.g. video_poster.
+        target: The post media file to write.
+        args: The ffmpeg arguments, without the output file.
+        store: The media store of the site.
+
+    Returns:
+        True if the target exists now.
+    """
+    digest = store.digests([source]).get(source)
+    known = store.find_derived(digest, kind) if digest else None
+    if known:
+        if not target.is_file() or store.digests([target]).get(target) != known:
+            logger.debug("Reusing the %s of %s", kind, source)
+            store.link(known, target)
+        return True
+    if not run_ffmpeg(args, target):
+        return False
+    derived = store.add(target, MIME_TYPES.get(target.suffix.lower(), "video/mp4"))
+    if digest:
+        store.record_derived(digest, kind, derived)
+    return True
+
+
+def is_faststart(path: Path) -> bool:
+    """Check whether a video can start playing before it is fully downloaded.
+
+    The top level boxes of the file are walked, the index (moov) must come
+    before the media data (mdat).
+
+    Args:
+        path: The video.
+
+    Returns:
+        False if the index follows the media data, True otherwise.
+    """
+    with path.open("rb") as video:
+        while header := video.read(8):
+            if len(header) < 8:
+                break
+            size, box = struct.unpack(">I4s", header)
+            if box == b"moov":
+                return True
+            if box == b"mdat":
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", video.read(8))[0] - 8
+            if size < 8:
+                break
+            video.seek(size - 8, 1)
+    return True
+
+
+def poster_name(name: str) -> str:
+    """Get the file name of the poster frame of a video.
+
+    Args:
+        name: The video file name.
+
+    Returns:
+        The poster file name.
+    """
+    return f"{POSTER_PREFIX}{Path(name).stem}.jpg"
+
+
+def mobile_name(name: str) -> str:
+    """Get the file name of the mobile rendition of a video.
+
+    Args:
+        name: The video file name.
+
+    Returns:
+        The mobile rendition file name.
+    """
+    return f"{MOBILE_PREFIX}{Path(name).stem}.mp4"
+
+
+def is_video(name: str) -> bool:
+    """Check whether a media file is an uploaded or transcoded video.
+
+    Args:
+        name: The media file name.
+
+    Returns:
+        True for videos, but not for their renditions.
+    """
+    return Path(name).suffix.lower() in VIDEO_SUFFIXES and not name.startswith(
+        (MOBILE_PREFIX, _ORIGINAL_PREFIX)
+    )
+
+
+def process_video(path: Path, store: MediaStore, mobile: bool = True) -> None:
+    """Make a video ready to stream, with a poster frame and a mobile rendition.
+
+    MP4 and QuickTime files with their index at the end are remuxed, so
+    playback starts before the whole file is downloaded.
+
+    Args:
+        path: The video in the post media directory.
+        store: The media store of the site.
+        mobile: Also write the mobile rendition.
+    """
+    if not path.is_file():
+        logger.warning("Skipping missing video %s", path)
+        return
+    if path.suffix.lower() in FASTSTART_SUFFIXES and not is_faststart(path):
+        derive_video_file(
+            path,
+            "faststart",
+            path,
+            ["-i", str(path), "-map", "0:v", "-map", "0:a?", "-c", "copy"]
+            + ["-map_metadata", "0", "-movflags", "+faststart"],
+            store,
+        )
+    derive_video_file(
+        path,
+        "video_poster",
+        path.with_name(poster_name(path.name)),
+        ["-i", str(path), "-frames:v", "1", "-q:v", "3"],
+        store,
+    )
+    if mobile:
+        derive_video_file(
+            path,
+            "video_mobile",
+            path.with_name(mobile_name(path.name)),
+            ["-i", str(path), *_MOBILE_ARGS],
+            store,
+        )
+
+
+def transcode_motion_video(source: Path, offset: int, target: Path, store: MediaStore) -> None:
+    """Transcode the video of a motion photo to H.264.
+
+    ffmpeg reads the video straight from the photo with its subfile
+    protocol, so the embedded video is never copied to its own file. A
+    photo whose video was transcoded before links that transcode instead.
+
+    Args:
+        source: The motion photo, or a file holding only the video.
+        offset: The offset the video starts at in the source.
+        target: The H.264 video to write.
+        store: The media store of the site.
+    """
+    video_input = f"subfile,,start,{offset},end,0,,:{source}" if offset else str(source)
+    args = ["-i", video_input, "-map", "0:0", "-c:v", "libx264", "-crf", "18"]
+    args += ["-c:a", "copy", "-movflags", "+faststart"]
+    derive_video_file(source, "motion_h264", target, args, store)
+
+
+def remove_split_videos(media_dir: Path) -> None:
+    """Delete motion photo videos split out by earlier versions once transcoded.
+
+    Args:
+        media_dir: The media directory of a post.
+    """
+    for path in media_dir.glob(f"{_ORIGINAL_PREFIX}*"):
+        transcoded = path.with_name(path.name.replace(_ORIGINAL_PREFIX, "ex_h264_", 1))
+        if transcoded.is_file():
+            logger.debug("Removing %s, it was transcoded to %s", path, transcoded.name)
+            path.unlink()
+
+
+def build_videos(posts: list["ExistingPost"], site_dir: Path, jobs: int = 1) -> None:
+    """Make the videos of posts ready to stream and give each a poster frame.
+
+    Mobile renditions are only made when a post is published or edited,
+    posts written before they existed do not reference one.
+
+    Args:
+        posts: The posts.
+        site_dir: The directory of the site.
+        jobs: The number of videos processed at once, ffmpeg itself is
+            limited by set_ffmpeg_limit.
+    """
+    store = media_store(site_dir)
+    for post in posts:
+        remove_split_videos(post.fs_media_dir)
+    videos = [
+        path for post in posts for path in post_media(post.fs_media_dir) if is_video(path.name)
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(lambda path: process_video(path, store, mobile=False), videos))
+    logger.debug("Processed %s videos", len(videos))
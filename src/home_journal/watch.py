@@ -0,0 +1,280 @@
+"""Watch the posts directory with inotify and report which posts changed."""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from collections.abc import Callable
+from pathlib import Path
+
+from .videos import MOBILE_PREFIX
+from .videos import POSTER_PREFIX
+
+
+logger = logging.getLogger(__name__)
+
+# Event flags from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# The events a post directory is watched for, a file counts once it is closed or moved in
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# Seconds without events before changes are reported, an rsync is one burst
+DEBOUNCE_SECONDS = 1.0
+
+# Seconds after the first event at which changes are reported even if events keep coming
+MAX_DELAY_SECONDS = 10.0
+
+# The post file and the directory of its media in a post directory
+POST_FILE_NAME = "post.md"
+MEDIA_DIR_NAME = "media"
+
+# Media written by the app itself, which never needs processing again
+_DERIVED_PREFIXES = (MOBILE_PREFIX, POSTER_PREFIX)
+
+_EVENT = struct.Struct("iIII")
+
+
+def _libc() -> ctypes.CDLL | None:
+    """Load the C library if it has the inotify calls.
+
+    Returns:
+        The C library, or None on systems without inotify.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+def inotify_available() -> bool:
+    """Check whether the system can watch directories with inotify.
+
+    Returns:
+        True on Linux.
+    """
+    return _libc() is not None
+
+
+class Inotify:
+    """A minimal inotify instance, read without blocking."""
+
+    def __init__(self) -> None:
+        """Open the inotify instance.
+
+        Raises:
+            OSError: If inotify is not available or cannot be opened.
+        """
+        libc = _libc()
+        if libc is None:
+            raise OSError("inotify is not available on this system")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        """Watch a directory.
+
+        Args:
+            path: The directory.
+            mask: The events to report.
+
+        Returns:
+            The watch descriptor.
+
+        Raises:
+            OSError: If the directory cannot be watched.
+        """
+        wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def read(self, timeout: float | None) -> list[tuple[int, int, str]]:
+        """Read the pending events.
+
+        Args:
+            timeout: Seconds to wait for an event, None waits until one arrives.
+
+        Returns:
+            The watch descriptor, mask, and file name of each event.
+        """
+        readable, _writable, _errors = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        """Close the inotify instance and all its watches."""
+        os.close(self.fd)
+
+
+class PostWatcher:
+    """Watch the posts of a site and report the post directories that changed.
+
+    Every directory below posts/ is watched, new directories as they
+    appear. Changes are collected until the posts are quiet for a moment,
+    so an rsync of many posts is reported once.
+    """
+
+    def __init__(
+        self,
+        site_dir: Path,
+        on_change: Callable[[set[Path]], None],
+        debounce: float = DEBOUNCE_SECONDS,
+        max_delay: float = MAX_DELAY_SECONDS,
+    ) -> None:
+        """Initialize the watcher.
+
+        Args:
+            site_dir: The directory of the site.
+            on_change: Called from the watcher thread with the changed post directories.
+            debounce: Seconds without events before changes are reported.
+            max_delay: Seconds after the first event at which changes are always reported.
+        """
+        self.posts_dir = site_dir / "posts"
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._inotify: Inotify | None = None
+        self._dirs: dict[int, Path] = {}
+
+    def _watch_tree(self, root: Path) -> set[Path]:
+        """Watch a directory and every directory below it.
+
+        Args:
+            root: The directory.
+
+        Returns:
+            The post directories found, files in them may predate the watch.
+        """
+        found: set[Path] = set()
+        if self._inotify is None:
+            return found
+        for current, dirs, files in os.walk(root):
+            path = Path(current)
+            try:
+                self._dirs[self._inotify.add_watch(path, WATCH_MASK)] = path
+            except OSError as exc:
+                logger.warning("Cannot watch %s: %s", path, exc)
+                continue
+            if POST_FILE_NAME in files:
+                found.add(path)
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+        return found
+
+    def _post_dir(self, path: Path, mask: int) -> Path | None:
+        """Get the post directory an event is about.
+
+        Args:
+            path: The file or directory the event names.
+            mask: The event flags.
+
+        Returns:
+            The post directory, or None for files the app writes itself.
+        """
+        if path.name.startswith("."):
+            return None
+        if mask & IN_ISDIR:
+            return path.parent if path.name == MEDIA_DIR_NAME else path
+        if path.name == POST_FILE_NAME:
+            return path.parent
+        if path.parent.name == MEDIA_DIR_NAME and not path.name.startswith(_DERIVED_PREFIXES):
+            return path.parent.parent
+        return None
+
+    def _collect(self, events: list[tuple[int, int, str]], changed: set[Path]) -> None:
+        """Add the post directories changed by a batch of events.
+
+        Args:
+            events: The watch descriptor, mask, and file name of each event.
+            changed: The changed post directories, updated in place.
+        """
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("Missed file events, rescanning %s", self.posts_dir)
+                changed.update(self._watch_tree(self.posts_dir))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / name
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                changed.update(self._watch_tree(path))
+            post_dir = self._post_dir(path, mask)
+            if post_dir is not None and post_dir.is_relative_to(self.posts_dir):
+                changed.add(post_dir)
+
+    def run(self) -> None:
+        """Watch the posts until the process exits."""
+        self.posts_dir.mkdir(parents=True, exist_ok=True)
+        self._inotify = Inotify()
+        self._watch_tree(self.posts_dir)
+        logger.info("Watching %s directories below %s", len(self._dirs), self.posts_dir)
+        changed: set[Path] = set()
+        first = last = 0.0
+        while True:
+            timeout = None
+            if changed:
+                deadline = min(last + self.debounce, first + self.max_delay)
+                timeout = max(0.0, deadline - time.monotonic())
+            events = self._inotify.read(timeout)
+            now = time.monotonic()
+            if events:
+                if not changed:
+                    first = now
+                last = now
+                self._collect(events, changed)
+            if changed and (now >= last + self.debounce or now >= first + self.max_delay):
+                logger.info("Posts changed on disk: %s", len(changed))
+                try:
+                    self.on_change(changed)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.exception("Could not handle changed posts")
+                changed = set()
+
+    def start(self) -> threading.Thread:
+        """Watch the posts in a daemon thread.
+
+        Returns:
+            The watcher thread.
+        """
+        thread = threading.Thread(target=self.run, name="post-watcher", daemon=True)
+        thread.start()
+        return thread
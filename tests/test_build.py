@@ -0,0 +1,98 @@
+"""Tests for the whole site rebuild."""
+import time
+
+from pathlib import Path
+
+import pytest
+
+from home_journal.build import initialize_site
+from home_journal.build import rebuild_site
+from home_journal.metrics import collect_stages
+from home_journal.pool import process_map
+
+
+# The number of posts in the unchanged rebuild test, a small journal
+POST_COUNT = 200
+
+
+def _write_posts(site_dir: Path, count: int) -> list[str]:
+    """Write posts a day apart.
+
+    Args:
+        site_dir: The directory of the site.
+        count: The number of posts.
+
+    Returns:
+        The post ids, ordered chronologically.
+    """
+    post_ids = []
+    for idx in range(count):
+        post_id = f"post{idx:04d}"
+        md_path = site_dir / "posts" / post_id / "post.md"
+        (md_path.parent / "media").mkdir(parents=True)
+        md_path.write_text(
+            f"---\nauthor: Ann\ndate: '2023-01-01 00:00:00.{idx:06d}'\n"
+            f"post_id: {post_id}\ntags: [garden]\ntitle: Post {idx}\n---\nBody {idx}\n",
+            encoding="utf-8",
+        )
+        post_ids.append(post_id)
+    return post_ids
+
+
+@pytest.fixture(name="site_dir")
+def _site_dir(tmp_path: Path) -> Path:
+    """Create an initialized site.
+
+    Args:
+        tmp_path: A temporary directory.
+
+    Returns:
+        The directory of the site.
+    """
+    initialize_site(tmp_path)
+    return tmp_path
+
+
+def test_process_map_keeps_item_order() -> None:
+    """Results from worker processes come back in the order of the items."""
+    items = [str(idx) for idx in range(20)]
+
+    assert process_map(str.upper, items, jobs=2, chunksize=3) == items
+
+
+def test_pool_rebuild_renders_every_post(site_dir: Path) -> None:
+    """A rebuild on worker processes renders each post page.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    post_ids = _write_posts(site_dir, 5)
+
+    result = rebuild_site(site_dir, jobs=2)
+
+    assert [post.post_id for post in result.posts] == post_ids
+    assert result.rendered == len(post_ids)
+    for idx, post_id in enumerate(post_ids):
+        page = site_dir / "posts" / post_id / "index.html"
+        assert f"Body {idx}" in page.read_text(encoding="utf-8")
+
+
+def test_unchanged_rebuild_is_fast(site_dir: Path) -> None:
+    """A rebuild with nothing changed renders nothing and skips the media steps.
+
+    Args:
+        site_dir: The directory of the site.
+    """
+    _write_posts(site_dir, POST_COUNT)
+    rebuild_site(site_dir)
+
+    with collect_stages() as stages:
+        start = time.perf_counter()
+        result = rebuild_site(site_dir)
+        seconds = time.perf_counter() - start
+
+    assert result.rendered == 0
+    assert seconds < 1
+    assert not {"build_videos", "adopt_media", "build_renditions"} & {
+        name for name, _seconds in stages
+    }
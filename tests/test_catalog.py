@@ -0,0 +1,118 @@
+"""Tests for the persistent post catalog."""
+import os
+
+from pathlib import Path
+
+from home_journal.catalog import PostCatalog
+
+
+def _write_post(site_dir: Path, post_id: str, title: str, tags: str = "[]") -> Path:
+    """Write a post markdown file.
+
+    Args:
+        site_dir: The directory of the site.
+        post_id: The id of the post.
+        title: The title of the post.
+        tags: The tags of the post as YAML.
+
+    Returns:
+        The markdown file.
+    """
+    md_path = site_dir / "posts" / post_id / "post.md"
+    md_path.parent.mkdir(parents=True, exist_ok=True)
+    md_path.write_text(
+        f"---\ndate: '2023-01-02 03:04:05'\ntitle: {title}\ntags: {tags}\n---\nBody\n",
+        encoding="utf-8",
+    )
+    return md_path
+
+
+def _touch_later(path: Path) -> None:
+    """Move the modification time of a file forward.
+
+    Args:
+        path: The file.
+    """
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_refresh_catalogs_new_posts(tmp_path: Path) -> None:
+    """New posts are reported as changed, then not again.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    _write_post(tmp_path, "one", "One")
+    _write_post(tmp_path, "two", "Two")
+    catalog = PostCatalog(tmp_path)
+
+    assert catalog.refresh() == {"one", "two"}
+    assert not catalog.refresh()
+    assert [entry.title for entry in catalog.all_entries()] == ["One", "Two"]
+
+
+def test_refresh_reparses_changed_posts(tmp_path: Path) -> None:
+    """A post whose stat data changed is parsed again.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    md_path = _write_post(tmp_path, "one", "One")
+    catalog = PostCatalog(tmp_path)
+    catalog.refresh()
+
+    _write_post(tmp_path, "one", "Renamed", tags="[a, 2023]")
+    _touch_later(md_path)
+
+    assert catalog.refresh() == {"one"}
+    entry = catalog.all_entries()[0]
+    assert entry.title == "Renamed"
+    assert entry.tags == ["a", "2023"]
+
+
+def test_refresh_drops_removed_posts(tmp_path: Path) -> None:
+    """A post whose markdown file is gone leaves the catalog.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    md_path = _write_post(tmp_path, "one", "One")
+    _write_post(tmp_path, "two", "Two")
+    catalog = PostCatalog(tmp_path)
+    catalog.refresh()
+
+    md_path.unlink()
+
+    assert catalog.refresh() == {"one"}
+    assert [entry.post_id for entry in catalog.all_entries()] == ["two"]
+
+
+def test_catalog_is_kept_across_instances(tmp_path: Path) -> None:
+    """A new catalog reads the stored entries and parses nothing unchanged.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    _write_post(tmp_path, "one", "One")
+    PostCatalog(tmp_path).refresh()
+
+    catalog = PostCatalog(tmp_path)
+
+    assert not catalog.refresh()
+    assert [entry.title for entry in catalog.all_entries()] == ["One"]
+
+
+def test_non_list_frontmatter_is_ignored(tmp_path: Path) -> None:
+    """Tags and media names that are not lists are read as empty.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    _write_post(tmp_path, "one", "One", tags="not-a-list")
+    catalog = PostCatalog(tmp_path)
+    catalog.refresh()
+
+    entry = catalog.all_entries()[0]
+    assert not entry.tags
+    assert not entry.media_file_names
@@ -0,0 +1,88 @@
+"""Tests for minified pages and their precompressed copies."""
+import gzip
+
+from pathlib import Path
+
+import pytest
+
+from home_journal.compress import MIN_COMPRESS_SIZE
+from home_journal.compress import brotli_available
+from home_journal.compress import minify_html
+from home_journal.compress import sidecar_path
+from home_journal.compress import write_text_file
+
+
+# A page large enough to be worth compressing
+PAGE = "<html>\n  <body>\n" + "    <p>A day at the lake</p>\n" * 64 + "  </body>\n</html>\n"
+
+
+def test_minify_keeps_preformatted_text() -> None:
+    """Indentation and comments go, preformatted text and scripts stay."""
+    html = (
+        "<div>\n    <!-- note -->\n    <pre>  a\n    b</pre>\n"
+        "  <script>\n  x = 1;\n</script>\n</div>"
+    )
+
+    assert minify_html(html) == (
+        "<div>\n<pre>  a\n    b</pre>\n<script>\n  x = 1;\n</script>\n</div>\n"
+    )
+
+
+def test_pages_get_precompressed_copies(tmp_path: Path) -> None:
+    """A written page has a gzip copy of its minified content.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    path = tmp_path / "index.html"
+
+    assert write_text_file(path, PAGE)
+
+    assert gzip.decompress(sidecar_path(path, "gzip").read_bytes()) == path.read_bytes()
+    assert sidecar_path(path, "br").exists() == brotli_available()
+
+
+def test_small_files_are_not_compressed(tmp_path: Path) -> None:
+    """Files too small to benefit have no copies, and lose stale ones.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    path = tmp_path / "feed.json"
+    write_text_file(path, "x" * MIN_COMPRESS_SIZE * 2)
+    assert sidecar_path(path, "gzip").exists()
+
+    write_text_file(path, "{}")
+
+    assert not sidecar_path(path, "gzip").exists()
+    assert not sidecar_path(path, "br").exists()
+
+
+def test_unchanged_pages_are_not_rewritten(tmp_path: Path) -> None:
+    """Writing the same content again leaves the page and its copies alone.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    path = tmp_path / "index.html"
+    write_text_file(path, PAGE)
+    written = path.stat().st_mtime_ns, sidecar_path(path, "gzip").stat().st_mtime_ns
+
+    assert not write_text_file(path, PAGE)
+
+    assert (path.stat().st_mtime_ns, sidecar_path(path, "gzip").stat().st_mtime_ns) == written
+
+
+@pytest.mark.skipif(not brotli_available(), reason="brotli is not installed")
+def test_brotli_copies_decompress_to_the_page(tmp_path: Path) -> None:
+    """The brotli copy holds the same content as the page.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    brotli = pytest.importorskip("brotli")
+    path = tmp_path / "index.html"
+
+    write_text_file(path, PAGE)
+
+    assert brotli.decompress(sidecar_path(path, "br").read_bytes()) == path.read_bytes()
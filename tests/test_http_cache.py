@@ -0,0 +1,87 @@
+"""Tests for serving site files with cache headers and validators."""
+from pathlib import Path
+
+import pytest
+
+from flask.testing import FlaskClient
+
+from home_journal.compress import write_atomic
+from home_journal.http_cache import IMMUTABLE
+from home_journal.http_cache import REVALIDATE
+from home_journal.http_cache import cache_control
+from home_journal.run import app
+
+
+# A page of the test site
+PAGE = "posts/one/index.html"
+
+
+@pytest.fixture(name="client")
+def _client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FlaskClient:
+    """Serve a site with a single page.
+
+    Args:
+        tmp_path: A temporary directory.
+        monkeypatch: The pytest monkeypatch fixture.
+
+    Returns:
+        A test client of the app.
+    """
+    page = tmp_path / PAGE
+    page.parent.mkdir(parents=True)
+    page.write_text("<p>One</p>\n", encoding="utf-8")
+    monkeypatch.setitem(app.config, "site_dir", tmp_path)
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("index.html", REVALIDATE),
+        ("sw.js", REVALIDATE),
+        ("posts/one/media/video.mp4", REVALIDATE),
+        ("thumbs/0123.jpg", IMMUTABLE),
+        ("fonts/icons.woff2", IMMUTABLE),
+    ],
+)
+def test_cache_control_by_path(filename: str, expected: str) -> None:
+    """Files that can be replaced under the same name are revalidated.
+
+    Args:
+        filename: The path relative to the site directory.
+        expected: The Cache-Control header value.
+    """
+    assert cache_control(filename) == expected
+
+
+def test_conditional_get_is_not_modified(client: FlaskClient) -> None:
+    """A client with the current version gets an empty 304.
+
+    Args:
+        client: A test client of the app.
+    """
+    response = client.get(f"/{PAGE}")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == REVALIDATE
+
+    cached = client.get(f"/{PAGE}", headers={"If-None-Match": response.headers["ETag"]})
+
+    assert cached.status_code == 304
+    assert not cached.data
+
+
+def test_written_file_is_sent_again(client: FlaskClient, tmp_path: Path) -> None:
+    """A file written by the app is sent in full to a client with the old version.
+
+    Args:
+        client: A test client of the app.
+        tmp_path: A temporary directory.
+    """
+    etag = client.get(f"/{PAGE}").headers["ETag"]
+
+    write_atomic(tmp_path / PAGE, b"<p>One, edited at length</p>\n")
+    response = client.get(f"/{PAGE}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert b"edited" in response.data
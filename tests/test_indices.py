@@ -0,0 +1,204 @@
+"""Tests for the paginated listing pages."""
+
+# pylint: disable=protected-access
+import json
+
+from collections.abc import Callable
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+
+import pytest
+
+from home_journal import indices
+from home_journal.utils import ExistingPost
+
+
+# The number of posts on a page shard in these tests
+PAGE_SIZE = 3
+
+
+@pytest.fixture(name="written")
+def _written(monkeypatch: pytest.MonkeyPatch) -> list[Path]:
+    """Use small shards and record the pages that are written.
+
+    Args:
+        monkeypatch: The pytest monkeypatch fixture.
+
+    Returns:
+        The paths written, in order.
+    """
+    paths: list[Path] = []
+    write_page = indices._write_page
+
+    def record(site_dir: Path, path: Path, page_signature: str, render: Callable[[], str]) -> bool:
+        """Write a page and record it if it was written.
+
+        Args:
+            site_dir: The directory of the site.
+            path: The page path.
+            page_signature: The signature of the page inputs.
+            render: Produces the page content.
+
+        Returns:
+            True if the page was written.
+        """
+        written = write_page(site_dir, path, page_signature, render)
+        if written:
+            paths.append(path)
+        return written
+
+    monkeypatch.setattr(indices, "INDEX_PAGE_SIZE", PAGE_SIZE)
+    monkeypatch.setattr(indices, "_write_page", record)
+    return paths
+
+
+def _posts(site_dir: Path, count: int) -> list[ExistingPost]:
+    """Create posts a day apart.
+
+    Args:
+        site_dir: The directory of the site.
+        count: The number of posts.
+
+    Returns:
+        The posts, ordered chronologically.
+    """
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    return [
+        ExistingPost(
+            date=start + timedelta(days=idx),
+            fs_post_directory=site_dir / "posts" / f"post{idx}",
+            md_content="",
+            post_id=f"post{idx}",
+            post_url=Path(f"/posts/post{idx}/index.html"),
+            tags=[],
+            title=f"Post {idx}",
+        )
+        for idx in range(count)
+    ]
+
+
+def _write(site_dir: Path, posts: list[ExistingPost]) -> set[Path]:
+    """Write the index listing.
+
+    Args:
+        site_dir: The directory of the site.
+        posts: The posts, ordered chronologically.
+
+    Returns:
+        Every page and feed path of the listing.
+    """
+    listing = indices._Listing(site_dir, site_dir / "index.html", "everything", None)
+    return listing.write(posts)
+
+
+def _feed(path: Path) -> dict[str, object]:
+    """Read a page feed.
+
+    Args:
+        path: The feed path.
+
+    Returns:
+        The feed.
+    """
+    return dict(json.loads(path.read_text(encoding="utf-8")))
+
+
+def _titles(path: Path) -> list[str]:
+    """Read the post titles of a page.
+
+    Args:
+        path: The page path.
+
+    Returns:
+        The titles, as shown.
+    """
+    content = path.read_text(encoding="utf-8")
+    return [part.split("</h6>")[0] for part in content.split("<h6>")[1:]]
+
+
+@pytest.mark.usefixtures("written")
+def test_first_page_is_a_full_page(tmp_path: Path) -> None:
+    """The first page holds the newest full shard and the posts after it.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    paths = _write(tmp_path, _posts(tmp_path, 8))
+
+    page_dir = tmp_path / "page"
+    assert paths == {tmp_path / "index.html", page_dir / "1.html", page_dir / "1.json"}
+    assert _titles(tmp_path / "index.html") == [f"Post {idx}" for idx in (7, 6, 5, 4, 3)]
+    assert _titles(page_dir / "1.html") == ["Post 2", "Post 1", "Post 0"]
+    feed = _feed(page_dir / "1.json")
+    assert feed["older"] is None
+    assert [str(post["title"]) for post in feed["posts"]] == ["Post 2", "Post 1", "Post 0"]
+
+
+@pytest.mark.usefixtures("written")
+def test_full_newest_shard_is_the_first_page(tmp_path: Path) -> None:
+    """When the newest shard is full it is the first page on its own.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    paths = _write(tmp_path, _posts(tmp_path, 9))
+
+    page_dir = tmp_path / "page"
+    assert sorted(path.name for path in paths if path.parent == page_dir) == [
+        "1.html",
+        "1.json",
+        "2.html",
+        "2.json",
+    ]
+    assert _titles(tmp_path / "index.html") == ["Post 8", "Post 7", "Post 6"]
+    assert _titles(page_dir / "2.html") == ["Post 5", "Post 4", "Post 3"]
+    assert _feed(page_dir / "2.json")["older"] == "/page/1.json"
+    assert 'data-feed="/page/2.json"' in (tmp_path / "index.html").read_text(encoding="utf-8")
+
+
+@pytest.mark.usefixtures("written")
+def test_few_posts_fit_the_first_page(tmp_path: Path) -> None:
+    """A listing shorter than a shard is a single page with no feed.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    paths = _write(tmp_path, _posts(tmp_path, 2))
+
+    assert paths == {tmp_path / "index.html"}
+    assert _titles(tmp_path / "index.html") == ["Post 1", "Post 0"]
+
+
+def test_new_post_rewrites_only_the_first_page(tmp_path: Path, written: list[Path]) -> None:
+    """Adding a post leaves the older pages and their feeds alone.
+
+    Args:
+        tmp_path: A temporary directory.
+        written: The paths written.
+    """
+    posts = _posts(tmp_path, 9)
+    _write(tmp_path, posts[:7])
+    written.clear()
+
+    _write(tmp_path, posts[:8])
+
+    assert written == [tmp_path / "index.html"]
+
+
+def test_edited_post_rewrites_only_its_page(tmp_path: Path, written: list[Path]) -> None:
+    """Editing an older post rewrites its page and feed only.
+
+    Args:
+        tmp_path: A temporary directory.
+        written: The paths written.
+    """
+    posts = _posts(tmp_path, 10)
+    _write(tmp_path, posts)
+    written.clear()
+
+    posts[4].title = "Edited"
+    _write(tmp_path, posts)
+
+    assert sorted(written) == [tmp_path / "page" / "2.html", tmp_path / "page" / "2.json"]
@@ -0,0 +1,51 @@
+"""Tests for copying part of an uploaded file."""
+import errno
+import os
+
+from pathlib import Path
+
+import pytest
+
+from home_journal import ingest
+from home_journal.ingest import copy_range
+
+
+# Content longer than the copy buffer in the tests
+CONTENT = bytes(range(256)) * 64
+
+
+def _unsupported(*_args: object) -> int:
+    """Fail like a kernel copy across file systems.
+
+    Args:
+        _args: The copy arguments.
+
+    Raises:
+        OSError: Always.
+    """
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+
+@pytest.mark.parametrize("kernel", [True, False], ids=["kernel", "buffered"])
+def test_copy_range_copies_exactly_the_range(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, kernel: bool
+) -> None:
+    """Only the requested bytes are copied, however the copy is done.
+
+    Args:
+        tmp_path: A temporary directory.
+        monkeypatch: The pytest monkeypatch fixture.
+        kernel: Whether the kernel copy is supported.
+    """
+    if not kernel:
+        monkeypatch.setattr(os, "copy_file_range", _unsupported, raising=False)
+        monkeypatch.setattr(os, "sendfile", _unsupported)
+    monkeypatch.setattr(ingest, "COPY_CHUNK_SIZE", 1000)
+    source = tmp_path / "motion.jpg"
+    source.write_bytes(CONTENT)
+    target = tmp_path / "motion.mp4"
+    target.write_bytes(b"stale content longer than nothing")
+
+    copy_range(source, target, 100, 5000)
+
+    assert target.read_bytes() == CONTENT[100:5100]
@@ -0,0 +1,126 @@
+"""Tests for the durable background job queue."""
+import threading
+import time
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from home_journal.jobs import Job
+from home_journal.jobs import JobQueue
+
+
+# Seconds to wait for a job to finish
+TIMEOUT = 10.0
+
+
+def _wait(jobs: JobQueue, job_id: str) -> Job:
+    """Wait for a job to finish.
+
+    Args:
+        jobs: The job queue.
+        job_id: The job id.
+
+    Returns:
+        The finished job.
+
+    Raises:
+        AssertionError: If the job did not finish in time.
+    """
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        job = jobs.status(job_id)
+        if job is not None and job.finished is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_jobs_run_with_their_arguments(tmp_path: Path) -> None:
+    """A submitted job runs its handler and is recorded as done.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    calls: list[tuple[Path, dict[str, Any]]] = []
+    jobs = JobQueue(tmp_path, {"record": lambda site_dir, args: calls.append((site_dir, args))})
+    jobs.start()
+
+    job = _wait(jobs, jobs.submit("record", {"post": "one"}).job_id)
+
+    assert job.state == "done"
+    assert calls == [(tmp_path, {"post": "one"})]
+    assert not jobs.unfinished("record")
+
+
+def test_failed_jobs_record_the_error(tmp_path: Path) -> None:
+    """A handler that raises leaves the job failed with the error message.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+
+    def fail(_site_dir: Path, _args: dict[str, Any]) -> None:
+        """Fail.
+
+        Args:
+            _site_dir: The directory of the site.
+            _args: The job arguments.
+
+        Raises:
+            RuntimeError: Always.
+        """
+        raise RuntimeError("no space left")
+
+    jobs = JobQueue(tmp_path, {"fail": fail})
+    jobs.start()
+
+    job = _wait(jobs, jobs.submit("fail", {}).job_id)
+
+    assert job.state == "failed"
+    assert job.error == "no space left"
+
+
+def test_unknown_kinds_are_refused(tmp_path: Path) -> None:
+    """Jobs without a handler are not queued.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    jobs = JobQueue(tmp_path, {})
+
+    with pytest.raises(ValueError, match="No handler"):
+        jobs.submit("missing", {})
+
+
+def test_queue_is_full_at_the_limit(tmp_path: Path) -> None:
+    """The queue reports itself full once enough jobs are waiting.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    jobs = JobQueue(tmp_path, {"wait": lambda _site_dir, _args: None}, max_pending=2)
+
+    jobs.submit("wait", {})
+    assert not jobs.full()
+    jobs.submit("wait", {})
+    assert jobs.full()
+    assert jobs.depth == 2
+
+
+def test_queued_jobs_survive_a_restart(tmp_path: Path) -> None:
+    """Jobs queued by a previous process run when the queue starts again.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    job_id = (
+        JobQueue(tmp_path, {"record": lambda _site_dir, _args: None}).submit("record", {}).job_id
+    )
+    ran = threading.Event()
+    jobs = JobQueue(tmp_path, {"record": lambda _site_dir, _args: ran.set()})
+    jobs.start()
+
+    assert _wait(jobs, job_id).state == "done"
+    assert ran.is_set()
@@ -0,0 +1,139 @@
+"""Tests for the content addressed media store."""
+import os
+import time
+
+from pathlib import Path
+
+import pytest
+
+from home_journal.media_store import PRUNE_GRACE_SECONDS
+from home_journal.media_store import MediaStore
+
+
+def _media(site_dir: Path, post_id: str, content: bytes) -> Path:
+    """Write a post media file.
+
+    Args:
+        site_dir: The directory of the site.
+        post_id: The id of the post.
+        content: The file content.
+
+    Returns:
+        The media file.
+    """
+    path = site_dir / "posts" / post_id / "media" / "photo.jpg"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def _age(path: Path) -> None:
+    """Make a stored file older than the prune grace period.
+
+    Args:
+        path: The stored file.
+    """
+    old = time.time() - 2 * PRUNE_GRACE_SECONDS
+    os.utime(path, (old, old))
+
+
+def _no_hardlinks(_src: object, _dst: object) -> None:
+    """Refuse to hardlink, as some file systems do.
+
+    Args:
+        _src: The link target.
+        _dst: The link path.
+
+    Raises:
+        OSError: Always.
+    """
+    raise OSError("hardlinks not supported")
+
+
+def test_duplicates_are_stored_once(tmp_path: Path) -> None:
+    """An identical upload is linked to the stored copy.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    store = MediaStore(tmp_path)
+    first = _media(tmp_path, "one", b"photo")
+    second = _media(tmp_path, "two", b"photo")
+
+    digest = store.add(first, "image/jpeg")
+
+    assert store.add(second) == digest
+    assert first.samefile(second)
+    assert len(list(store.objects_dir.glob("*/*"))) == 1
+    assert store.mime_types([second]) == {"photo.jpg": "image/jpeg"}
+
+
+def test_prune_removes_unused_files(tmp_path: Path) -> None:
+    """Stored files no post uses are removed once past the grace period.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    path = _media(tmp_path, "one", b"photo")
+    digest = MediaStore(tmp_path).add(path, "image/jpeg")
+    path.unlink()
+    _age(MediaStore(tmp_path).object_path(digest))
+
+    store = MediaStore(tmp_path)
+    assert not store.prune([])
+
+    assert not store.object_path(digest).exists()
+    assert not store.types
+
+
+def test_prune_keeps_files_of_posts_being_written(tmp_path: Path) -> None:
+    """A file stored after the media was listed survives the prune.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    store = MediaStore(tmp_path)
+    listed: list[Path] = []
+    digest = store.add(_media(tmp_path, "new", b"photo"), "image/jpeg")
+
+    assert store.prune(listed) == {digest}
+
+    assert store.object_path(digest).exists()
+    assert store.types == {digest: "image/jpeg"}
+
+
+def test_prune_keeps_new_files_of_other_processes(tmp_path: Path) -> None:
+    """A recently stored file is kept even if this process did not store it.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    path = _media(tmp_path, "new", b"photo")
+    digest = MediaStore(tmp_path).add(path, "image/jpeg")
+    path.unlink()
+
+    MediaStore(tmp_path).prune([])
+
+    assert MediaStore(tmp_path).object_path(digest).exists()
+
+
+def test_prune_keeps_symlinked_duplicates(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A duplicate linked by symlink is kept though its stored file has one link.
+
+    Args:
+        tmp_path: A temporary directory.
+        monkeypatch: The pytest monkeypatch fixture.
+    """
+    monkeypatch.setattr(os, "link", _no_hardlinks)
+    path = _media(tmp_path, "one", b"photo")
+    digest = MediaStore(tmp_path).add(path)
+    path.unlink()
+    store = MediaStore(tmp_path)
+    _age(store.object_path(digest))
+
+    duplicate = _media(tmp_path, "new", b"photo")
+    store.add(duplicate)
+    store.prune([])
+
+    assert duplicate.is_symlink()
+    assert duplicate.read_bytes() == b"photo"
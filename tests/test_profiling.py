@@ -0,0 +1,101 @@
+"""Tests for profiles named by the size of the site."""
+import argparse
+
+from pathlib import Path
+
+from home_journal.benchmark.generate import SiteSpec
+from home_journal.benchmark.generate import generate_site
+from home_journal.build import initialize_site
+from home_journal.cli import _build
+from home_journal.profiling import PROFILE_SUFFIX
+from home_journal.profiling import SNAPSHOT_SUFFIX
+from home_journal.profiling import Profiler
+from home_journal.profiling import use_profiler
+from home_journal.utils import load_posts
+
+
+# The number of posts in the test site
+POSTS = 3
+
+
+def _site(tmp_path: Path) -> Path:
+    """Create a site with posts that were never cataloged.
+
+    Args:
+        tmp_path: A temporary directory.
+
+    Returns:
+        The directory of the site.
+    """
+    site_dir = tmp_path / "site"
+    initialize_site(site_dir)
+    generate_site(site_dir, SiteSpec(posts=POSTS, image_ratio=0, video_ratio=0))
+    return site_dir
+
+
+def test_build_profile_counts_posts(tmp_path: Path) -> None:
+    """The build profile and snapshots carry the post count of a fresh site.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    site_dir = _site(tmp_path)
+    args = argparse.Namespace(
+        ffmpeg_jobs=1, jobs=1, profile_dir="profiles", site_directory=str(site_dir)
+    )
+    try:
+        _build(args)
+    finally:
+        use_profiler(None)
+
+    profiles = list((site_dir / "profiles").glob(f"*{PROFILE_SUFFIX}"))
+    assert len(profiles) == 1
+    assert profiles[0].name.endswith(f"-build-{POSTS}-posts{PROFILE_SUFFIX}")
+    snapshots = list((site_dir / "profiles").glob(f"*{SNAPSHOT_SUFFIX}"))
+    assert snapshots
+    assert all(path.stem.endswith(f"-{POSTS}-posts") for path in snapshots)
+
+
+def test_load_posts_snapshots_count_posts(tmp_path: Path) -> None:
+    """The snapshots of loading the posts carry the post count of a fresh site.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    site_dir = _site(tmp_path)
+    profiler = Profiler(tmp_path / "profiles")
+    profiler.enable()
+    use_profiler(profiler)
+    try:
+        load_posts(site_dir)
+    finally:
+        profiler.disable()
+        use_profiler(None)
+
+    # Named by the time they were taken, then by what was measured
+    snapshots = {path.name.split("-", 1)[1] for path in profiler.profile_dir.iterdir()}
+    assert snapshots == {
+        f"populate-post-metadata-before-{POSTS}-posts{SNAPSHOT_SUFFIX}",
+        f"populate-post-metadata-after-{POSTS}-posts{SNAPSHOT_SUFFIX}",
+    }
+
+
+def test_memory_counts_posts_after_the_block(tmp_path: Path) -> None:
+    """A post count function is read once the measured code ran.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    profiler = Profiler(tmp_path / "profiles")
+    profiler.enable()
+    posts: list[str] = []
+    try:
+        with profiler.memory("load", lambda: len(posts)):
+            posts.extend(["one", "two"])
+    finally:
+        profiler.disable()
+
+    assert sorted(path.name.split("-", 1)[1] for path in profiler.profile_dir.iterdir()) == [
+        f"load-after-2-posts{SNAPSHOT_SUFFIX}",
+        f"load-before-2-posts{SNAPSHOT_SUFFIX}",
+    ]
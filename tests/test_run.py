@@ -0,0 +1,42 @@
+"""Tests for the post submission endpoints."""
+from pathlib import Path
+
+import pytest
+
+from home_journal.jobs import JobQueue
+from home_journal.run import RETRY_AFTER_SECONDS
+from home_journal.run import app
+
+
+@pytest.fixture(name="busy_site")
+def _busy_site(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Serve a site whose job queue is full.
+
+    Args:
+        tmp_path: A temporary directory.
+        monkeypatch: The pytest monkeypatch fixture.
+
+    Returns:
+        The directory of the site.
+    """
+    jobs = JobQueue(tmp_path, {"process_post": lambda _site_dir, _args: None}, max_pending=1)
+    jobs.submit("process_post", {})
+    monkeypatch.setitem(app.config, "authors", ["Someone"])
+    monkeypatch.setitem(app.config, "jobs", jobs)
+    monkeypatch.setitem(app.config, "site_dir", tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("path", ["/", "/edit"])
+def test_full_queue_rejects_submissions(busy_site: Path, path: str) -> None:
+    """Posts and edits are refused with Retry-After before the form is checked.
+
+    Args:
+        busy_site: The directory of the site.
+        path: The submission URL.
+    """
+    response = app.test_client().post(path, data={"author": "Nobody", "passcode": "wrong"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(RETRY_AFTER_SECONDS)
+    assert not (busy_site / "posts").exists()
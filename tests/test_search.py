@@ -0,0 +1,133 @@
+"""Tests for the full-text search index."""
+import os
+import shutil
+
+from pathlib import Path
+
+from home_journal.search import SearchIndex
+
+
+def _write_post(site_dir: Path, post_id: str, title: str, body: str) -> Path:
+    """Write a post markdown file.
+
+    Args:
+        site_dir: The directory of the site.
+        post_id: The id of the post.
+        title: The title of the post.
+        body: The markdown body of the post.
+
+    Returns:
+        The post directory.
+    """
+    post_dir = site_dir / "posts" / post_id
+    post_dir.mkdir(parents=True, exist_ok=True)
+    md_path = post_dir / "post.md"
+    previous = md_path.stat().st_mtime_ns if md_path.exists() else 0
+    md_path.write_text(
+        f"---\ndate: '2023-01-02 03:04:05'\ntitle: {title}\ntags: []\n---\n{body}\n",
+        encoding="utf-8",
+    )
+    # Edits are seen by their stat data, so make sure it moves
+    stat = md_path.stat()
+    os.utime(md_path, ns=(stat.st_atime_ns, max(stat.st_mtime_ns, previous + 1_000_000_000)))
+    return post_dir
+
+
+def _hits(index: SearchIndex, query: str) -> list[str]:
+    """Search and keep the post ids.
+
+    Args:
+        index: The search index.
+        query: The search string.
+
+    Returns:
+        The ids of the matching posts, best first.
+    """
+    return [hit.post_id for hit in index.search(query)]
+
+
+def test_update_indexes_new_post(tmp_path: Path) -> None:
+    """A new post is searchable once updated and its document is stored.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    index = SearchIndex(tmp_path)
+    assert not _hits(index, "garden")
+
+    post_dir = _write_post(tmp_path, "one", "Spring", "Planting the garden")
+    index.update([post_dir])
+
+    assert _hits(index, "garden") == ["one"]
+    assert (index.doc_dir / "one.json").is_file()
+    assert _hits(SearchIndex(tmp_path), "garden") == ["one"]
+
+
+def test_update_reindexes_edited_post(tmp_path: Path) -> None:
+    """An edited post matches its new words only.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    post_dir = _write_post(tmp_path, "one", "Spring", "Planting the garden")
+    index = SearchIndex(tmp_path)
+    index.update([post_dir])
+
+    _write_post(tmp_path, "one", "Autumn", "Raking the leaves")
+    index.update([post_dir])
+
+    assert not _hits(index, "garden")
+    assert _hits(index, "autumn leaves") == ["one"]
+
+
+def test_update_drops_deleted_post(tmp_path: Path) -> None:
+    """A deleted post leaves the index and its document is removed.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    post_dir = _write_post(tmp_path, "one", "Spring", "Planting the garden")
+    _write_post(tmp_path, "two", "Summer", "Watering the garden")
+    index = SearchIndex(tmp_path)
+    index.update([post_dir])
+    assert sorted(_hits(index, "garden")) == ["one", "two"]
+
+    shutil.rmtree(post_dir)
+    index.update([post_dir])
+
+    assert _hits(index, "garden") == ["two"]
+    assert not (index.doc_dir / "one.json").exists()
+
+
+def test_update_writes_only_changed_documents(tmp_path: Path) -> None:
+    """Updating one post leaves the stored documents of the others alone.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    _write_post(tmp_path, "one", "Spring", "Planting the garden")
+    post_dir = _write_post(tmp_path, "two", "Summer", "Watering the garden")
+    index = SearchIndex(tmp_path)
+    index.search("garden")
+    untouched = (index.doc_dir / "one.json").stat().st_mtime_ns
+
+    _write_post(tmp_path, "two", "Summer", "Weeding the garden")
+    index.update([post_dir])
+
+    assert (index.doc_dir / "one.json").stat().st_mtime_ns == untouched
+    assert _hits(index, "weeding") == ["two"]
+
+
+def test_snippet_escapes_post_text(tmp_path: Path) -> None:
+    """Snippets escape the post text and highlight only the matches.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    post_dir = _write_post(tmp_path, "one", "Code", 'Fish & chips, then `"x" < y` for dinner')
+    index = SearchIndex(tmp_path)
+    index.update([post_dir])
+
+    (hit,) = index.search("chips")
+
+    assert hit.snippet == "Fish &amp; <mark>chips</mark>, then &quot;x&quot; &lt; y for dinner"
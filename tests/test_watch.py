@@ -0,0 +1,103 @@
+"""Tests for watching the posts directory for changes."""
+
+# pylint: disable=protected-access
+import queue
+import time
+
+from pathlib import Path
+
+import pytest
+
+from home_journal.videos import POSTER_PREFIX
+from home_journal.watch import PostWatcher
+from home_journal.watch import inotify_available
+
+
+pytestmark = pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+
+# Seconds to wait for the watcher
+TIMEOUT = 5.0
+
+
+def _watch(site_dir: Path) -> "queue.Queue[set[Path]]":
+    """Start watching the posts of a site.
+
+    Args:
+        site_dir: The directory of the site.
+
+    Returns:
+        The changed post directories, one set per report.
+
+    Raises:
+        AssertionError: If the watcher did not start in time.
+    """
+    reports: "queue.Queue[set[Path]]" = queue.Queue()
+    watcher = PostWatcher(site_dir, reports.put, debounce=0.2, max_delay=2.0)
+    watcher.start()
+    deadline = time.monotonic() + TIMEOUT
+    while not watcher._dirs:
+        if time.monotonic() > deadline:
+            raise AssertionError("The watcher did not start")
+        time.sleep(0.01)
+    return reports
+
+
+def _post(site_dir: Path, post_id: str) -> Path:
+    """Write a post.
+
+    Args:
+        site_dir: The directory of the site.
+        post_id: The id of the post.
+
+    Returns:
+        The post directory.
+    """
+    post_dir = site_dir / "posts" / post_id
+    (post_dir / "media").mkdir(parents=True, exist_ok=True)
+    (post_dir / "post.md").write_text("---\ntitle: A post\n---\n", encoding="utf-8")
+    return post_dir
+
+
+def test_new_posts_are_reported_together(tmp_path: Path) -> None:
+    """Posts copied in at once are reported in a single batch.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    reports = _watch(tmp_path)
+
+    post_dirs = {_post(tmp_path, f"post{idx}") for idx in range(3)}
+
+    assert reports.get(timeout=TIMEOUT) == post_dirs
+
+
+def test_edits_and_media_are_reported(tmp_path: Path) -> None:
+    """Editing a post or adding media reports the post.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    post_dir = _post(tmp_path, "one")
+    reports = _watch(tmp_path)
+
+    (post_dir / "post.md").write_text("---\ntitle: Edited\n---\n", encoding="utf-8")
+    assert reports.get(timeout=TIMEOUT) == {post_dir}
+
+    (post_dir / "media" / "photo.jpg").write_bytes(b"photo")
+    assert reports.get(timeout=TIMEOUT) == {post_dir}
+
+
+def test_files_written_by_the_app_are_ignored(tmp_path: Path) -> None:
+    """Derived media and hidden temporary files do not report the post.
+
+    Args:
+        tmp_path: A temporary directory.
+    """
+    post_dir = _post(tmp_path, "one")
+    reports = _watch(tmp_path)
+
+    (post_dir / "media" / f"{POSTER_PREFIX}video.jpg").write_bytes(b"poster")
+    (post_dir / ".post.md.tmp").write_text("draft", encoding="utf-8")
+
+    with pytest.raises(queue.Empty):
+        reports.get(timeout=1.0)